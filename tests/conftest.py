@@ -0,0 +1,99 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import FakeCalendarHttp
+import json
+import os
+import pytest
+
+BENCHMARK_BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baselines.json')
+
+# The events created from golden.csv for a race day of 2022-10-15
+GOLDEN_EVENTS = [
+    ('2022-10-11', 'Test0'), ('2022-10-12', 'Test1'), ('2022-10-13', 'Test2'),
+    ('2022-10-14', 'Test3'), ('2022-10-15', 'RACE DAY'), ('2022-10-16', 'Test5')]
+
+def get_test_file(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+# A FakeCalendarHttp that the command line talks to (through run_main), without sleeping
+# between retries
+@pytest.fixture
+def fake(monkeypatch, tmp_path):
+    http = FakeCalendarHttp()
+    service = http.build_service()
+    monkeypatch.setattr(sut, 'get_calendar_service', lambda *args: service)
+    monkeypatch.setattr(sut.time, 'sleep', lambda s: None)
+    http.cache_dir = str(tmp_path / 'cache')
+    return http
+
+def run_main(fake, *args):
+    sut.main(list(args) + ['--cache-dir', fake.cache_dir])
+
+def pytest_addoption(parser):
+    parser.addoption('--run-benchmarks', action='store_true', default=False,
+                     help='run the (slow) throughput benchmarks in addition to the tests')
+    parser.addoption('--update-benchmark-baselines', action='store_true', default=False,
+                     help='record the benchmarks\' results as the baselines later runs are checked against')
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: slow throughput benchmark, only run with --run-benchmarks')
+    config.benchmark_results = []
+    config.benchmark_baselines = {}
+    if os.path.exists(BENCHMARK_BASELINES_FILE):
+        with open(BENCHMARK_BASELINES_FILE) as f:
+            config.benchmark_baselines = json.load(f)
+    config.benchmark_baselines_updated = False
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-benchmarks'):
+        return
+    skip = pytest.mark.skip(reason='benchmarks only run with --run-benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+@pytest.fixture
+def benchmark_results(request):
+    return request.config.benchmark_results
+
+# Returns a function that checks a benchmark's measurements against the stored baseline of
+# the same name (or, with --update-benchmark-baselines, stores them as the new baseline).
+# Each measurement fails the benchmark if it's over its baseline by more than its tolerance.
+@pytest.fixture
+def check_baseline(request):
+    config = request.config
+    def check(name, measurements, tolerances):
+        if config.getoption('--update-benchmark-baselines'):
+            config.benchmark_baselines[name] = measurements
+            config.benchmark_baselines_updated = True
+            return
+        baseline = config.benchmark_baselines.get(name)
+        if baseline is None:
+            pytest.fail('no baseline for {}; record one with --update-benchmark-baselines'.format(name))
+        regressions = ['{} is {:.4g} (baseline {:.4g}, tolerance {:.0%})'.format(k, v, baseline[k], tolerances[k] - 1)
+            for (k,v) in measurements.items() if v > baseline[k] * tolerances[k]]
+        assert not regressions, '{} regressed: {}'.format(name, '; '.join(regressions))
+    return check
+
+def pytest_sessionfinish(session):
+    config = session.config
+    if config.benchmark_baselines_updated:
+        with open(BENCHMARK_BASELINES_FILE, 'w') as f:
+            json.dump(config.benchmark_baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = config.benchmark_results
+    if not results:
+        return
+    terminalreporter.section('benchmark results')
+    # Benchmarks report different columns, so there's a table for each set of columns
+    tables = {}
+    for result in results:
+        tables.setdefault(tuple(result), []).append(result)
+    for columns, rows in tables.items():
+        terminalreporter.write_line(''.join('{:>14}'.format(c) for c in columns))
+        for result in rows:
+            terminalreporter.write_line(''.join(
+                '{:>14.2f}'.format(result[c]) if isinstance(result[c], float) else '{:>14}'.format(result[c])
+                for c in columns))
+        terminalreporter.write_line('')
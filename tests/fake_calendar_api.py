@@ -0,0 +1,419 @@
+# In-process stand-in for the parts of the Google Calendar v3 API that training_calendar
+# uses. FakeCalendarHttp takes the place of the httplib2.Http under a real discovery-built
+# service, so requests go through googleapiclient exactly as they would against Google:
+#
+#   http = FakeCalendarHttp(latency=0.05, qps=10)
+#   service = http.build_service()
+#
+# It supports calendarList.list, calendars.insert/delete, events.list/insert/patch/delete
+# (with paging, sync tokens, q, timeMin/timeMax & private extended property filters, and
+# partial responses with `fields=`) and the batch endpoint, with configurable latency, a queries-per-second quota & injected
+# errors. Every HTTP request is timed, so benchmarks can report call latencies.
+
+from email.parser import Parser
+import copy
+import datetime
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+import httplib2
+from googleapiclient.discovery import build
+
+API_PREFIX = '/calendar/v3'
+BATCH_PATH = '/batch/calendar/v3'
+MAX_BATCH_SIZE = 50
+MAX_EVENTS_PAGE_SIZE = 2500
+MAX_CALENDARS_PAGE_SIZE = 250
+
+class FakeApiError(Exception):
+    def __init__(self, status, message, reason=None, headers=None):
+        self.status = status
+        self.message = message
+        self.reason = reason or 'backendError'
+        self.headers = headers or {}
+
+class FakeCalendarHttp:
+    # latency: seconds each HTTP request takes (a number, or a function of the request count)
+    # latency_per_item: extra seconds per sub-request of a batch
+    # qps: queries per second allowed before requests fail with 403 rateLimitExceeded;
+    #   each sub-request of a batch counts as a query
+    # error_rate: fraction of queries that fail with a 503
+    # errors: list of (status, reason) errors handed out, in order, to the next queries
+    # event_errors: dict of event summary -> list of (status, reason) errors handed out, in
+    #   order, to the inserts of that event
+    def __init__(self, latency=0, latency_per_item=0, qps=None, error_rate=0, errors=None, event_errors=None, seed=0, account='user@example.com'):
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.qps = qps
+        self.error_rate = error_rate
+        self.errors = list(errors or [])
+        self.event_errors = { k: list(v) for (k,v) in (event_errors or {}).items() }
+        self.random = random.Random(seed)
+        self.account = account
+        self.expire_sync_tokens = False
+
+        self.lock = threading.RLock()
+        self.seq = itertools.count(1)
+        self.calendars = {}
+        self.events = {}
+        self.calendar_list_seq = {}
+        self.add_calendar(account, primary=True)
+
+        self.quota_tokens = qps
+        self.quota_refilled = time.monotonic()
+        self.request_count = 0
+        self.query_count = 0
+        self.rate_limited_count = 0
+        self.method_counts = {}
+        self.calls = []
+        self.latencies = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def build_service(self):
+        return build('calendar', 'v3', http=self, static_discovery=True)
+
+    ######## Test setup helpers ########
+
+    def add_calendar(self, summary, primary=False, calendar_id=None):
+        with self.lock:
+            calendar_id = calendar_id or (summary if primary else '{}@group.calendar.google.com'.format(uuid.uuid4().hex))
+            self.calendars[calendar_id] = {
+                'kind': 'calendar#calendarListEntry', 'id': calendar_id, 'summary': summary,
+                'timeZone': 'America/Chicago', 'accessRole': 'owner', 'primary': primary,
+                'etag': '"{}"'.format(next(self.seq)),
+            }
+            self.calendar_list_seq[calendar_id] = next(self.seq)
+            self.events[calendar_id] = {}
+            return calendar_id
+
+    def add_events(self, calendar_id, events):
+        with self.lock:
+            return [self.insert_event(calendar_id, dict(e)) for e in events]
+
+    def get_events(self, calendar_id, include_cancelled=False):
+        with self.lock:
+            events = [copy.deepcopy(e) for e in self.events[calendar_id].values()
+                if include_cancelled or e['status'] != 'cancelled']
+        return sorted(events, key=get_start)
+
+    def calendar_id(self, summary):
+        with self.lock:
+            for c in self.calendars.values():
+                if c['summary'] == summary and not c.get('deleted'):
+                    return c['id']
+        return None
+
+    # The query parameters of each call of a method (as named in method_counts), in order
+    def get_calls(self, name):
+        with self.lock:
+            return [params for (n, params) in self.calls if n == name]
+
+    def latency_percentile(self, p):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies)-1, int(round(p / 100.0 * (len(latencies)-1))))]
+
+    ######## httplib2.Http interface ########
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        started = time.monotonic()
+        with self.lock:
+            self.request_count += 1
+            request_count = self.request_count
+            if body:
+                self.bytes_sent += len(body.encode('utf-8') if isinstance(body, str) else body)
+
+        parsed = urllib.parse.urlparse(uri)
+        if parsed.path == BATCH_PATH:
+            status, resp_headers, content = self.handle_batch(body, (headers or {}).get('content-type', ''))
+            num_items = content.count('Content-ID:')
+        else:
+            status, resp_headers, content = self.handle(method, parsed.path, parsed.query, body)
+            num_items = 0
+
+        latency = self.latency(request_count) if callable(self.latency) else self.latency
+        time.sleep(latency + self.latency_per_item * num_items)
+
+        content = content.encode('utf-8')
+        resp = httplib2.Response(dict(resp_headers, status=status))
+        with self.lock:
+            self.bytes_received += len(content)
+            self.latencies.append(time.monotonic() - started)
+        return resp, content
+
+    def close(self):
+        pass
+
+    ######## Request handling ########
+
+    def handle_batch(self, body, content_type):
+        boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1)
+        message = Parser().parsestr('Content-Type: {}\r\n\r\n{}'.format(content_type, body))
+        parts = message.get_payload()
+        if len(parts) > MAX_BATCH_SIZE:
+            return self.error_response(FakeApiError(400, 'Too many requests in batch', 'invalid'))
+
+        response_boundary = 'batch_{}'.format(uuid.uuid4().hex)
+        out = []
+        for part in parts:
+            payload = part.get_payload()
+            request_line, rest = payload.split('\n', 1)
+            method, path_and_query, _ = request_line.strip().split(' ', 2)
+            sub_body = rest.split('\r\n\r\n', 1)[1] if '\r\n\r\n' in rest else rest.split('\n\n', 1)[-1]
+            path, _, query = path_and_query.partition('?')
+            status, _, content = self.handle(method, path, query, sub_body or None)
+            out.append('--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}\r\n\r\n'
+                'HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n{}\r\n'.format(
+                response_boundary, part['Content-ID'][1:], status, STATUS_TEXT.get(status, 'Error'), content))
+        out.append('--{}--'.format(response_boundary))
+        return 200, { 'content-type': 'multipart/mixed; boundary={}'.format(response_boundary) }, ''.join(out)
+
+    def handle(self, method, path, query, body):
+        params = urllib.parse.parse_qs(query)
+        try:
+            self.take_quota()
+            result = self.dispatch(method, path, params, json.loads(body) if body else None)
+            if result is None:
+                return 204, {}, ''
+            fields = get_param(params, 'fields')
+            if fields:
+                result = project(result, parse_fields(fields))
+            return 200, { 'content-type': 'application/json; charset=UTF-8' }, json.dumps(result)
+        except FakeApiError as e:
+            return self.error_response(e)
+
+    def error_response(self, e):
+        content = json.dumps({ 'error': {
+            'code': e.status, 'message': e.message,
+            'errors': [{ 'domain': 'global', 'reason': e.reason, 'message': e.message }] } })
+        return e.status, dict(e.headers, **{ 'content-type': 'application/json; charset=UTF-8' }), content
+
+    def take_quota(self):
+        with self.lock:
+            self.query_count += 1
+            if self.errors:
+                status, reason = self.errors.pop(0)
+                raise FakeApiError(status, 'Injected error', reason)
+            if self.error_rate and self.random.random() < self.error_rate:
+                raise FakeApiError(503, 'The service is currently unavailable.', 'backendError')
+            if self.qps:
+                now = time.monotonic()
+                self.quota_tokens = min(self.qps, self.quota_tokens + (now - self.quota_refilled) * self.qps)
+                self.quota_refilled = now
+                if self.quota_tokens < 1:
+                    self.rate_limited_count += 1
+                    raise FakeApiError(403, 'Rate Limit Exceeded', 'rateLimitExceeded')
+                self.quota_tokens -= 1
+
+    def count(self, name, params):
+        self.method_counts[name] = self.method_counts.get(name, 0) + 1
+        self.calls.append((name, { k: v[0] if len(v) == 1 else v for (k,v) in params.items() }))
+
+    def dispatch(self, method, path, params, body):
+        if not path.startswith(API_PREFIX):
+            raise FakeApiError(404, 'Not Found', 'notFound')
+        parts = [urllib.parse.unquote(p) for p in path[len(API_PREFIX):].strip('/').split('/')]
+        with self.lock:
+            if parts == ['users', 'me', 'calendarList'] and method == 'GET':
+                self.count('calendarList.list', params)
+                return self.list_calendars(params)
+            if parts == ['calendars'] and method == 'POST':
+                self.count('calendars.insert', params)
+                calendar_id = self.add_calendar(body['summary'])
+                calendar = dict(self.calendars[calendar_id], kind='calendar#calendar')
+                for k in ('primary', 'accessRole'):
+                    calendar.pop(k, None)
+                return calendar
+            if len(parts) == 2 and parts[0] == 'calendars' and method == 'DELETE':
+                self.count('calendars.delete', params)
+                calendar = self.get_calendar(parts[1])
+                if calendar.get('primary'):
+                    raise FakeApiError(400, 'Cannot delete primary calendar.', 'cannotDeletePrimaryCalendar')
+                calendar['deleted'] = True
+                self.calendar_list_seq[parts[1]] = next(self.seq)
+                return None
+            if len(parts) == 3 and parts[0] == 'calendars' and parts[2] == 'events':
+                self.get_calendar(parts[1])
+                if method == 'GET':
+                    self.count('events.list', params)
+                    return self.list_events(parts[1], params)
+                if method == 'POST':
+                    self.count('events.insert', params)
+                    errors = self.event_errors.get(body.get('summary'))
+                    if errors:
+                        status, reason = errors.pop(0)
+                        raise FakeApiError(status, 'Injected error', reason)
+                    return self.insert_event(parts[1], body)
+            if len(parts) == 4 and parts[0] == 'calendars' and parts[2] == 'events':
+                self.get_calendar(parts[1])
+                event = self.events[parts[1]].get(parts[3])
+                if event is None or event['status'] == 'cancelled':
+                    raise FakeApiError(404, 'Not Found', 'notFound')
+                if method == 'GET':
+                    self.count('events.get', params)
+                    return copy.deepcopy(event)
+                if method == 'PATCH':
+                    self.count('events.patch', params)
+                    for k,v in body.items():
+                        if v is None:
+                            event.pop(k, None)
+                        else:
+                            event[k] = v
+                    self.touch(event)
+                    return copy.deepcopy(event)
+                if method == 'DELETE':
+                    self.count('events.delete', params)
+                    event['status'] = 'cancelled'
+                    self.touch(event)
+                    return None
+        raise FakeApiError(404, 'Not Found', 'notFound')
+
+    def get_calendar(self, calendar_id):
+        calendar = self.calendars.get(calendar_id)
+        if calendar is None or calendar.get('deleted'):
+            raise FakeApiError(404, 'Not Found', 'notFound')
+        return calendar
+
+    def list_calendars(self, params):
+        sync_token = get_param(params, 'syncToken')
+        if sync_token is not None:
+            self.check_sync_token()
+            items = [dict(c) for (cid, c) in self.calendars.items() if self.calendar_list_seq[cid] > int(sync_token)]
+        else:
+            items = [dict(c) for c in self.calendars.values() if not c.get('deleted')]
+        items = [c if not c.get('deleted') else { 'id': c['id'], 'deleted': True } for c in items]
+        for c in items:
+            if not c.get('primary', True):
+                del c['primary']
+        return self.page(items, params, MAX_CALENDARS_PAGE_SIZE, 'calendar#calendarList')
+
+    def list_events(self, calendar_id, params):
+        sync_token = get_param(params, 'syncToken')
+        events = self.events[calendar_id].values()
+        if sync_token is not None:
+            self.check_sync_token()
+            items = [e for e in events if e['_seq'] > int(sync_token)]
+        else:
+            items = [e for e in events if e['status'] != 'cancelled']
+            time_min = get_param(params, 'timeMin')
+            time_max = get_param(params, 'timeMax')
+            q = get_param(params, 'q')
+            if time_min:
+                items = [e for e in items if get_end(e) > time_min[:10]]
+            if time_max:
+                items = [e for e in items if get_start(e) < time_max[:10]]
+            if q:
+                items = [e for e in items if q.lower() in (e.get('summary', '') + ' ' + e.get('description', '')).lower()]
+            for prop in params.get('privateExtendedProperty', []):
+                k, v = prop.split('=', 1)
+                items = [e for e in items if e.get('extendedProperties', {}).get('private', {}).get(k) == v]
+            if get_param(params, 'orderBy') == 'startTime':
+                items = sorted(items, key=get_start)
+        items = [{ k: copy.deepcopy(v) for (k,v) in e.items() if k != '_seq' } for e in items]
+        return self.page(items, params, MAX_EVENTS_PAGE_SIZE, 'calendar#events')
+
+    def page(self, items, params, max_page_size, kind):
+        max_results = min(int(get_param(params, 'maxResults') or 250), max_page_size)
+        start = int(get_param(params, 'pageToken') or 0)
+        result = { 'kind': kind, 'etag': '"{}"'.format(next(self.seq)), 'items': items[start:start+max_results] }
+        if start + max_results < len(items):
+            result['nextPageToken'] = str(start + max_results)
+        else:
+            result['nextSyncToken'] = str(next(self.seq))
+        return result
+
+    def check_sync_token(self):
+        if self.expire_sync_tokens:
+            raise FakeApiError(410, 'Sync token is no longer valid, a full sync is required.', 'fullSyncRequired')
+
+    def insert_event(self, calendar_id, body):
+        if 'start' not in body or 'end' not in body:
+            raise FakeApiError(400, 'Missing time range.', 'required')
+        event_id = uuid.uuid4().hex
+        now = utc_now()
+        event = dict(body,
+            kind='calendar#event', id=event_id, status='confirmed',
+            htmlLink='https://www.google.com/calendar/event?eid={}'.format(event_id),
+            created=now, creator={ 'email': self.account, 'self': True },
+            organizer={ 'email': calendar_id, 'self': True },
+            iCalUID=body.get('iCalUID') or '{}@google.com'.format(event_id), sequence=0,
+            reminders={ 'useDefault': True }, eventType='default')
+        event.pop('etag', None)
+        self.events[calendar_id][event_id] = event
+        self.touch(event)
+        return { k: copy.deepcopy(v) for (k,v) in event.items() if k != '_seq' }
+
+    def touch(self, event):
+        event['_seq'] = next(self.seq)
+        event['etag'] = '"{}"'.format(event['_seq'])
+        event['updated'] = utc_now()
+
+STATUS_TEXT = { 200: 'OK', 204: 'No Content', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 410: 'Gone', 429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable' }
+
+def utc_now():
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+
+def get_param(params, name):
+    values = params.get(name)
+    return values[0] if values else None
+
+def get_start(event):
+    return event['start'].get('date') or event['start'].get('dateTime', '')
+
+def get_end(event):
+    return event['end'].get('date') or event['end'].get('dateTime', '')
+
+# Parses a partial response field selection such as 'nextPageToken,items(id,summary)' into
+# a dict of field -> selection within it (None for the whole field).
+def parse_fields(fields):
+    def parse(i):
+        selection = {}
+        name = ''
+        while i < len(fields) and fields[i] != ')':
+            c = fields[i]
+            if c == '(':
+                selection[name], i = parse(i + 1)
+                name = ''
+            elif c == ',':
+                if name:
+                    selection[name] = None
+                name = ''
+            else:
+                name += c
+            i += 1
+        if name:
+            selection[name] = None
+        return selection, i
+    return parse(0)[0]
+
+def project(value, selection):
+    if selection is None:
+        return value
+    if isinstance(value, list):
+        return [project(v, selection) for v in value]
+    if isinstance(value, dict):
+        return { k: project(value[k], sub) for (k,sub) in selection.items() if k in value }
+    return value
+
+def make_template_events(num_events, race_day_index=None, first_day=datetime.date(2020, 1, 1)):
+    if race_day_index is None:
+        race_day_index = num_events - 1
+    events = []
+    for i in range(num_events):
+        day = first_day + datetime.timedelta(days=i)
+        events.append({
+            'summary': 'RACE DAY' if i == race_day_index else ['REST', '30 min easy run', 'Swim 1500m', 'Bike 1 hr'][i % 4],
+            'description': 'Week {}'.format(i // 7 + 1),
+            'start': { 'date': day.isoformat() },
+            'end': { 'date': (day + datetime.timedelta(days=1)).isoformat() },
+        })
+    return events
@@ -0,0 +1,61 @@
+# Throughput benchmarks for create_events against the in-process fake Calendar API.
+# These are skipped unless pytest is run with --run-benchmarks, e.g.
+#
+#   python -m pytest tests/test_benchmark_create_events.py --run-benchmarks -s
+#
+# Each request to the fake takes LATENCY seconds plus LATENCY_PER_ITEM per batched
+# sub-request, which is roughly what the real API costs from a home connection.
+from training_calendar import training_calendar as sut
+from fake_calendar_api import FakeCalendarHttp
+import datetime
+import time
+import pytest
+
+LATENCY = 0.01
+LATENCY_PER_ITEM = 0.0005
+
+SIZES = [100, 1000, 10000, 100000]
+
+STRATEGIES = {
+    'sequential': dict(),
+    'concurrent': dict(concurrency=8),
+    'batched': dict(batch_size=sut.CALENDAR_API_MAX_BATCH_SIZE),
+    'batched+conc': dict(batch_size=sut.CALENDAR_API_MAX_BATCH_SIZE, concurrency=8),
+}
+
+# Unbatched strategies make one HTTP request per event; beyond this size they take minutes
+MAX_UNBATCHED_EVENTS = 10000
+
+def make_plan(num_events, first_day=datetime.date(2022, 1, 1)):
+    one_day = datetime.timedelta(days=1)
+    return sut.EventTable.from_events(
+        sut.Event(first_day + i * one_day, first_day + (i + 1) * one_day, {'summary': 'Run {}'.format(i)})
+        for i in range(num_events))
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('num_events', SIZES)
+@pytest.mark.parametrize('strategy', sorted(STRATEGIES))
+def test_create_events_throughput(strategy, num_events, benchmark_results):
+    options = STRATEGIES[strategy]
+    if 'batch_size' not in options and num_events > MAX_UNBATCHED_EVENTS:
+        pytest.skip('too slow without batching')
+    http = FakeCalendarHttp(latency=LATENCY, latency_per_item=LATENCY_PER_ITEM)
+    service = http.build_service()
+    calendar_id = http.add_calendar('Benchmark')
+    plan = make_plan(num_events)
+
+    started = time.monotonic()
+    created = sut.create_events(service, plan, calendar_id, **options)
+    wall = time.monotonic() - started
+
+    assert created == num_events
+    assert len(http.get_events(calendar_id)) == num_events
+    benchmark_results.append({
+        'strategy': strategy,
+        'events': num_events,
+        'wall_s': wall,
+        'events_per_s': num_events / wall,
+        'calls': http.request_count,
+        'p50_ms': http.latency_percentile(50) * 1000.0,
+        'p99_ms': http.latency_percentile(99) * 1000.0,
+    })
@@ -0,0 +1,166 @@
+# Scaling benchmarks for reading a plan from a CSV (or JSON Lines) file, on generated files of
+# 1k to 1M rows. These are skipped unless pytest is run with --run-benchmarks, e.g.
+#
+#   python -m pytest tests/test_benchmark_load_events.py --run-benchmarks -s
+#
+# Each benchmark records the time per row (without tracemalloc, which slows everything
+# down) & the peak memory traced per row, & fails if either is over the baseline stored in
+# benchmark_baselines.json by more than the tolerance. Times depend on the machine, so
+# record new baselines with --update-benchmark-baselines after moving to another one (or
+# after making the loader faster).
+from training_calendar import training_calendar as sut
+import collections
+import csv
+import gc
+import json
+import time
+import tracemalloc
+import pytest
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+# Far enough from both ends of the calendar for a million days either side
+RACE_DAY = '5000-01-01'
+
+# Timings on a shared machine easily vary by half again; traced memory hardly varies at all
+TOLERANCES = { 'us_per_row': 2.0, 'bytes_per_row': 1.2 }
+
+WORKOUTS = ['REST', '30 min easy run', 'Swim 1500m', 'Bike 1 hr', 'Long run 16 km', 'Intervals 6x800m', 'Brick 40 km + 5 km']
+FILLER_COLUMNS = ['Week', 'Day', 'Date', 'Zone', 'Distance', 'Duration', 'Pace', 'Heart Rate', 'Cadence', 'Terrain',
+    'Equipment', 'Nutrition', 'RPE', 'Completed']
+
+# The columns of each kind of file: (header, column map, function giving a row's cells
+# from its summary, description & notes)
+SHAPES = {
+    'narrow': (['Summary', 'Description'], {}, lambda i, s, d, n: [s, d]),
+    'wide': (FILLER_COLUMNS[:3] + ['Summary', 'Description', 'Notes'] + FILLER_COLUMNS[3:], {},
+        lambda i, s, d, n: [i // 7 + 1, i % 7 + 1, ''] + [s, d, n] + ['z{}'.format(i % 5)] * (len(FILLER_COLUMNS) - 3)),
+    'remapped': (['Workout', 'Details', 'Coach Notes', 'Week'],
+        { 'Workout': 'Summary', 'Details': 'Description', 'Coach Notes': 'Notes' },
+        lambda i, s, d, n: [s, d, n, i // 7 + 1]),
+}
+
+# The race day is the last row, so it's found as late as possible
+def write_plan(path, shape, num_rows):
+    header, _, make_row = SHAPES[shape]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i in range(num_rows):
+            summary = sut.RACE_DAY_SUMMARY if i == num_rows - 1 else WORKOUTS[i % len(WORKOUTS)]
+            writer.writerow(make_row(i, summary, 'Week {} day {}'.format(i // 7 + 1, i % 7 + 1), 'Keep it easy' if i % 3 else ''))
+
+# The same rows as a JSON Lines file, one object per row
+def write_jsonl_plan(path, shape, num_rows):
+    csv_path = path[:-len('.jsonl')] + '.csv'
+    write_plan(csv_path, shape, num_rows)
+    with open(csv_path, newline='') as f, open(path, 'w') as out:
+        for row in csv.DictReader(f):
+            out.write(json.dumps(row) + '\n')
+
+@pytest.fixture(scope='module')
+def plan_files(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('plans')
+    files = {}
+    def get(shape, num_rows, extension='csv'):
+        if (shape, num_rows, extension) not in files:
+            path = str(directory / '{}-{}.{}'.format(shape, num_rows, extension))
+            (write_jsonl_plan if extension == 'jsonl' else write_plan)(path, shape, num_rows)
+            files[(shape, num_rows, extension)] = path
+        return files[(shape, num_rows, extension)]
+    return get
+
+# Returns the seconds `func` takes & the peak memory it allocates (anything it returns is
+# kept until the peak has been taken, so it counts). Small runs are timed as the best of
+# enough repeats to cover a 100k rows, or they're too noisy to compare.
+def measure(func, num_rows):
+    seconds = None
+    for _ in range(max(1, 100000 // num_rows)):
+        gc.collect()
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        del result
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return seconds, peak
+
+def record(benchmark_results, check_baseline, benchmark, shape, num_rows, seconds, peak):
+    measurements = { 'us_per_row': seconds * 1e6 / num_rows, 'bytes_per_row': peak / float(num_rows) }
+    benchmark_results.append({
+        'benchmark': benchmark,
+        'shape': shape,
+        'rows': num_rows,
+        'rows_per_s': num_rows / seconds,
+        'us_per_row': measurements['us_per_row'],
+        'peak_kb': peak / 1024.0,
+        'bytes_per_row': measurements['bytes_per_row'],
+    })
+    check_baseline('{}[{}-{}]'.format(benchmark, shape, num_rows), measurements, TOLERANCES)
+
+# Streams the events through (as writing an ICS file does), so memory shouldn't grow with the file
+@pytest.mark.benchmark
+@pytest.mark.parametrize('num_rows', SIZES)
+@pytest.mark.parametrize('shape', sorted(SHAPES))
+def test_stream_events_from_file(shape, num_rows, plan_files, benchmark_results, check_baseline):
+    path = plan_files(shape, num_rows)
+    column_map = SHAPES[shape][1]
+    def stream():
+        collections.deque(sut.stream_events_from_file(path, column_map, RACE_DAY, False), maxlen=0)
+    seconds, peak = measure(stream, num_rows)
+    record(benchmark_results, check_baseline, 'stream_events', shape, num_rows, seconds, peak)
+
+# Keeps a view of every event of the compiled plan, to see what each one costs
+@pytest.mark.benchmark
+@pytest.mark.parametrize('num_rows', SIZES)
+def test_load_event_list_from_file(num_rows, plan_files, benchmark_results, check_baseline):
+    path = plan_files('wide', num_rows)
+    def load():
+        return list(sut.load_events_from_file(path, {}, RACE_DAY, False))
+    seconds, peak = measure(load, num_rows)
+    events = load()
+    assert len(events) == num_rows
+    assert events[-1].start.strftime(sut.TRAINING_CALENDAR_EVENT_DATE_FORMAT) == RACE_DAY
+    record(benchmark_results, check_baseline, 'event_list', 'wide', num_rows, seconds, peak)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('num_rows', SIZES)
+@pytest.mark.parametrize('shape', sorted(SHAPES))
+def test_compile_file_plan(shape, num_rows, plan_files, benchmark_results, check_baseline):
+    path = plan_files(shape, num_rows)
+    column_map = SHAPES[shape][1]
+    def compile():
+        return sut.load_file_plan(path, column_map, False)
+    seconds, peak = measure(compile, num_rows)
+    plan = compile()
+    assert len(plan.starts) == num_rows
+    assert plan.starts[-1] == 0
+    record(benchmark_results, check_baseline, 'compile_plan', shape, num_rows, seconds, peak)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('num_rows', SIZES)
+def test_compile_jsonl_plan(num_rows, plan_files, benchmark_results, check_baseline):
+    path = plan_files('wide', num_rows, 'jsonl')
+    def compile():
+        return sut.load_file_plan(path, {}, False)
+    seconds, peak = measure(compile, num_rows)
+    plan = compile()
+    assert len(plan.starts) == num_rows
+    assert plan.starts[-1] == 0
+    record(benchmark_results, check_baseline, 'jsonl_plan', 'wide', num_rows, seconds, peak)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('num_rows', SIZES)
+def test_find_race_day(num_rows, benchmark_results, check_baseline):
+    workout = { 'summary': 'REST' }
+    events = [workout] * (num_rows - 1) + [{ 'summary': sut.RACE_DAY_SUMMARY }]
+    seconds, peak = measure(lambda: sut.find_race_day(events), num_rows)
+    assert sut.find_race_day(events) == num_rows - 1
+    record(benchmark_results, check_baseline, 'find_race_day', 'dicts', num_rows, seconds, peak)
@@ -0,0 +1,72 @@
+from training_calendar import training_calendar as sut
+import json
+import pytest
+
+def make_event(day, summary=None):
+    date = '2020-01-{:02d}'.format(day)
+    return {'summary': summary or 'Test{}'.format(day), 'start': {'date': date}, 'end': {'date': date}}
+
+@pytest.fixture
+def template_id(fake):
+    return fake.add_calendar('Template')
+
+@pytest.fixture
+def service(fake, template_id):
+    fake.add_events(template_id, [make_event(3), make_event(1), make_event(2)])
+    return fake.build_service()
+
+def summaries(events):
+    return [e['summary'] for e in events]
+
+# Whether each listing of the template's events was incremental (given a sync token)
+def used_sync_tokens(fake):
+    return ['syncToken' in params for params in fake.get_calls('events.list')]
+
+def test_calendar_list_is_cached_in_process(tmp_path, fake, service, template_id):
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'))
+    assert sut.get_calendar_name_id_map(service, cache=cache)['Template'] == template_id
+    assert sut.get_calendar_name_id_map(service, cache=cache)['Template'] == template_id
+    assert fake.method_counts['calendarList.list'] == 1
+
+def test_events_are_sorted_by_start(tmp_path, service, template_id):
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'))
+    assert summaries(cache.get_events(service, template_id)) == ['Test1', 'Test2', 'Test3']
+
+def test_later_runs_fetch_only_changes(tmp_path, fake, service, template_id):
+    path = str(tmp_path / 'cache.json')
+    events = sut.CalendarCache(path, max_age=0).get_events(service, template_id)
+    service.events().patch(calendarId=template_id, eventId=events[1]['id'], body={'summary': 'Changed'}).execute()
+    service.events().delete(calendarId=template_id, eventId=events[2]['id']).execute()
+    fake.add_events(template_id, [make_event(4)])
+    events = sut.CalendarCache(path, max_age=0).get_events(service, template_id)
+    assert summaries(events) == ['Test1', 'Changed', 'Test4']
+    assert used_sync_tokens(fake) == [False, True]
+
+def test_expired_sync_token_refetches_everything(tmp_path, fake, service, template_id):
+    path = str(tmp_path / 'cache.json')
+    sut.CalendarCache(path, max_age=0).get_events(service, template_id)
+    fake.expire_sync_tokens = True
+    events = sut.CalendarCache(path, max_age=0).get_events(service, template_id)
+    assert summaries(events) == ['Test1', 'Test2', 'Test3']
+    assert used_sync_tokens(fake) == [False, True, False]
+
+def test_put_calendar_updates_cached_list(tmp_path, service, template_id):
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'))
+    sut.get_calendar_name_id_map(service, cache=cache)
+    cache.put_calendar({'id': 'cal2', 'summary': 'New'})
+    cal_id_map = sut.get_calendar_name_id_map(service, cache=cache)
+    assert (cal_id_map['Template'], cal_id_map['New']) == (template_id, 'cal2')
+
+def test_unreadable_cache_file_is_ignored(tmp_path, service, template_id):
+    path = tmp_path / 'cache.json'
+    path.write_text('not json')
+    cache = sut.CalendarCache(str(path))
+    assert sut.get_calendar_name_id_map(service, cache=cache)['Template'] == template_id
+    assert json.loads(path.read_text())['entries']['calendarList']['syncToken'] is not None
+
+def test_load_events_from_calendar_uses_cache(tmp_path, fake, service, template_id):
+    fake.add_events(template_id, [make_event(5, 'RACE DAY')])
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'))
+    events = list(sut.load_events_from_calendar(service, 'Template', '2022-10-15', False, cache=cache))
+    assert [e.properties['summary'] for e in events] == ['Test1', 'Test2', 'Test3', 'RACE DAY']
+    assert fake.method_counts['events.list'] == 1
@@ -0,0 +1,97 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import FakeCalendarHttp
+from datetime import datetime, timedelta
+import pytest
+
+START = datetime(2022, 1, 3)
+
+def make_events(days_and_summaries, start=START):
+    return [
+        sut.Event(start=start + timedelta(days=d), end=start + timedelta(days=d+1), properties={'summary': s})
+        for (d, s) in days_and_summaries]
+
+def describe(events):
+    return [
+        (e.start.strftime('%Y-%m-%d'), e.properties['summary'], e.build().get('recurrence'))
+        for e in events]
+
+def test_weekly_runs_become_one_event():
+    events = make_events([(7 * w + d, s) for w in range(4) for (d, s) in [(0, 'REST'), (2, 'Swim')]])
+    assert describe(sut.compress_recurring_events(events)) == [
+        ('2022-01-03', 'REST', ['RRULE:FREQ=WEEKLY;COUNT=4']),
+        ('2022-01-05', 'Swim', ['RRULE:FREQ=WEEKLY;COUNT=4']),
+    ]
+
+def test_daily_runs_become_one_event():
+    events = make_events([(d, 'Taper jog') for d in range(5)])
+    assert describe(sut.compress_recurring_events(events)) == [('2022-01-03', 'Taper jog', ['RRULE:FREQ=DAILY;COUNT=5'])]
+
+# Four weeks of the same event every day is one daily series, not seven weekly ones
+def test_longest_run_wins():
+    events = make_events([(d, 'Taper jog') for d in range(28)] + [(7 * w + 28, 'Taper jog') for w in range(1, 4)])
+    assert describe(sut.compress_recurring_events(events)) == [
+        ('2022-01-03', 'Taper jog', ['RRULE:FREQ=DAILY;COUNT=28']),
+        ('2022-02-07', 'Taper jog', ['RRULE:FREQ=WEEKLY;COUNT=3']),
+    ]
+
+def test_skipped_occurrence_becomes_exdate():
+    events = make_events([(0, 'REST'), (7, 'REST'), (21, 'REST')])
+    compressed = sut.compress_recurring_events(events)
+    assert describe(compressed) == [('2022-01-03', 'REST', ['RRULE:FREQ=WEEKLY;COUNT=4', 'EXDATE;VALUE=DATE:20220117'])]
+    assert len(compressed[0]) == 3
+
+def test_long_gap_splits_runs():
+    events = make_events([(0, 'REST'), (7, 'REST'), (28, 'REST'), (35, 'REST')])
+    assert describe(sut.compress_recurring_events(events)) == [
+        ('2022-01-03', 'REST', ['RRULE:FREQ=WEEKLY;COUNT=2']),
+        ('2022-01-31', 'REST', ['RRULE:FREQ=WEEKLY;COUNT=2']),
+    ]
+
+def test_unique_and_differing_events_are_kept():
+    events = make_events([(0, 'Run'), (7, 'Run 2'), (14, 'RACE DAY')])
+    events[1].properties['summary'] = 'Run'
+    events[1].properties['description'] = 'Hills'
+    assert describe(sut.compress_recurring_events(events)) == [
+        ('2022-01-03', 'Run', None), ('2022-01-10', 'Run', None), ('2022-01-17', 'RACE DAY', None)]
+
+def test_events_on_the_same_day_are_kept_apart():
+    events = make_events([(0, 'Core'), (0, 'Core'), (7, 'Core'), (7, 'Core')])
+    compressed = sut.compress_recurring_events(events)
+    assert sum(len(e) if isinstance(e, sut.RecurringEvent) else 1 for e in compressed) == 4
+    assert [e.build().get('recurrence') for e in compressed] == [['RRULE:FREQ=WEEKLY;COUNT=2'], None, None]
+
+def test_empty_events_are_skipped():
+    events = make_events([(0, ''), (7, ''), (1, 'Run')])
+    assert describe(sut.compress_recurring_events(events)) == [('2022-01-04', 'Run', None)]
+
+def test_main_creates_recurring_events(monkeypatch, tmp_path, capsys):
+    fake = FakeCalendarHttp()
+    service = fake.build_service()
+    monkeypatch.setattr(sut, 'get_calendar_service', lambda *args: service)
+    template_events = []
+    for i in range(29):
+        summary = 'RACE DAY' if i == 28 else 'REST' if i % 7 == 0 else 'Run {}'.format(i)
+        start, end = START + timedelta(days=i), START + timedelta(days=i+1)
+        template_events.append({ 'summary': summary, 'start': { 'date': start.strftime('%Y-%m-%d') }, 'end': { 'date': end.strftime('%Y-%m-%d') } })
+    fake.add_events(fake.add_calendar('Template'), template_events)
+    sut.main(['Marathon', '2022-10-15', '-c', 'Template', '--compress', '--cache-dir', str(tmp_path)])
+    assert 'Compressed 29 events into 26 (1 recurring); compression ratio 1.1x' in capsys.readouterr().out
+    created = fake.get_events(fake.calendar_id('Marathon'))
+    assert len(created) == 26
+    assert [e['recurrence'] for e in created if 'recurrence' in e] == [['RRULE:FREQ=WEEKLY;COUNT=4']]
+
+def test_ics_output_includes_recurrence(tmp_path):
+    events = sut.compress_recurring_events(make_events([(0, 'REST'), (7, 'REST'), (21, 'REST')]))
+    ics_path = str(tmp_path / 'plan.ics')
+    writer = sut.IcsEventWriter(ics_path, 'Plan')
+    writer.write(events)
+    writer.close()
+    with open(ics_path) as f:
+        lines = f.read().splitlines()
+    assert 'RRULE:FREQ=WEEKLY;COUNT=4' in lines
+    assert 'EXDATE;VALUE=DATE:20220117' in lines
+
+def test_compress_conflicts_with_sync():
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.parse_arguments(['Marathon', '2022-10-15', '-f', './test.csv', '--compress', '--sync'])
+    assert exc_info.value.message == "--compress can't be used with --sync"
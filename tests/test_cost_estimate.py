@@ -0,0 +1,68 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import make_template_events
+from conftest import get_test_file
+import json
+import pytest
+
+def test_batched_calls_use_a_quota_unit_each():
+    estimate = sut.CostEstimate()
+    estimate.add('calendar_lookup', 1)
+    estimate.add_calls('insert', 120, batch_size=50)
+    assert estimate.to_dict(0.5) == {
+        'phases': [
+            { 'phase': 'calendar_lookup', 'requests': 1, 'quota_units': 1, 'seconds': 0.5 },
+            { 'phase': 'insert', 'requests': 3, 'quota_units': 120, 'seconds': 1.5 }],
+        'requests': 4, 'quota_units': 121, 'seconds': 2.0,
+        'latency_seconds': 0.5, 'latency_source': 'measured', 'concurrency': 1, 'qps': None }
+
+def test_parallel_calls_are_bound_by_rate_limit():
+    estimate = sut.CostEstimate(concurrency=4, qps=10)
+    estimate.add_calls('insert', 100)
+    estimate.add('calendar_create', 1)
+    result = estimate.to_dict()
+    assert result['latency_source'] == 'default'
+    assert [p['seconds'] for p in result['phases']] == [10.0, sut.DEFAULT_API_LATENCY]
+
+def test_what_if_estimates_requests_of_real_run(fake, tmp_path, capsys):
+    fake.add_events(fake.add_calendar('Template'), make_template_events(300))
+    estimate_file = str(tmp_path / 'estimate.json')
+    args = ['Marathon', '2022-10-15', '-c', 'Template', '--batch-size', '50', '--no-cache']
+    sut.main(args + ['--what-if', '--estimate-file', estimate_file])
+    assert 'WHAT-IF: Estimated cost:' in capsys.readouterr().out
+    with open(estimate_file) as f:
+        estimate = json.load(f)
+    assert [(p['phase'], p['requests'], p['quota_units']) for p in estimate['phases']] == [
+        ('load', 3, 3), ('calendar_lookup', 1, 1), ('calendar_create', 1, 1), ('insert', 6, 300)]
+    assert estimate['latency_source'] == 'measured'
+
+    fake.request_count = fake.query_count = 0
+    sut.main(args)
+    assert fake.request_count == estimate['requests']
+    assert fake.query_count == estimate['quota_units']
+
+def test_what_if_estimates_overwrite(fake, tmp_path):
+    calendar_id = fake.add_calendar('Marathon')
+    fake.add_events(calendar_id, make_template_events(10, first_day=sut.datetime.date(2022, 10, 11)))
+    estimate_file = str(tmp_path / 'estimate.json')
+    sut.main(['Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--force', '--no-cache', '--what-if',
+        '--estimate-file', estimate_file])
+    with open(estimate_file) as f:
+        phases = { p['phase']: p for p in json.load(f)['phases'] }
+    assert (phases['overwrite']['requests'], phases['overwrite']['quota_units']) == (2, 7)
+    assert 'calendar_create' not in phases
+
+def test_manifest_estimates_add_up(fake, tmp_path):
+    manifest = tmp_path / 'jobs.csv'
+    manifest.write_text('name,race_day\nAlex,2022-10-15\nSam,2022-11-15\n')
+    estimate_file = str(tmp_path / 'estimate.json')
+    sut.main(['--manifest', str(manifest), '-f', get_test_file('golden.csv'), '--what-if', '--no-cache',
+        '--estimate-file', estimate_file])
+    with open(estimate_file) as f:
+        estimate = json.load(f)
+    assert [j['name'] for j in estimate['jobs']] == ['Alex', 'Sam']
+    assert estimate['total']['quota_units'] == sum(j['estimate']['quota_units'] for j in estimate['jobs']) == 16
+
+def test_estimate_file_requires_what_if():
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.parse_arguments(['Marathon', '2022-10-15', '-f', 'plan.csv', '--estimate-file', 'e.json'])
+    assert exc_info.value.message == '--estimate-file requires --what-if'
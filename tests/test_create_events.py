@@ -0,0 +1,108 @@
+from training_calendar import training_calendar as sut
+from googleapiclient.errors import HttpError
+from datetime import datetime, timedelta
+import pytest
+
+RATE_LIMITED = (403, 'rateLimitExceeded')
+
+def make_events(n, start=datetime(2022, 10, 1)):
+    return [
+        sut.Event(start=start + timedelta(days=i), end=start + timedelta(days=i+1), properties={'summary': 'Test{}'.format(i)})
+        for i in range(n)]
+
+@pytest.fixture
+def calendar_id(fake):
+    return fake.add_calendar('Marathon')
+
+def summaries(fake, calendar_id):
+    return [e['summary'] for e in fake.get_events(calendar_id)]
+
+def test_batched_splits_into_batches(fake, calendar_id):
+    sut.create_events(fake.build_service(), make_events(120), calendar_id, batch_size=50)
+    assert fake.request_count == 3
+    assert summaries(fake, calendar_id) == ['Test{}'.format(i) for i in range(120)]
+
+def test_batched_skips_empty_events(fake, calendar_id):
+    events = make_events(3)
+    events[1].properties['summary'] = ''
+    sut.create_events(fake.build_service(), events, calendar_id, batch_size=50)
+    assert summaries(fake, calendar_id) == ['Test0', 'Test2']
+
+def test_batched_retries_only_failed_events(fake, calendar_id):
+    fake.event_errors = {'Test3': [RATE_LIMITED]}
+    sut.create_events(fake.build_service(), make_events(5), calendar_id, batch_size=50)
+    # The batch of 5, then one of the rate limited event
+    assert fake.request_count == 2
+    assert fake.method_counts['events.insert'] == 6
+    assert summaries(fake, calendar_id) == ['Test{}'.format(i) for i in range(5)]
+
+def test_batched_raises_on_non_retryable_error(fake, calendar_id):
+    fake.event_errors = {'Test1': [(400, 'badRequest')]}
+    with pytest.raises(HttpError):
+        sut.create_events(fake.build_service(), make_events(3), calendar_id, batch_size=50)
+
+def test_batched_raises_when_retries_exhausted(fake, calendar_id):
+    fake.event_errors = {'Test0': [RATE_LIMITED] * 10}
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.create_events(fake.build_service(), make_events(2), calendar_id, batch_size=50)
+    assert 'retry limit exceeded' in exc_info.value.message
+
+@pytest.mark.parametrize('batch_size', [0, 51])
+def test_batched_raises_on_invalid_batch_size(fake, calendar_id, batch_size):
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.create_events(fake.build_service(), make_events(1), calendar_id, batch_size=batch_size)
+    assert exc_info.value.message == 'batch size must be between 1 and 50 (got {})'.format(batch_size)
+    assert fake.request_count == 0
+
+@pytest.mark.parametrize('batch_size', [None, 5])
+def test_concurrent_inserts_all_events(fake, calendar_id, batch_size):
+    sut.create_events(fake.build_service(), make_events(40), calendar_id, batch_size=batch_size, concurrency=4)
+    assert sorted(summaries(fake, calendar_id)) == sorted('Test{}'.format(i) for i in range(40))
+
+def test_concurrent_raises_first_error_in_event_order(fake, calendar_id):
+    fake.event_errors = {'Test7': [(400, 'badRequest')], 'Test30': [(404, 'notFound')]}
+    with pytest.raises(HttpError) as exc_info:
+        sut.create_events(fake.build_service(), make_events(40), calendar_id, concurrency=4)
+    assert exc_info.value.resp.status == 400
+    assert 'Test39' not in summaries(fake, calendar_id)
+
+def test_concurrent_retries_rate_limited_event(fake, calendar_id):
+    fake.event_errors = {'Test2': [RATE_LIMITED]}
+    sut.create_events(fake.build_service(), make_events(5), calendar_id, concurrency=3)
+    assert fake.method_counts['events.insert'] == 6
+    assert len(summaries(fake, calendar_id)) == 5
+
+def test_run_in_order_preserves_order():
+    results = list(sut.run_in_order(lambda x: x * 2, range(100), concurrency=8))
+    assert results == [x * 2 for x in range(100)]
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, s):
+        self.slept.append(s)
+        self.now += s
+
+def test_token_bucket_throttles_to_rate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sut.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(sut.time, 'sleep', clock.sleep)
+    bucket = sut.TokenBucket(10)
+    for _ in range(30):
+        bucket.acquire()
+    # The first 10 tokens are available immediately, the remaining 20 come in at 10/s
+    assert clock.now == pytest.approx(2.0)
+
+def test_token_bucket_allows_acquiring_more_than_capacity(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sut.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(sut.time, 'sleep', clock.sleep)
+    bucket = sut.TokenBucket(2)
+    bucket.acquire(2)
+    bucket.acquire(10)
+    assert clock.now == pytest.approx(5.0)
@@ -0,0 +1,149 @@
+from training_calendar import training_calendar as sut
+from google.oauth2.credentials import Credentials
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import pytest
+
+def write_token(path, token, expires_in):
+    expiry = sut.get_utc_now() + datetime.timedelta(seconds=expires_in)
+    with open(path, 'w') as f:
+        json.dump({'token': token, 'refresh_token': 'refresh', 'client_id': 'client', 'client_secret': 'secret',
+            'expiry': expiry.strftime('%Y-%m-%dT%H:%M:%SZ')}, f)
+
+def read_token(path):
+    with open(path) as f:
+        return json.load(f)['token']
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    calls = []
+    def fake_refresh(self, request):
+        calls.append(threading.current_thread().name)
+        time.sleep(0.05)
+        self.token = 'fresh-{}'.format(len(calls))
+        self.expiry = sut.get_utc_now() + datetime.timedelta(hours=1)
+    monkeypatch.setattr(Credentials, 'refresh', fake_refresh)
+    return calls
+
+@pytest.fixture
+def token_path(tmp_path):
+    return str(tmp_path / 'auth' / 'token.json')
+
+def test_uses_saved_token_that_is_not_expiring(token_path, refreshes):
+    os.makedirs(os.path.dirname(token_path))
+    write_token(token_path, 'saved', expires_in=3600)
+    manager = sut.CredentialManager(token_path).start()
+    headers = {}
+    manager.before_request(None, 'GET', 'https://example.com/', headers)
+    manager.close()
+    assert headers['authorization'] == 'Bearer saved'
+    assert (manager.client_id, manager.refresh_token) == ('client', 'refresh')
+    assert refreshes == []
+
+def test_refreshes_token_ahead_of_expiry_and_saves_it(token_path, refreshes):
+    os.makedirs(os.path.dirname(token_path))
+    write_token(token_path, 'saved', expires_in=60)
+    manager = sut.CredentialManager(token_path, refresh_margin=300).start()
+    manager.close()
+    assert manager.get_token() == 'fresh-1'
+    assert read_token(token_path) == 'fresh-1'
+
+def test_refreshes_in_the_background(token_path, refreshes):
+    os.makedirs(os.path.dirname(token_path))
+    write_token(token_path, 'saved', expires_in=301)
+    manager = sut.CredentialManager(token_path, refresh_margin=300).start()
+    assert manager.get_token() == 'saved'
+    deadline = time.monotonic() + 5
+    while manager.get_token() == 'saved' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    manager.close()
+    assert manager.get_token() == 'fresh-1'
+    assert refreshes == ['token-refresh']
+
+def test_picks_up_token_refreshed_by_another_process(token_path, refreshes):
+    os.makedirs(os.path.dirname(token_path))
+    write_token(token_path, 'saved', expires_in=3600)
+    manager = sut.CredentialManager(token_path).start()
+    manager.close()
+    write_token(token_path, 'other', expires_in=3600)
+    manager.refresh(None)
+    assert manager.get_token() == 'other'
+    assert refreshes == []
+
+def test_concurrent_401s_refresh_once(token_path, refreshes):
+    os.makedirs(os.path.dirname(token_path))
+    write_token(token_path, 'saved', expires_in=3600)
+    manager = sut.CredentialManager(token_path).start()
+    manager.close()
+    barrier = threading.Barrier(8, timeout=5)
+    def refresh():
+        token = manager.get_token()
+        barrier.wait()
+        manager.update(token, force=True)
+    threads = [threading.Thread(target=refresh) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(refreshes) == 1
+    assert read_token(token_path) == 'fresh-1'
+
+def refresh_in_process(token_path, results):
+    manager = sut.CredentialManager(token_path).start()
+    manager.close()
+    results.put(manager.get_token())
+
+@pytest.mark.skipif(os.name == 'nt', reason='needs fork')
+def test_processes_sharing_token_file_refresh_once(token_path, monkeypatch):
+    def fake_refresh(self, request):
+        time.sleep(0.05)
+        self.token = 'fresh-{}'.format(os.getpid())
+        self.expiry = sut.get_utc_now() + datetime.timedelta(hours=1)
+    monkeypatch.setattr(Credentials, 'refresh', fake_refresh)
+    os.makedirs(os.path.dirname(token_path))
+    write_token(token_path, 'saved', expires_in=0)
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=refresh_in_process, args=(token_path, results)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(10)
+    # The process that refreshed the token put its pid in it; the others must have read it
+    tokens = [results.get(timeout=1) for _ in processes]
+    assert tokens == [read_token(token_path)] * 4
+    assert tokens[0] in ['fresh-{}'.format(p.pid) for p in processes]
+
+def test_missing_client_secret_file_is_an_error(tmp_path):
+    manager = sut.CredentialManager(str(tmp_path / 'token.json'), str(tmp_path / 'credentials.json'))
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        manager.start()
+    assert exc_info.value.message.startswith('no saved token in')
+
+def test_parse_arguments_reads_token_and_credentials_paths():
+    inputs = sut.parse_arguments(['Marathon', '2022-10-15', '-c', 'Template',
+        '--token', 'auth/token.json', '--credentials', 'auth/credentials.json'])
+    assert (inputs['token'], inputs['credentials']) == ('auth/token.json', 'auth/credentials.json')
+
+# msvcrt can't wait on a lock for long, so lock_file keeps trying until the lock is free
+def test_lock_file_waits_for_lock_on_windows(tmp_path, monkeypatch):
+    class FakeMsvcrt:
+        LK_NBLCK, LK_UNLCK = 'nblck', 'unlck'
+        def __init__(self):
+            self.calls = []
+        def locking(self, fd, mode, nbytes):
+            self.calls.append(mode)
+            if mode == self.LK_NBLCK and self.calls.count(mode) < 30:
+                raise OSError('locked')
+    msvcrt = FakeMsvcrt()
+    monkeypatch.setitem(sys.modules, 'msvcrt', msvcrt)
+    monkeypatch.setattr(sut.os, 'name', 'nt')
+    monkeypatch.setattr(sut.time, 'sleep', lambda s: None)
+    with sut.lock_file(str(tmp_path / 'token.json.lock')):
+        assert msvcrt.calls == ['nblck'] * 30
+    assert msvcrt.calls[-1] == 'unlck'
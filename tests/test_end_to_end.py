@@ -0,0 +1,137 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import make_template_events
+from conftest import GOLDEN_EVENTS, get_test_file, run_main
+from os import path
+import subprocess
+import sys
+import time
+import pytest
+
+REAL_SLEEP = time.sleep
+
+def summaries(fake, calendar_name):
+    return [(e['start']['date'], e['summary']) for e in fake.get_events(fake.calendar_id(calendar_name))]
+
+@pytest.mark.parametrize('options', [
+    [],
+    ['--batch-size', '4'],
+    ['--concurrency', '3', '--qps', '1000'],
+    ['--batch-size', '2', '--concurrency', '2', '--qps', '1000'],
+])
+def test_creates_calendar_from_file(fake, options):
+    run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), *options)
+    assert summaries(fake, 'Marathon') == GOLDEN_EVENTS
+
+def test_creates_calendar_from_template(fake):
+    template_id = fake.add_calendar('Template')
+    fake.add_events(template_id, make_template_events(300, race_day_index=250))
+    run_main(fake, 'Marathon', '2022-10-15', '-c', 'Template', '--page-size', '100', '--batch-size', '50')
+    events = summaries(fake, 'Marathon')
+    assert len(events) == 300
+    assert events[250] == ('2022-10-15', 'RACE DAY')
+    # One search for the race day, then the template's 3 pages
+    assert fake.method_counts['events.list'] == 4
+
+def test_recovers_from_transient_errors(fake):
+    fake.errors = [(503, 'backendError'), (403, 'userRateLimitExceeded'), (429, 'rateLimitExceeded')]
+    run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--batch-size', '3')
+    assert summaries(fake, 'Marathon') == GOLDEN_EVENTS
+
+def test_client_rate_limit_stays_under_quota(fake, monkeypatch):
+    monkeypatch.setattr(sut.time, 'sleep', REAL_SLEEP)
+    template_id = fake.add_calendar('Template')
+    fake.add_events(template_id, make_template_events(100))
+    fake.qps = fake.quota_tokens = 50
+    run_main(fake, 'Marathon', '2022-10-15', '-c', 'Template', '--concurrency', '4', '--qps', '40')
+    assert len(summaries(fake, 'Marathon')) == 100
+    assert fake.rate_limited_count == 0
+
+def test_sync_rerun_makes_no_changes(fake):
+    run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--sync')
+    inserts = fake.method_counts['events.insert']
+    run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--sync')
+    assert fake.method_counts['events.insert'] == inserts
+    assert summaries(fake, 'Marathon') == GOLDEN_EVENTS
+
+# Neither the tag nor a Notes column is returned by the API, so neither may look like a change
+@pytest.mark.parametrize('tagged,with_notes', [(True, False), (False, True), (True, True)])
+def test_sync_rerun_patches_nothing(fake, tmp_path, tagged, with_notes):
+    plan = tmp_path / 'plan.csv'
+    plan.write_text('summary,description{}\n'.format(',notes' if with_notes else '') + ''.join(
+        'Test{0},Desc{0}{1}\n'.format(i, ',Note{}'.format(i) if with_notes else '') if i != 4 else 'RACE DAY,Race{}\n'.format(',Go' if with_notes else '')
+        for i in range(6)))
+    options = ['-t', 'TAG'] if tagged else []
+    run_main(fake, 'Marathon', '2022-10-15', '-f', str(plan), '--sync', *options)
+    run_main(fake, 'Marathon', '2022-10-15', '-f', str(plan), '--sync', *options)
+    assert fake.method_counts['events.insert'] == 6
+    assert 'events.patch' not in fake.method_counts
+    assert 'events.delete' not in fake.method_counts
+
+def test_what_if_creates_nothing(fake):
+    run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--what-if')
+    assert fake.calendar_id('Marathon') is None
+    assert 'events.insert' not in fake.method_counts
+
+def test_what_if_from_file_runs_offline(monkeypatch, capsys):
+    def no_service(*args):
+        raise AssertionError('--what-if with --file should not need the API')
+    monkeypatch.setattr(sut, 'get_calendar_service', no_service)
+    sut.main(['Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--what-if'])
+    assert capsys.readouterr().out.count('WHAT-IF: Copying event') == len(GOLDEN_EVENTS)
+
+def test_what_if_from_template_uses_api(fake):
+    template_id = fake.add_calendar('Template')
+    fake.add_events(template_id, make_template_events(10))
+    run_main(fake, 'Marathon', '2022-10-15', '-c', 'Template', '--what-if')
+    assert fake.method_counts['events.list'] >= 1
+    assert fake.calendar_id('Marathon') is None
+
+def test_import_does_not_load_google_libraries():
+    code = ("import sys, training_calendar.training_calendar; "
+        "print(sorted(m for m in sys.modules if m.split('.')[0] in ('google', 'googleapiclient', 'google_auth_oauthlib', 'httplib2')))")
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=path.dirname(path.dirname(path.abspath(__file__))))
+    assert out.decode('utf-8').strip() == '[]'
+
+def test_auth_overlaps_plan_loading(fake, monkeypatch):
+    service = fake.build_service()
+    def slow_service(*args):
+        with sut.METRICS.phase('auth'):
+            REAL_SLEEP(0.3)
+        return service
+    compile_file_plan = sut.compile_file_plan
+    def slow_compile(*args):
+        REAL_SLEEP(0.3)
+        return compile_file_plan(*args)
+    monkeypatch.setattr(sut, 'get_calendar_service', slow_service)
+    monkeypatch.setattr(sut, 'compile_file_plan', slow_compile)
+    started = time.monotonic()
+    run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('golden.csv'))
+    assert time.monotonic() - started < 0.55
+    assert sut.METRICS.get('hidden_latency_seconds_total') >= 0.2
+    assert summaries(fake, 'Marathon') == GOLDEN_EVENTS
+
+def test_bad_plan_creates_no_calendar(fake):
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('no-race-day.csv'))
+    assert exc_info.value.message.startswith('no race day detected')
+    assert fake.calendar_id('Marathon') is None
+
+def test_fake_expires_sync_tokens(fake):
+    template_id = fake.add_calendar('Template')
+    fake.add_events(template_id, make_template_events(10))
+    service = fake.build_service()
+    cache = sut.CalendarCache(path.join(fake.cache_dir, 'c.json'), max_age=0)
+    cache.get_events(service, template_id)
+    fake.expire_sync_tokens = True
+    assert len(cache.get_events(service, template_id)) == 10
+
+@pytest.mark.parametrize('jobs', ['1', '4'])
+def test_manifest_lists_template_once(fake, tmp_path, jobs):
+    template_id = fake.add_calendar('Template')
+    fake.add_events(template_id, make_template_events(300, race_day_index=250))
+    manifest = tmp_path / 'jobs.csv'
+    manifest.write_text('name,race_day\n' + ''.join('Runner{0},2022-10-1{0}\n'.format(i) for i in range(4)))
+    run_main(fake, '--manifest', str(manifest), '-c', 'Template', '--page-size', '100', '--jobs', jobs)
+    assert [len(fake.get_events(fake.calendar_id('Runner{}'.format(i)))) for i in range(4)] == [300] * 4
+    # The template's 3 pages once, then at most a search & an incremental sync per job
+    assert fake.method_counts['events.list'] <= 3 + 4 * 2
@@ -0,0 +1,115 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import FakeCalendarHttp
+from conftest import get_test_file, run_main
+from datetime import datetime, timedelta
+import json
+import os
+import pytest
+
+# Interrupts the run as the given HTTP request's response comes back, so that its event is
+# created but not journaled
+def interrupt_at(request_number):
+    def latency(count):
+        if count == request_number:
+            raise KeyboardInterrupt()
+        return 0
+    return latency
+
+def summaries(fake, calendar_id):
+    return [e['summary'] for e in fake.get_events(calendar_id)]
+
+def make_events(n, start=datetime(2022, 10, 1)):
+    return [
+        sut.Event(start=start + timedelta(days=i), end=start + timedelta(days=i+1), properties={'summary': 'Test{}'.format(i)})
+        for i in range(n)]
+
+def test_records_created_events(tmp_path):
+    fake = FakeCalendarHttp()
+    calendar_id = fake.add_calendar('Journaled')
+    path = str(tmp_path / 'journal.jsonl')
+    journal = sut.EventJournal(path)
+    sut.create_events(fake.build_service(), make_events(3), calendar_id, journal=journal)
+    journal.close()
+    with open(path) as f:
+        entries = [json.loads(line) for line in f]
+    assert entries == [{'key': key, 'id': e['id']}
+        for (key, e) in zip(['2022-10-01:0', '2022-10-02:0', '2022-10-03:0'], fake.get_events(calendar_id))]
+
+def test_resume_skips_created_events(tmp_path):
+    fake = FakeCalendarHttp(latency=interrupt_at(4))
+    calendar_id = fake.add_calendar('Journaled')
+    path = str(tmp_path / 'journal.jsonl')
+    journal = sut.EventJournal(path)
+    with pytest.raises(KeyboardInterrupt):
+        sut.create_events(fake.build_service(), make_events(6), calendar_id, journal=journal)
+    journal.close()
+
+    fake.latency = 0
+    journal = sut.EventJournal(path, resume=True)
+    assert len(journal) == 3
+    sut.create_events(fake.build_service(), make_events(6), calendar_id, journal=journal)
+    journal.close()
+    # The interrupted insert went through, so Test3 is created again
+    assert summaries(fake, calendar_id) == ['Test0', 'Test1', 'Test2', 'Test3', 'Test3', 'Test4', 'Test5']
+    assert len(sut.EventJournal(path, resume=True)) == 6
+
+# A batch that gives up still journals the events created by its other sub-requests
+def test_records_batched_events_when_batch_fails(tmp_path):
+    fake = FakeCalendarHttp(errors=[(403, 'rateLimitExceeded')])
+    calendar_id = fake.add_calendar('Batched')
+    path = str(tmp_path / 'journal.jsonl')
+    journal = sut.EventJournal(path)
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.create_events(fake.build_service(), make_events(5), calendar_id, batch_size=5,
+            retry_policy=sut.RetryPolicy(max_retries=0), journal=journal)
+    journal.close()
+    assert exc_info.value.message.startswith('retry limit exceeded')
+    assert len(fake.get_events(calendar_id)) == 4
+
+    journal = sut.EventJournal(path, resume=True)
+    assert len(journal) == 4
+    sut.create_events(fake.build_service(), make_events(5), calendar_id, batch_size=5, journal=journal)
+    journal.close()
+    assert sorted(e['summary'] for e in fake.get_events(calendar_id)) == ['Test{}'.format(i) for i in range(5)]
+
+def test_resume_with_workers(tmp_path):
+    fake = FakeCalendarHttp()
+    calendar_id = fake.add_calendar('Journaled')
+    path = str(tmp_path / 'journal.jsonl')
+    journal = sut.EventJournal(path, fsync_every=4)
+    sut.create_events(fake.build_service(), make_events(20), calendar_id, concurrency=3, journal=journal)
+    journal.close()
+    sut.create_events(fake.build_service(), make_events(25), calendar_id, journal=sut.EventJournal(path, resume=True))
+    assert fake.method_counts['events.insert'] == 25
+    assert summaries(fake, calendar_id) == ['Test{}'.format(i) for i in range(25)]
+
+def test_ignores_partially_written_line(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    path.write_text('{"key": "2022-10-01:0", "id": "a"}\n{"key": "2022-10-0')
+    journal = sut.EventJournal(str(path), resume=True)
+    assert '2022-10-01:0' in journal
+    assert len(journal) == 1
+
+def test_without_resume_starts_over(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    path.write_text('{"key": "2022-10-01:0", "id": "a"}\n')
+    journal = sut.EventJournal(str(path))
+    assert len(journal) == 0
+    journal.close()
+    assert path.read_text() == ''
+
+def test_journal_per_calendar(tmp_path):
+    a = sut.EventJournal.for_calendar(str(tmp_path), 'cal-a')
+    b = sut.EventJournal.for_calendar(str(tmp_path), 'cal-b')
+    assert a.path != b.path
+    assert a.path.startswith(str(tmp_path))
+
+def test_no_cache_writes_no_journal(fake):
+    run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--no-cache')
+    assert len(fake.get_events(fake.calendar_id('Marathon'))) == 6
+    assert not os.path.exists(fake.cache_dir)
+
+def test_resume_with_no_cache_requires_journal():
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.parse_arguments(['Marathon', '2022-10-15', '-f', 'plan.csv', '--resume', '--no-cache'])
+    assert exc_info.value.message == '--resume requires --journal when used with --no-cache'
@@ -0,0 +1,55 @@
+from training_calendar import training_calendar as sut
+from conftest import get_test_file
+from datetime import datetime, timedelta
+import pytest
+
+def make_events(summaries, start=datetime(2022, 10, 1)):
+    return [
+        sut.Event(start=start + timedelta(days=i), end=start + timedelta(days=i+1), properties={'summary': s, 'description': 'Desc', 'week': '1'})
+        for (i,s) in enumerate(summaries)]
+
+def test_rows_match_events():
+    events = list(sut.load_events_from_file(get_test_file('column-names-variable-case.csv'), {}, '2022-10-15', False))
+    table = sut.EventTable.from_events(events)
+    assert len(table) == len(events)
+    for event, row in zip(events, table):
+        assert row.start == event.start
+        assert row.end == event.end
+        assert row.properties == event.properties
+        assert row.build() == event.build()
+        assert str(row) == str(event)
+        assert row.is_empty() == event.is_empty()
+
+def test_interns_repeated_values():
+    table = sut.EventTable.from_events(make_events(['REST', 'Run', 'REST', 'REST', 'Run']))
+    assert table.values['summary'] == ['REST', 'Run']
+    assert list(table.columns['summary']) == [0, 1, 0, 0, 1]
+    assert table.values['description'] == ['Desc']
+
+def test_drops_unretained_and_keeps_missing_properties():
+    events = make_events(['REST'])
+    events.append(sut.Event(start=datetime(2022, 10, 2), end=datetime(2022, 10, 3), properties={'summary': ''}))
+    table = sut.EventTable.from_events(events)
+    assert table[0].properties == {'summary': 'REST', 'description': 'Desc'}
+    assert table[1].properties == {'summary': ''}
+    assert table[1].is_empty()
+    assert not table[0].is_empty()
+
+def test_indexing():
+    table = sut.EventTable.from_events(make_events(['A', 'B', 'C']))
+    assert table[-1].properties['summary'] == 'C'
+    with pytest.raises(IndexError):
+        table[3]
+
+def test_shifted():
+    table = sut.EventTable.from_events(make_events(['A', 'B']))
+    shifted = table.shifted(10)
+    assert shifted[0].start == datetime(2022, 10, 11)
+    assert shifted[1].end == datetime(2022, 10, 13)
+    assert shifted[1].properties['summary'] == 'B'
+    assert table[0].start == datetime(2022, 10, 1)
+
+def test_rows_use_slots():
+    table = sut.EventTable.from_events(make_events(['A']))
+    with pytest.raises(AttributeError):
+        table[0].foo = 1
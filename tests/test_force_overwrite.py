@@ -0,0 +1,70 @@
+from training_calendar import training_calendar as sut
+from conftest import GOLDEN_EVENTS, get_test_file, run_main
+import datetime
+import pytest
+
+def run_force(fake, *args):
+    run_main(fake, 'Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--force', *args)
+
+def make_events(num_events, first_day='2022-10-11', num_days=6, summary='Old'):
+    first_day = datetime.date.fromisoformat(first_day)
+    events = []
+    for i in range(num_events):
+        day = first_day + datetime.timedelta(days=i % num_days)
+        events.append({ 'summary': '{}{}'.format(summary, i),
+            'start': { 'date': day.isoformat() }, 'end': { 'date': (day + datetime.timedelta(days=1)).isoformat() } })
+    return events
+
+def summaries(fake, calendar_id):
+    return sorted((e['start']['date'], e['summary']) for e in fake.get_events(calendar_id))
+
+def test_recreates_calendar_holding_only_the_plans_dates(fake, capsys):
+    calendar_id = fake.add_calendar('Marathon')
+    fake.add_events(calendar_id, make_events(500))
+    run_force(fake, '--page-size', '250')
+    new_calendar_id = fake.calendar_id('Marathon')
+    assert new_calendar_id != calendar_id
+    assert summaries(fake, new_calendar_id) == GOLDEN_EVENTS
+    assert fake.method_counts['calendars.delete'] == 1
+    assert 'events.delete' not in fake.method_counts
+    out = capsys.readouterr().out
+    assert "500 of its events fall on the plan's dates, 0 don't" in out
+    assert 'Strategy: Recreating the calendar (2 calls; its id changes) rather than deleting the events (10 calls in batches of 50); estimated 4 calls, including 2 to list the events' in out
+
+def test_deletes_events_in_batches_when_others_must_be_kept(fake, capsys):
+    calendar_id = fake.add_calendar('Marathon')
+    fake.add_events(calendar_id, make_events(120) + make_events(2, first_day='2022-09-01', summary='Keep'))
+    run_force(fake, '--batch-size', '40')
+    assert fake.calendar_id('Marathon') == calendar_id
+    assert summaries(fake, calendar_id) == [('2022-09-01', 'Keep0'), ('2022-09-02', 'Keep1')] + GOLDEN_EVENTS
+    assert fake.method_counts['events.delete'] == 120
+    assert 'calendars.delete' not in fake.method_counts
+    assert "would remove the events outside the plan's dates too" in capsys.readouterr().out
+
+def test_deletes_few_events_rather_than_recreating(fake):
+    calendar_id = fake.add_calendar('Marathon')
+    fake.add_events(calendar_id, make_events(3))
+    run_force(fake)
+    assert fake.calendar_id('Marathon') == calendar_id
+    assert summaries(fake, calendar_id) == GOLDEN_EVENTS
+    assert fake.method_counts['events.delete'] == 3
+
+def test_what_if_prints_plan_and_changes_nothing(fake, capsys):
+    calendar_id = fake.add_calendar('Marathon')
+    fake.add_events(calendar_id, make_events(500))
+    run_force(fake, '--what-if')
+    assert fake.calendar_id('Marathon') == calendar_id
+    assert len(fake.get_events(calendar_id)) == 500
+    assert 'calendars.delete' not in fake.method_counts
+    assert 'WHAT-IF: Strategy: Recreating the calendar' in capsys.readouterr().out
+
+def test_new_calendar_needs_no_overwrite(fake, capsys):
+    run_force(fake)
+    assert summaries(fake, fake.calendar_id('Marathon')) == GOLDEN_EVENTS
+    assert 'Overwriting' not in capsys.readouterr().out
+
+@pytest.mark.parametrize('other', [['--sync'], ['--resume'], ['--output-ics', 'plan.ics']])
+def test_force_conflicts(other):
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.parse_arguments(['Marathon', '2022-10-15', '-f', 'plan.csv', '--force'] + other)
+    assert exc_info.value.message == '--force can\'t be used with {}'.format(other[0])
@@ -0,0 +1,118 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import FakeCalendarHttp
+from googleapiclient.discovery import build
+import httplib2
+import json
+import threading
+import pytest
+
+class FakeConnection:
+    on_request = None
+
+    def __init__(self, credentials, timeout):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.in_use = False
+        self.closed = False
+        self.requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        assert not self.in_use, 'connection used by two requests at once'
+        self.in_use = True
+        try:
+            self.requests.append(headers)
+            if self.on_request:
+                self.on_request()
+            return httplib2.Response({'status': 200}), b'{}'
+        finally:
+            self.in_use = False
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+    def new_connection(credentials, timeout=None):
+        opened.append(FakeConnection(credentials, timeout))
+        return opened[-1]
+    monkeypatch.setattr(sut, 'new_authorized_http', new_connection)
+    return opened
+
+def test_reuses_idle_connection(connections):
+    pool = sut.HttpPool('creds', timeout=5)
+    for _ in range(3):
+        pool.request('https://example.com/')
+    assert len(connections) == 1
+    assert len(connections[0].requests) == 3
+    assert (connections[0].credentials, connections[0].timeout) == ('creds', 5)
+
+def test_concurrent_requests_get_their_own_connections(connections, monkeypatch):
+    pool = sut.HttpPool('creds', max_idle=2)
+    barrier = threading.Barrier(4, timeout=5)
+    monkeypatch.setattr(FakeConnection, 'on_request', staticmethod(lambda: barrier.wait()))
+    threads = [threading.Thread(target=pool.request, args=('https://example.com/',)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(connections) == 4
+    assert sum(c.closed for c in connections) == 2
+    assert len(pool.idle) == 2
+
+def test_asks_for_gzip(connections):
+    pool = sut.HttpPool('creds')
+    pool.request('https://example.com/', headers={'content-type': 'multipart/mixed'})
+    pool.request('https://example.com/', headers={'user-agent': 'client/1.0', 'accept-encoding': 'gzip'})
+    pool.request('https://example.com/', headers={'user-agent': '(gzip)'})
+    assert [(h['accept-encoding'], h['user-agent']) for h in connections[0].requests] == [
+        ('gzip, deflate', '(gzip)'), ('gzip', 'client/1.0 (gzip)'), ('gzip, deflate', '(gzip)')]
+
+def test_close_closes_idle_connections(connections):
+    pool = sut.HttpPool('creds')
+    pool.request('https://example.com/')
+    pool.close()
+    assert connections[0].closed
+    assert pool.idle == []
+
+@pytest.mark.parametrize('batch_size', [None, 10])
+def test_service_can_be_shared_by_workers(monkeypatch, batch_size):
+    fake = FakeCalendarHttp(latency=0.001)
+    monkeypatch.setattr(sut, 'new_authorized_http', lambda credentials, timeout=None: fake)
+    pool = sut.HttpPool(None)
+    service = build('calendar', 'v3', http=pool, static_discovery=True)
+    calendar_id = fake.add_calendar('Pooled')
+    events = sut.EventTable.from_events(
+        sut.Event(sut.datetime.datetime(2022, 1, 1) + sut.datetime.timedelta(days=i),
+            sut.datetime.datetime(2022, 1, 2) + sut.datetime.timedelta(days=i), {'summary': 'Run {}'.format(i)})
+        for i in range(40))
+    assert sut.create_events(service, events, calendar_id, batch_size=batch_size, concurrency=4) == 40
+    assert len(fake.get_events(calendar_id)) == 40
+    assert 1 <= len(pool.idle) <= 4
+
+# Batch requests check & apply the pool's credentials themselves (see CredentialManager)
+def test_batch_requests_use_credential_manager(monkeypatch, tmp_path):
+    from google_auth_httplib2 import AuthorizedHttp
+    token_path = str(tmp_path / 'token.json')
+    expiry = sut.get_utc_now() + sut.datetime.timedelta(hours=1)
+    with open(token_path, 'w') as f:
+        json.dump({'token': 'saved', 'refresh_token': 'refresh', 'client_id': 'client', 'client_secret': 'secret',
+            'expiry': expiry.strftime('%Y-%m-%dT%H:%M:%SZ')}, f)
+    fake = FakeCalendarHttp()
+    sent = []
+    def request(uri, method='GET', body=None, headers=None, *args, **kwargs):
+        sent.append((headers, body))
+        return FakeCalendarHttp.request(fake, uri, method, body, headers, *args, **kwargs)
+    monkeypatch.setattr(fake, 'request', request)
+    monkeypatch.setattr(sut, 'new_authorized_http', lambda credentials, timeout=None: AuthorizedHttp(credentials, http=fake))
+    manager = sut.CredentialManager(token_path).start()
+    manager.close()
+    service = build('calendar', 'v3', http=sut.HttpPool(manager), static_discovery=True)
+    calendar_id = fake.add_calendar('Batched')
+    events = [sut.Event(sut.datetime.datetime(2022, 1, 1) + sut.datetime.timedelta(days=i),
+        sut.datetime.datetime(2022, 1, 2) + sut.datetime.timedelta(days=i), {'summary': 'Run {}'.format(i)}) for i in range(5)]
+    assert sut.create_events(service, events, calendar_id, batch_size=5) == 5
+    assert len(fake.get_events(calendar_id)) == 5
+    headers, body = sent[-1]
+    assert headers['authorization'] == 'Bearer saved'
+    assert (body.decode('utf-8') if isinstance(body, bytes) else body).lower().count('authorization: bearer saved') == 5
@@ -0,0 +1,127 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import make_template_events
+from conftest import get_test_file, run_main
+from datetime import datetime, timedelta
+import pytest
+import re
+
+def make_events(summaries, start=datetime(2022, 10, 1)):
+    return [
+        sut.Event(start=start + timedelta(days=i), end=start + timedelta(days=i+1), properties={'summary': s})
+        for i,s in enumerate(summaries)]
+
+def read_lines(ics_path):
+    with open(ics_path, 'rb') as f:
+        content = f.read()
+    assert content.endswith(b'\r\n')
+    return content.decode('utf-8').split('\r\n')[:-1]
+
+def unfold(lines):
+    unfolded = []
+    for line in lines:
+        if line.startswith(' '):
+            unfolded[-1] += line[1:]
+        else:
+            unfolded.append(line)
+    return unfolded
+
+def write_ics(tmp_path, events, tag=None, name='Marathon'):
+    ics_path = str(tmp_path / 'plan.ics')
+    writer = sut.IcsEventWriter(ics_path, name, tag)
+    try:
+        num_written = writer.write(events)
+    finally:
+        writer.close()
+    return num_written, read_lines(ics_path)
+
+def test_writes_all_day_events(tmp_path):
+    num_written, lines = write_ics(tmp_path, make_events(['Run', 'Swim']), tag='IM2020')
+    assert num_written == 2
+    assert lines[0] == 'BEGIN:VCALENDAR'
+    assert lines[-1] == 'END:VCALENDAR'
+    events = '\n'.join(lines).split('BEGIN:VEVENT')[1:]
+    assert len(events) == 2
+    assert 'DTSTART;VALUE=DATE:20221001\nDTEND;VALUE=DATE:20221002\nSUMMARY:Run\nCATEGORIES:IM2020\nEND:VEVENT' in events[0]
+    assert 'DTSTART;VALUE=DATE:20221002' in events[1]
+
+def test_uids_are_unique_and_stable(tmp_path):
+    events = make_events(['Run', 'Swim'])
+    events.append(sut.Event(start=events[0].start, end=events[0].end, properties={'summary': 'Bike'}))
+    _, first = write_ics(tmp_path, events)
+    _, second = write_ics(tmp_path, events)
+    uids = [l for l in first if l.startswith('UID:')]
+    assert len(set(uids)) == 3
+    assert uids == [l for l in second if l.startswith('UID:')]
+
+def test_skips_empty_events(tmp_path):
+    num_written, lines = write_ics(tmp_path, make_events(['Run', '', 'Swim']))
+    assert num_written == 2
+    assert lines.count('BEGIN:VEVENT') == 2
+
+def test_escapes_text(tmp_path):
+    events = make_events(['Run; easy, then stretch'])
+    events[0].properties['description'] = 'Line one\nLine two \\ done'
+    _, lines = write_ics(tmp_path, events)
+    assert 'SUMMARY:Run\\; easy\\, then stretch' in lines
+    assert 'DESCRIPTION:Line one\\nLine two \\\\ done' in lines
+
+@pytest.mark.parametrize('summary', ['x' * 200, 'é' * 100, 'ab🏃' * 40])
+def test_folds_long_lines(tmp_path, summary):
+    _, lines = write_ics(tmp_path, make_events([summary]))
+    assert all(len(l.encode('utf-8')) <= 75 for l in lines)
+    assert 'SUMMARY:' + summary in unfold(lines)
+
+def test_main_writes_ics_without_api(monkeypatch, tmp_path):
+    def no_service(*args):
+        raise AssertionError('--output-ics with --file should not need the API')
+    monkeypatch.setattr(sut, 'get_calendar_service', no_service)
+    ics_path = str(tmp_path / 'marathon.ics')
+    sut.main(['Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--output-ics', ics_path, '-t', 'M22'])
+    lines = read_lines(ics_path)
+    assert [l for l in lines if l.startswith('SUMMARY:')] == \
+        ['SUMMARY:Test0', 'SUMMARY:Test1', 'SUMMARY:Test2', 'SUMMARY:Test3', 'SUMMARY:RACE DAY', 'SUMMARY:Test5']
+    assert 'DTSTART;VALUE=DATE:20221015' in lines
+    assert lines.count('CATEGORIES:M22') == 6
+
+# The plan isn't compiled (or held in memory), the events go straight from the file to the
+# ICS file
+def test_main_streams_file_to_ics(monkeypatch, tmp_path):
+    def no_plan(*args):
+        raise AssertionError('--output-ics should stream the events')
+    monkeypatch.setattr(sut, 'load_file_plan', no_plan)
+    ics_path = str(tmp_path / 'marathon.ics')
+    sut.main(['Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--output-ics', ics_path, '--no-cache'])
+    assert read_lines(ics_path).count('BEGIN:VEVENT') == 6
+
+def test_main_streams_template_to_ics(fake, monkeypatch, tmp_path):
+    def no_plan(*args):
+        raise AssertionError('--output-ics should stream the events')
+    monkeypatch.setattr(sut, 'load_calendar_plan', no_plan)
+    fake.add_events(fake.add_calendar('Template'), make_template_events(30, race_day_index=20))
+    ics_path = str(tmp_path / 'marathon.ics')
+    run_main(fake, 'Marathon', '2022-10-15', '-c', 'Template', '--output-ics', ics_path, '--page-size', '10')
+    lines = read_lines(ics_path)
+    assert lines.count('BEGIN:VEVENT') == 30
+    assert lines[lines.index('SUMMARY:RACE DAY') - 2] == 'DTSTART;VALUE=DATE:20221015'
+
+# Reports go to stderr when the ICS file goes to stdout, so stdout holds just the calendar
+def test_main_writes_only_ics_to_stdout(capsys, tmp_path):
+    plan = tmp_path / 'plan.csv'
+    plan.write_text('summary\nRun\nRun\n""\nRun\nRun\nRACE DAY\n')
+    sut.main(['Marathon', '2022-10-15', '-f', str(plan), '--output-ics', '--', '--compress', '--profile', '--no-cache'])
+    out, err = capsys.readouterr()
+    assert out.endswith('\r\n')
+    lines = out.split('\r\n')[:-1]
+    assert lines[0] == 'BEGIN:VCALENDAR' and lines[-1] == 'END:VCALENDAR'
+    assert lines.count('BEGIN:VCALENDAR') == 1
+    assert all(re.match(r'^[A-Z-]+[;:]', l) for l in lines)
+    assert 'RRULE:FREQ=DAILY;COUNT=5' in lines and 'EXDATE;VALUE=DATE:20221012' in lines
+    assert 'Skipping empty event' in err
+    assert 'Compressed 5 events into 2 (1 recurring)' in err
+    assert 'Phases (seconds):' in err
+
+@pytest.mark.parametrize('args', [['--sync'], ['--manifest', 'jobs.csv']])
+def test_output_ics_conflicts(args):
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.parse_arguments(['Marathon', '2022-10-15', '-f', './test.csv', '--output-ics', 'out.ics'] + args)
+    assert exc_info.value.message.startswith("--output-ics can't be used with")
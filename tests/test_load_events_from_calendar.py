@@ -0,0 +1,78 @@
+from training_calendar import training_calendar as sut
+from datetime import datetime, timedelta
+import pytest
+
+DATE_FORMAT = '%Y-%m-%d'
+
+def make_template(n, race_day_index, start=datetime(2020, 1, 1)):
+    events = []
+    for i in range(n):
+        day = start + timedelta(days=i)
+        events.append({
+            'summary': 'RACE DAY' if i == race_day_index else 'Test{}'.format(i),
+            'start': {'date': day.strftime(DATE_FORMAT)},
+            'end': {'date': (day + timedelta(days=1)).strftime(DATE_FORMAT)},
+        })
+    return events
+
+def add_template(fake, template):
+    calendar_id = fake.add_calendar('Template')
+    fake.add_events(calendar_id, template)
+    return calendar_id
+
+# The (maxResults, pageToken) of each listing of a calendar's events
+def list_calls(fake):
+    return [(params['maxResults'], params.get('pageToken')) for params in fake.get_calls('events.list')]
+
+def test_get_events_follows_page_tokens(fake):
+    calendar_id = add_template(fake, make_template(25, 3))
+    events = list(sut.get_events_for_calendar(fake.build_service(), calendar_id, page_size=10))
+    assert [e['summary'] for e in events] == [e['summary'] for e in make_template(25, 3)]
+    assert list_calls(fake) == [('10', None), ('10', '10'), ('10', '20')]
+
+def test_get_events_is_lazy(fake):
+    calendar_id = add_template(fake, make_template(25, 3))
+    events = sut.get_events_for_calendar(fake.build_service(), calendar_id, page_size=10)
+    next(events)
+    assert len(list_calls(fake)) == 1
+
+def test_get_events_stops_at_num_events(fake):
+    calendar_id = add_template(fake, make_template(25, 3))
+    events = list(sut.get_events_for_calendar(fake.build_service(), calendar_id, num_events=12, page_size=10))
+    assert len(events) == 12
+    assert list_calls(fake) == [('10', None), ('2', '10')]
+
+def test_load_shifts_events_across_pages(fake):
+    add_template(fake, make_template(30, 20))
+    events = list(sut.load_events_from_calendar(fake.build_service(), 'Template', '2022-10-15', False, page_size=7))
+    assert len(events) == 30
+    race_date = datetime.strptime('2022-10-15', DATE_FORMAT)
+    for i,e in enumerate(events):
+        assert e.start == race_date + timedelta(days=i-20)
+        assert e.end == e.start + timedelta(days=1)
+    assert events[20].properties['summary'] == 'RACE DAY'
+
+def test_load_ends_on_race_day(fake):
+    add_template(fake, make_template(12, -1))
+    events = list(sut.load_events_from_calendar(fake.build_service(), 'Template', '2022-10-15', True, page_size=5))
+    assert events[-1].start == datetime.strptime('2022-10-15', DATE_FORMAT)
+
+def test_load_raises_on_missing_template(fake):
+    add_template(fake, [])
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.load_events_from_calendar(fake.build_service(), 'Other', '2022-10-15', False)
+    assert exc_info.value.message.startswith("template calendar 'Other' does not exist")
+
+def test_load_raises_on_no_race_day(fake):
+    add_template(fake, make_template(12, -1))
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.load_events_from_calendar(fake.build_service(), 'Template', '2022-10-15', False)
+    assert exc_info.value.message.startswith('no race day detected')
+
+def test_load_raises_on_second_race_day(fake):
+    template = make_template(12, 3)
+    template[8]['summary'] = 'RACE DAY'
+    add_template(fake, template)
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        list(sut.load_events_from_calendar(fake.build_service(), 'Template', '2022-10-15', False, page_size=5))
+    assert exc_info.value.message.startswith("multiple events with summary 'RACE DAY' found")
@@ -159,3 +159,44 @@ def test_remap_is_coerced_to_lowercase():
             assert e.properties['summary'] == 'RACE DAY'
         else:
             assert e.properties['summary'] == 'Test{}'.format(i)
+
+# The same compiled plan the command line creates calendars from
+def test_returns_compiled_plan():
+    test_file = get_test_file('golden.csv')
+    events = sut.load_events_from_file(test_file, {}, '2022-10-15', False)
+    assert isinstance(events, sut.EventTable)
+    assert events[0].properties['summary'] == 'Test0'
+    assert events[0].start == datetime.strptime('2022-10-11', DATE_FORMAT)
+
+def test_stream_events_from_file_is_lazy():
+    test_file = get_test_file('golden.csv')
+    events = sut.stream_events_from_file(test_file, {}, '2022-10-15', False)
+    assert not isinstance(events, list)
+    first = next(events)
+    assert first.properties['summary'] == 'Test0'
+    assert first.start == datetime.strptime('2022-10-11', DATE_FORMAT)
+
+def test_reads_from_stdin(monkeypatch):
+    with open(get_test_file('golden.csv')) as f:
+        monkeypatch.setattr(sut.sys, 'stdin', io.StringIO(f.read()))
+    events = list(sut.load_events_from_file('--', {}, '2022-10-15', False))
+    assert len(events) == 6
+    assert events[4].properties['summary'] == 'RACE DAY'
+    assert events[4].start == datetime.strptime('2022-10-15', DATE_FORMAT)
+
+def test_skips_blank_lines_and_pads_short_rows(monkeypatch):
+    monkeypatch.setattr(sut.sys, 'stdin', io.StringIO('summary,description\nTest0,Desc0\n\nRACE DAY\nTest2,Desc2\n'))
+    events = list(sut.load_events_from_file('--', {}, '2022-10-15', False))
+    assert [e.properties['summary'] for e in events] == ['Test0', 'RACE DAY', 'Test2']
+    assert events[1].properties['description'] is None
+    assert events[2].start == datetime.strptime('2022-10-16', DATE_FORMAT)
+
+def test_raises_on_multiple_race_days(monkeypatch):
+    monkeypatch.setattr(sut.sys, 'stdin', io.StringIO('summary\nRACE DAY\nTest1\nRACE DAY\n'))
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.load_events_from_file('--', {}, '2022-10-15', False)
+    assert 'second found in entry 3' in exc_info.value.message
+
+def test_compile_column_map_uses_header_positions():
+    compiled = sut.compile_column_map(['Foobar', 'Description', 'Notes'], {'foobar': 'summary', 'NOTES': 'description', 'description': 'notes'}, 'x.csv')
+    assert compiled == {'summary': 0, 'description': 2, 'notes': 1}
@@ -0,0 +1,107 @@
+from training_calendar import training_calendar as sut
+from os import path
+import json
+import threading
+import pytest
+
+def write(tmp_path, name, content):
+    p = tmp_path / name
+    p.write_text(content)
+    return str(p)
+
+def test_parse_arguments_allows_manifest_alone():
+    inputs = sut.parse_arguments(['--manifest', 'jobs.csv', '--jobs', '4'])
+    assert inputs['manifest'] == 'jobs.csv'
+    assert inputs['jobs'] == 4
+
+def test_load_csv_manifest(tmp_path):
+    manifest = write(tmp_path, 'jobs.csv',
+        'Name,Race Day,File,Tag,Ends-On-Race-Day\n'
+        'Alex,2022-10-15,plan.csv,A,yes\n'
+        'Sam,2022-11-15,,,\n')
+    jobs = sut.load_manifest(manifest)
+    assert jobs == [
+        {'name': 'Alex', 'race_day': '2022-10-15', 'file': str(tmp_path / 'plan.csv'), 'tag': 'A', 'ends_on_race_day': True},
+        {'name': 'Sam', 'race_day': '2022-11-15'}]
+
+def test_load_json_manifest(tmp_path):
+    manifest = write(tmp_path, 'jobs.json', json.dumps([
+        {'name': 'Alex', 'race_day': '2022-10-15', 'template': 'Template', 'ends_on_race_day': False}]))
+    assert sut.load_manifest(manifest) == [
+        {'name': 'Alex', 'race_day': '2022-10-15', 'template_calendar_name': 'Template', 'ends_on_race_day': False}]
+
+def test_manifest_flags_are_parsed(tmp_path):
+    manifest = write(tmp_path, 'jobs.csv',
+        'name,race_day,file,force,sync,what_if,compress,batch_size\n'
+        'Alex,2022-10-15,plan.csv,false,no,0,True,25\n')
+    job = sut.load_manifest(manifest)[0]
+    assert (job['force'], job['sync'], job['what_if'], job['compress'], job['batch_size']) == (False, False, False, True, 25)
+
+@pytest.mark.parametrize('header,value,message', [
+    ('force', 'maybe', 'manifest entry 1: force must be true or false (got maybe)'),
+    ('batch_size', '0', 'manifest entry 1: batch_size must be a positive integer (got 0)'),
+    ('Token', 'token.json', 'manifest entry 1: unknown field: Token (file: '),
+])
+def test_bad_manifest_fields(tmp_path, header, value, message):
+    manifest = write(tmp_path, 'jobs.csv', 'name,race_day,{}\nAlex,2022-10-15,{}\n'.format(header, value))
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.load_manifest(manifest)
+    assert exc_info.value.message.startswith(message)
+
+def test_job_inputs_take_defaults_from_command_line():
+    inputs = {'manifest': 'jobs.csv', 'template_calendar_name': 'Template', 'batch_size': 50, 'journal': 'j'}
+    job = sut.get_job_inputs(inputs, {'name': 'Alex', 'race_day': '2022-10-15'}, 0)
+    assert job == {'template_calendar_name': 'Template', 'batch_size': 50, 'name': 'Alex', 'race_day': '2022-10-15'}
+
+def test_job_source_overrides_command_line_source():
+    inputs = {'manifest': 'jobs.csv', 'template_calendar_name': 'Template'}
+    job = sut.get_job_inputs(inputs, {'name': 'Alex', 'race_day': '2022-10-15', 'file': 'plan.csv'}, 0)
+    assert job['file'] == 'plan.csv'
+    assert 'template_calendar_name' not in job
+
+@pytest.mark.parametrize('job,message', [
+    ({'race_day': '2022-10-15', 'file': 'plan.csv'}, 'manifest entry 3: missing required field: name'),
+    ({'name': 'Alex', 'file': 'plan.csv'}, 'manifest entry 3: missing required field: race_day'),
+    ({'name': 'Alex', 'race_day': '2022-10-15'}, 'manifest entry 3: exactly one of file or template_calendar_name required (got neither)'),
+    ({'name': 'Alex', 'race_day': '2022-10-15', 'file': 'plan.csv', 'force': True, 'sync': True},
+        "manifest entry 3: --force can't be used with --sync"),
+    ({'name': 'Alex', 'race_day': '2022-10-15', 'file': 'plan.csv', 'compress': True, 'sync': True},
+        "manifest entry 3: --compress can't be used with --sync"),
+])
+def test_job_inputs_validated(job, message):
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.get_job_inputs({}, job, 2)
+    assert exc_info.value.message == message
+
+def test_run_manifest_reports_each_job(tmp_path, monkeypatch):
+    manifest = write(tmp_path, 'jobs.csv', 'name,race_day\nAlex,2022-10-15\nBroken,2022-10-15\nSam,2022-11-15\n')
+    report = str(tmp_path / 'report.json')
+    shared = []
+    def fake_run_job(service, inputs, cache, limiter, retry_policy, plan_cache=None, stream_template=True):
+        shared.append((service, cache, limiter))
+        if inputs['name'] == 'Broken':
+            sut.exit_with_error('something went wrong')
+        return {'calendar_id': inputs['name'] + '-id', 'events': 3}
+    monkeypatch.setattr(sut, 'run_job', fake_run_job)
+
+    inputs = {'manifest': manifest, 'template_calendar_name': 'Template', 'jobs': 2, 'report': report}
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.run_manifest('service', inputs, 'cache', 'limiter')
+    assert exc_info.value.message == '1 of 3 jobs failed'
+    assert shared == [('service', 'cache', 'limiter')] * 3
+
+    with open(report) as f:
+        reports = json.load(f)
+    assert [(r['name'], r['status'], r.get('calendar_id')) for r in reports] == [
+        ('Alex', 'ok', 'Alex-id'), ('Broken', 'failed', None), ('Sam', 'ok', 'Sam-id')]
+    assert reports[1]['error'] == 'something went wrong'
+
+def test_run_manifest_runs_jobs_concurrently(tmp_path, monkeypatch):
+    manifest = write(tmp_path, 'jobs.csv', 'name,race_day\nA,2022-10-15\nB,2022-10-15\nC,2022-10-15\n')
+    barrier = threading.Barrier(3, timeout=5)
+    def fake_run_job(service, inputs, cache, limiter, retry_policy, plan_cache=None, stream_template=True):
+        barrier.wait()
+        return {'calendar_id': 'id', 'events': 0}
+    monkeypatch.setattr(sut, 'run_job', fake_run_job)
+    reports = sut.run_manifest(None, {'manifest': manifest, 'file': 'plan.csv', 'jobs': 3})
+    assert [r['status'] for r in reports] == ['ok'] * 3
@@ -0,0 +1,86 @@
+from training_calendar import training_calendar as sut
+from conftest import get_test_file
+import json
+import pytest
+
+@pytest.fixture(autouse=True)
+def metrics():
+    sut.METRICS.reset()
+    yield sut.METRICS
+    sut.METRICS.reset()
+
+def test_counters_are_keyed_by_labels(metrics):
+    metrics.inc('api_requests_total', method='a', status='200')
+    metrics.inc('api_requests_total', status='200', method='a')
+    metrics.inc('api_requests_total', method='b', status='200')
+    assert metrics.get('api_requests_total', method='a', status='200') == 2
+    assert metrics.get('api_requests_total', method='b', status='200') == 1
+    assert metrics.get('api_requests_total', method='c', status='200') == 0
+
+def test_histogram_quantiles_come_from_buckets():
+    metrics = sut.Metrics(buckets=(0.1, 1.0, 10.0))
+    for seconds in [0.05] * 90 + [0.5] * 9 + [20.0]:
+        metrics.observe('api_request_seconds', seconds, method='a')
+    histogram = metrics.to_json()['histograms']['api_request_seconds'][0]
+    assert histogram['count'] == 100
+    assert histogram['p50'] == 0.1
+    assert histogram['p99'] == 1.0
+    assert histogram['buckets'] == { '0.1': 90, '1.0': 99, '10.0': 99, '+Inf': 100 }
+
+def test_prometheus_format():
+    metrics = sut.Metrics(buckets=(0.1, 1.0))
+    metrics.inc('retries_total', error='503')
+    metrics.observe('api_request_seconds', 0.5, method='calendar.events.insert')
+    assert metrics.to_prometheus().splitlines() == [
+        '# TYPE training_calendar_retries_total counter',
+        'training_calendar_retries_total{error="503"} 1',
+        '# TYPE training_calendar_api_request_seconds histogram',
+        'training_calendar_api_request_seconds_bucket{method="calendar.events.insert",le="0.1"} 0',
+        'training_calendar_api_request_seconds_bucket{method="calendar.events.insert",le="1.0"} 1',
+        'training_calendar_api_request_seconds_bucket{method="calendar.events.insert",le="+Inf"} 1',
+        'training_calendar_api_request_seconds_sum{method="calendar.events.insert"} 0.5',
+        'training_calendar_api_request_seconds_count{method="calendar.events.insert"} 1',
+    ]
+
+def test_records_backoff(metrics, monkeypatch):
+    monkeypatch.setattr(sut.time, 'sleep', lambda s: None)
+    errors = [ConnectionResetError()]
+    def call():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    sut.RetryPolicy(base_delay=0.5).call(call)
+    assert metrics.get('retries_total', error='ConnectionResetError') == 1
+    assert 0 <= metrics.get('backoff_seconds_total') <= 0.5
+
+def test_metrics_file_records_calls_and_phases(fake, tmp_path):
+    metrics_file = str(tmp_path / 'metrics.json')
+    fake.errors = [(503, 'backendError')]
+    sut.main(['Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--cache-dir', fake.cache_dir,
+              '--metrics-file', metrics_file])
+    with open(metrics_file) as f:
+        report = json.load(f)
+    requests = { (c['labels']['method'], c['labels']['status']): c['value'] for c in report['counters']['api_requests_total'] }
+    assert requests[('calendar.events.insert', '200')] == 6
+    assert requests[('calendar.calendars.insert', '200')] == 1
+    assert sum(v for ((m, status), v) in requests.items() if status == '503') == 1
+    assert { c['labels']['phase'] for c in report['counters']['phase_seconds_total'] } == \
+        { 'load', 'calendar_lookup', 'calendar_create', 'insert', 'total' }
+    assert [c['value'] for c in report['counters']['retries_total']] == [1]
+    assert all(c['value'] > 0 for c in report['counters']['api_received_bytes_total'])
+
+def test_batched_calls_are_metered(fake, tmp_path):
+    metrics_file = str(tmp_path / 'metrics.prom')
+    sut.main(['Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--cache-dir', fake.cache_dir,
+              '--batch-size', '4', '--metrics-file', metrics_file])
+    with open(metrics_file) as f:
+        lines = f.read().splitlines()
+    assert 'training_calendar_api_requests_total{method="batch",status="200"} 2' in lines
+    assert 'training_calendar_api_batched_calls_total{method="calendar.events.insert"} 6' in lines
+
+def test_profile_prints_report(fake, capsys):
+    sut.main(['Marathon', '2022-10-15', '-f', get_test_file('golden.csv'), '--cache-dir', fake.cache_dir, '--profile'])
+    out = capsys.readouterr().out
+    assert 'Phases (seconds):' in out
+    assert 'calendar.events.insert' in out
+    assert 'Retries: 0' in out
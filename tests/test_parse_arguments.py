@@ -92,6 +92,9 @@ additional_args = {
     'column_map': ('-m','--column-map','foo=bar,bing=baz'),
     'ends_on_race_day': (None,'--ends-on-race-day',None),
     'what_if': (None,'--what-if',None),
+    'sync': (None,'--sync',None),
+    'resume': (None,'--resume',None),
+    'profile': (None,'--profile',None),
 }
 
 def __choose_arg(arg):
@@ -124,3 +127,19 @@ def test_other_args():
                 assert inputs[k] == True
             else:
                 assert inputs[k] == v[2]
+
+@pytest.mark.parametrize('value', ['0', '-5', 'ten'])
+def test_raises_when_batch_size_not_positive_int(value):
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        inputs = sut.parse_arguments(['Marathon', '2022-10-15', '-f', './test.csv', '--batch-size', value])
+    assert exc_info.value.message.startswith('--batch-size must be a positive integer')
+
+def test_batch_size_parsed_as_int():
+    inputs = sut.parse_arguments(['Marathon', '2022-10-15', '-f', './test.csv', '-b', '25'])
+    assert inputs['batch_size'] == 25
+
+@pytest.mark.parametrize('value', ['0', '-1.5', 'fast', 'nan'])
+def test_raises_when_qps_not_positive(value):
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        inputs = sut.parse_arguments(['Marathon', '2022-10-15', '-f', './test.csv', '--qps', value])
+    assert exc_info.value.message.startswith('--qps must be a positive number')
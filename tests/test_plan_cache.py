@@ -0,0 +1,93 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import FakeCalendarHttp, make_template_events
+from conftest import get_test_file, run_main
+from datetime import datetime
+import pytest
+
+def write(tmp_path, name, content):
+    p = tmp_path / name
+    p.write_text(content)
+    return str(p)
+
+def summaries_by_date(events):
+    return [(e.start.strftime('%Y-%m-%d'), e.properties['summary']) for e in events]
+
+@pytest.fixture
+def no_compile(monkeypatch):
+    def fail(*args):
+        raise AssertionError('plan should have come from the cache')
+    def disable():
+        monkeypatch.setattr(sut, 'compile_file_plan', fail)
+        monkeypatch.setattr(sut, 'compile_calendar_plan', fail)
+    return disable
+
+def test_plan_days_are_offsets_from_race_day():
+    plan = sut.load_file_plan(get_test_file('golden.csv'), {}, False)
+    assert list(plan.starts) == [-4, -3, -2, -1, 0, 1]
+    assert list(plan.ends) == [-3, -2, -1, 0, 1, 2]
+    events = plan.shifted(datetime(2022, 10, 15).toordinal())
+    assert summaries_by_date(events) == summaries_by_date(sut.load_events_from_file(get_test_file('golden.csv'), {}, '2022-10-15', False))
+
+def test_ends_on_race_day():
+    plan = sut.load_file_plan(get_test_file('no-race-day.csv'), {}, True)
+    assert plan.starts[-1] == 0
+
+def test_compile_errors_are_unchanged():
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.load_file_plan(get_test_file('no-race-day.csv'), {}, False, sut.PlanCache())
+    assert exc_info.value.message.startswith('no race day detected')
+    assert exc_info.value.message.endswith('(file: {})'.format(get_test_file('no-race-day.csv')))
+
+def test_compiled_plan_is_reused_from_disk(tmp_path, no_compile):
+    first = sut.load_file_plan(get_test_file('golden.csv'), {}, False, sut.PlanCache(str(tmp_path)))
+    no_compile()
+    second = sut.load_file_plan(get_test_file('golden.csv'), {}, False, sut.PlanCache(str(tmp_path)))
+    assert list(second.starts) == list(first.starts)
+    assert [e.properties for e in second] == [e.properties for e in first]
+
+def test_compiled_plan_is_reused_from_memory(no_compile):
+    plan_cache = sut.PlanCache()
+    first = sut.load_file_plan(get_test_file('golden.csv'), {}, False, plan_cache)
+    no_compile()
+    assert sut.load_file_plan(get_test_file('golden.csv'), {}, False, plan_cache) is first
+
+def test_key_covers_content_and_options(tmp_path):
+    plan_cache = sut.PlanCache(str(tmp_path / 'plans'))
+    plan_path = write(tmp_path, 'plan.csv', 'Summary,Workout\nRun,Easy\nRACE DAY,\n')
+    plan = sut.load_file_plan(plan_path, {}, False, plan_cache)
+    assert [e.properties['summary'] for e in plan] == ['Run', 'RACE DAY']
+    assert sut.load_file_plan(plan_path, {}, True, plan_cache).starts[0] == -1
+    write(tmp_path, 'plan.csv', 'Summary,Workout\nSwim,Easy\nRACE DAY,\n')
+    assert [e.properties['summary'] for e in sut.load_file_plan(plan_path, {}, False, plan_cache)] == ['Swim', 'RACE DAY']
+    remapped = sut.load_file_plan(plan_path, {'summary': 'title', 'workout': 'summary'}, True, plan_cache)
+    assert [e.properties['summary'] for e in remapped] == ['Easy', '']
+
+def test_unreadable_plan_is_recompiled(tmp_path, capsys):
+    sut.load_file_plan(get_test_file('golden.csv'), {}, False, sut.PlanCache(str(tmp_path)))
+    for name in tmp_path.iterdir():
+        name.write_text('{not json')
+    plan = sut.load_file_plan(get_test_file('golden.csv'), {}, False, sut.PlanCache(str(tmp_path)))
+    assert len(plan) == 6
+    assert 'ignoring unreadable compiled plan' in capsys.readouterr().err
+
+def test_template_plan_is_cached_by_sync_token(tmp_path, no_compile):
+    fake = FakeCalendarHttp()
+    service = fake.build_service()
+    template_id = fake.add_calendar('Template')
+    fake.add_events(template_id, make_template_events(20, race_day_index=15))
+    def load():
+        cache = sut.CalendarCache(str(tmp_path / 'cache.json'), max_age=0)
+        return sut.load_calendar_plan(service, 'Template', False, cache=cache, plan_cache=sut.PlanCache(str(tmp_path / 'plans')))
+    first = load()
+    assert first.starts[15] == 0
+    no_compile()
+    assert list(load().starts) == list(first.starts)
+
+def test_main_reuses_plan_for_other_race_days(fake, monkeypatch):
+    rows_read = []
+    read_csv_rows = sut.read_csv_rows
+    monkeypatch.setattr(sut, 'read_csv_rows', lambda f: rows_read.append(1) or read_csv_rows(f))
+    for name, race_day in [('Alex', '2022-10-15'), ('Sam', '2023-04-01')]:
+        run_main(fake, name, race_day, '-f', get_test_file('golden.csv'))
+    assert len(rows_read) == 1
+    assert [e['start']['date'] for e in fake.get_events(fake.calendar_id('Sam'))][4] == '2023-04-01'
@@ -0,0 +1,42 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import FakeCalendarHttp, make_template_events
+import urllib.parse
+import pytest
+
+def get_fields(request):
+    return urllib.parse.parse_qs(urllib.parse.urlsplit(request.uri).query).get('fields')
+
+@pytest.fixture
+def service():
+    return FakeCalendarHttp().build_service()
+
+def test_adds_fields_for_method(service):
+    request = sut.with_response_fields(service.events().insert(calendarId='cal', body={}))
+    assert get_fields(request) == ['id']
+    # Retries go through again without adding another
+    assert get_fields(sut.with_response_fields(request)) == ['id']
+
+def test_leaves_other_methods_and_explicit_fields_alone(service):
+    assert get_fields(sut.with_response_fields(service.events().delete(calendarId='cal', eventId='e'))) is None
+    request = sut.with_response_fields(service.events().list(calendarId='cal', fields='items(id)'))
+    assert get_fields(request) == ['items(id)']
+
+def copy_template(monkeypatch, tmp_path, fields):
+    monkeypatch.setattr(sut, 'API_RESPONSE_FIELDS', fields)
+    fake = FakeCalendarHttp()
+    service = fake.build_service()
+    monkeypatch.setattr(sut, 'get_calendar_service', lambda *args: service)
+    fake.add_events(fake.add_calendar('Template'), make_template_events(200))
+    sut.main(['Marathon', '2022-10-15', '-c', 'Template', '--batch-size', '50', '--journal', str(tmp_path / 'journal.jsonl'),
+        '--cache-dir', str(tmp_path / 'cache-{}'.format(len(fields)))])
+    with open(str(tmp_path / 'journal.jsonl')) as f:
+        num_journaled = len(f.readlines())
+    events = [(e['start']['date'], e['summary']) for e in fake.get_events(fake.calendar_id('Marathon'))]
+    return events, num_journaled, fake.bytes_received
+
+def test_partial_responses_carry_what_is_needed_in_fewer_bytes(monkeypatch, tmp_path):
+    events, num_journaled, partial_bytes = copy_template(monkeypatch, tmp_path, sut.API_RESPONSE_FIELDS)
+    full_events, _, full_bytes = copy_template(monkeypatch, tmp_path, {})
+    assert events == full_events
+    assert len(events) == num_journaled == 200
+    assert partial_bytes < full_bytes / 3
@@ -0,0 +1,91 @@
+from training_calendar import training_calendar as sut
+from googleapiclient.errors import HttpError
+import httplib2
+import json
+import socket
+import pytest
+
+def make_http_error(status, message='Error', reasons=(), headers=None):
+    resp = httplib2.Response(dict({'status': status}, **(headers or {})))
+    error = {'code': status, 'message': message, 'errors': [{'reason': r} for r in reasons]}
+    return HttpError(resp, json.dumps({'error': error}).encode('utf-8'))
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(sut.time, 'sleep', slept.append)
+    return slept
+
+@pytest.mark.parametrize('error', [
+    make_http_error(429),
+    make_http_error(500),
+    make_http_error(503),
+    make_http_error(403, 'Rate Limit Exceeded'),
+    make_http_error(403, 'Quota exceeded for quota metric', reasons=['userRateLimitExceeded']),
+    make_http_error(403, 'Quota exceeded', reasons=['rateLimitExceeded']),
+    socket.timeout('timed out'),
+    ConnectionResetError(),
+])
+def test_retryable_errors(error):
+    assert sut.is_retryable_error(error)
+
+@pytest.mark.parametrize('error', [
+    make_http_error(400),
+    make_http_error(404),
+    make_http_error(403, 'Forbidden', reasons=['forbidden']),
+    ValueError('bad'),
+])
+def test_non_retryable_errors(error):
+    assert not sut.is_retryable_error(error)
+
+def test_retries_until_success(sleeps):
+    errors = [make_http_error(503), make_http_error(429)]
+    def call():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    assert sut.RetryPolicy(max_retries=3).call(call) == 'ok'
+    assert len(sleeps) == 2
+
+def test_raises_non_retryable_immediately(sleeps):
+    def call():
+        raise make_http_error(400)
+    with pytest.raises(HttpError):
+        sut.RetryPolicy().call(call)
+    assert sleeps == []
+
+def test_gives_up_after_max_retries(sleeps):
+    attempts = []
+    def call():
+        attempts.append(1)
+        raise make_http_error(503)
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.RetryPolicy(max_retries=3).call(call)
+    assert exc_info.value.message.startswith('retry limit exceeded (3 retries)')
+    assert len(attempts) == 4
+    assert len(sleeps) == 3
+
+def test_backoff_is_jittered_and_capped():
+    policy = sut.RetryPolicy(base_delay=1.0, max_delay=10.0)
+    for attempt in range(1, 10):
+        for _ in range(20):
+            delay = policy.get_delay(attempt)
+            assert 0 <= delay <= min(10.0, 2 ** (attempt - 1))
+
+def test_honors_retry_after(sleeps):
+    errors = [make_http_error(429, headers={'retry-after': '30'})]
+    def call():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    sut.RetryPolicy(base_delay=0.001).call(call)
+    assert sleeps == [30.0]
+
+def test_custom_classifier(sleeps):
+    errors = [KeyError('flaky')]
+    def call():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    policy = sut.RetryPolicy(is_retryable=lambda e: isinstance(e, KeyError))
+    assert policy.call(call) == 'ok'
@@ -0,0 +1,119 @@
+from training_calendar import training_calendar as sut
+from conftest import get_test_file, run_main
+from datetime import datetime
+import io
+import json
+import pytest
+
+def write(tmp_path, name, content):
+    p = tmp_path / name
+    p.write_text(content, encoding='utf-8')
+    return str(p)
+
+def write_jsonl(tmp_path, name, records):
+    return write(tmp_path, name, ''.join(json.dumps(r) + '\n' for r in records))
+
+def properties(events):
+    return [(e.start.strftime('%Y-%m-%d'), e.properties) for e in events]
+
+GOLDEN_RECORDS = [{ 'summary': s } for s in ['Test0', 'Test1', 'Test2', 'Test3', 'RACE DAY', 'Test5']]
+
+def test_jsonl_matches_csv(tmp_path):
+    jsonl = write_jsonl(tmp_path, 'golden.jsonl', GOLDEN_RECORDS)
+    expected = properties(sut.load_events_from_file(get_test_file('golden.csv'), {}, '2022-10-15', False))
+    assert properties(sut.load_events_from_file(jsonl, {}, '2022-10-15', False)) == expected
+    assert properties(sut.load_file_plan(jsonl, {}, False).shifted(datetime(2022, 10, 15).toordinal())) == expected
+
+def test_jsonl_column_map_and_missing_fields(tmp_path):
+    jsonl = write(tmp_path, 'plan.ndjson',
+        '{"Workout": "Swim", "Details": "1500m", "Week": 1}\n\n{"Workout": "RACE DAY"}\n{"Workout": "Rest", "Details": null}\n')
+    events = list(sut.load_events_from_file(jsonl, {'Workout': 'summary', 'Details': 'description'}, '2022-10-15', False))
+    assert properties(events) == [
+        ('2022-10-14', {'summary': 'Swim', 'description': '1500m'}),
+        ('2022-10-15', {'summary': 'RACE DAY', 'description': None}),
+        ('2022-10-16', {'summary': 'Rest', 'description': None})]
+
+def test_jsonl_non_string_values_are_kept_as_json(tmp_path):
+    jsonl = write_jsonl(tmp_path, 'plan.jsonl', [{'summary': 'RACE DAY', 'description': 42, 'notes': [1, 2]}])
+    assert properties(sut.load_events_from_file(jsonl, {}, '2022-10-15', False)) == [
+        ('2022-10-15', {'summary': 'RACE DAY', 'description': '42', 'notes': '[1, 2]'})]
+
+@pytest.mark.parametrize('content,message', [
+    ('{"summary": "Swim"}\n{"summary": "RACE DAY", "notes": "x"}\n', "unexpected field 'notes' on line 2;"),
+    ('{"summary": "Swim"}\n{"summary": \n', 'invalid JSON on line 2:'),
+    ('["Swim"]\n', 'expected a JSON object on line 1'),
+])
+def test_jsonl_errors(tmp_path, content, message):
+    jsonl = write(tmp_path, 'plan.jsonl', content)
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.load_file_plan(jsonl, {}, False)
+    assert exc_info.value.message.startswith(message)
+    assert exc_info.value.message.endswith('(file: {})'.format(jsonl))
+
+def test_format_overrides_extension(tmp_path):
+    jsonl = write_jsonl(tmp_path, 'plan.txt', GOLDEN_RECORDS)
+    plan = sut.load_file_plan(jsonl, {}, False, source_format='jsonl')
+    assert list(plan.starts) == [-4, -3, -2, -1, 0, 1]
+
+def test_reads_jsonl_from_stdin(monkeypatch):
+    monkeypatch.setattr(sut.sys, 'stdin', io.StringIO(''.join(json.dumps(r) + '\n' for r in GOLDEN_RECORDS)))
+    events = list(sut.load_events_from_file('--', {}, '2022-10-15', False, 'jsonl'))
+    assert events[4].properties['summary'] == 'RACE DAY'
+    assert events[4].start == datetime(2022, 10, 15)
+
+@pytest.mark.parametrize('name', ['plan.csv', 'plan.jsonl'])
+def test_large_files_are_memory_mapped(tmp_path, monkeypatch, name):
+    records = [{ 'summary': 'Day {}'.format(i), 'description': 'Quoted, "with"\nnewline é' } for i in range(200)]
+    records[150]['summary'] = 'RACE DAY'
+    if name.endswith('.csv'):
+        lines = ['summary,description\n'] + ['{},"{}"\n'.format(r['summary'], r['description'].replace('"', '""')) for r in records]
+        source = write(tmp_path, name, ''.join(lines))
+    else:
+        source = write_jsonl(tmp_path, name, records)
+    expected = properties(sut.load_events_from_file(source, {}, '2022-10-15', False))
+    key = sut.hash_input(sut.get_input_opener(source))
+    monkeypatch.setattr(sut, 'MMAP_MIN_BYTES', 1)
+    with sut.get_input_opener(source)() as f:
+        assert isinstance(f, sut.MappedFile)
+    assert properties(sut.load_events_from_file(source, {}, '2022-10-15', False)) == expected
+    assert expected[150] == ('2022-10-15', records[150])
+    assert sut.hash_input(sut.get_input_opener(source)) == key
+
+@pytest.mark.parametrize('mmap_min_bytes', [1, 2 ** 40])
+@pytest.mark.parametrize('name', ['plan.csv', 'plan.jsonl'])
+def test_reads_non_ascii_plan_as_utf8(tmp_path, monkeypatch, mmap_min_bytes, name):
+    records = [{ 'summary': 'Schwimmen 1500m – locker', 'description': 'Café' },
+        { 'summary': 'RACE DAY', 'description': 'Ziel: Ørestad 🏁' }]
+    if name.endswith('.csv'):
+        source = write(tmp_path, name, 'summary,description\n' + ''.join('{},{}\n'.format(r['summary'], r['description']) for r in records))
+    else:
+        source = write(tmp_path, name, ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records))
+    monkeypatch.setattr(sut, 'MMAP_MIN_BYTES', mmap_min_bytes)
+    with sut.get_input_opener(source)() as f:
+        assert isinstance(f, sut.MappedFile) == (mmap_min_bytes == 1)
+    assert properties(sut.load_events_from_file(source, {}, '2022-10-15', False)) == [
+        ('2022-10-14', records[0]), ('2022-10-15', records[1])]
+
+def test_plan_cache_keys_differ_by_format(tmp_path):
+    source = write(tmp_path, 'plan.txt', '{"summary": "RACE DAY"}\n')
+    plan_cache = sut.PlanCache()
+    assert list(sut.load_file_plan(source, {}, True, plan_cache, 'jsonl').starts) == [0]
+    # Read as CSV, the line is a header without a summary column
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.load_file_plan(source, {}, True, plan_cache, 'csv')
+    assert exc_info.value.message.startswith("expected column 'summary'")
+
+def test_parse_arguments_reads_format():
+    inputs = sut.parse_arguments(['Marathon', '2022-10-15', '-f', 'plan.txt', '--format', 'jsonl'])
+    assert inputs['format'] == 'jsonl'
+
+def test_raises_when_format_unknown():
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.parse_arguments(['Marathon', '2022-10-15', '-f', 'plan.txt', '--format', 'xml'])
+    assert exc_info.value.message == '--format must be one of csv, jsonl (got xml)'
+
+def test_main_creates_calendar_from_jsonl(fake, tmp_path):
+    jsonl = write_jsonl(tmp_path, 'plan.jsonl', GOLDEN_RECORDS)
+    run_main(fake, 'Marathon', '2022-10-15', '-f', jsonl, '--no-cache')
+    events = fake.get_events(fake.calendar_id('Marathon'))
+    assert [(e['start']['date'], e['summary']) for e in events][4] == ('2022-10-15', 'RACE DAY')
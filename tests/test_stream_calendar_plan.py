@@ -0,0 +1,92 @@
+from training_calendar import training_calendar as sut
+from fake_calendar_api import FakeCalendarHttp, make_template_events
+import datetime
+import pytest
+
+@pytest.fixture
+def fake():
+    return FakeCalendarHttp()
+
+def add_template(fake, num_events=30, race_day_index=20):
+    template_id = fake.add_calendar('Template')
+    fake.add_events(template_id, make_template_events(num_events, race_day_index))
+    return template_id
+
+def test_finds_race_day_with_one_request_then_streams(fake):
+    add_template(fake)
+    service = fake.build_service()
+    events = sut.stream_calendar_plan(service, 'Template', '2022-10-15', page_size=10)
+    assert fake.method_counts == { 'calendarList.list': 1, 'events.list': 1 }
+    first = next(events)
+    assert fake.method_counts['events.list'] == 2
+    events = [first] + list(events)
+    assert len(events) == 30
+    assert events[20].properties['summary'] == 'RACE DAY'
+    assert events[20].start == datetime.datetime(2022, 10, 15)
+    assert events[0].start == datetime.datetime(2022, 9, 25)
+
+def test_ignores_events_that_only_mention_race_day(fake):
+    template_id = add_template(fake)
+    fake.add_events(template_id, [{ 'summary': 'Taper', 'description': 'Two weeks to RACE DAY',
+        'start': { 'date': '2020-01-05' }, 'end': { 'date': '2020-01-06' } }])
+    assert sut.find_template_race_day(fake.build_service(), template_id, 'Template') == '2020-01-21'
+
+@pytest.mark.parametrize('race_day_indexes,message', [
+    ([], 'no race day detected'),
+    ([3, 20], "multiple events with summary 'RACE DAY' found; expected at most 1 (calendar: Template; on 2020-01-04, 2020-01-21)"),
+])
+def test_race_day_errors_come_before_any_event(fake, race_day_indexes, message):
+    template = make_template_events(30, race_day_index=-1)
+    for i in race_day_indexes:
+        template[i]['summary'] = 'RACE DAY'
+    fake.add_events(fake.add_calendar('Template'), template)
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        sut.stream_calendar_plan(fake.build_service(), 'Template', '2022-10-15')
+    assert exc_info.value.message.startswith(message)
+
+def test_race_day_is_cached(fake, tmp_path):
+    add_template(fake)
+    service = fake.build_service()
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'))
+    list(sut.stream_calendar_plan(service, 'Template', '2022-10-15', cache=cache))
+    list_calls = fake.method_counts['events.list']
+    list(sut.stream_calendar_plan(service, 'Template', '2022-11-15', cache=sut.CalendarCache(str(tmp_path / 'cache.json'))))
+    assert fake.method_counts['events.list'] == list_calls + 1
+
+def test_moved_race_day_is_an_error(fake, tmp_path):
+    template_id = add_template(fake)
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'))
+    cache.put_race_day(template_id, '2020-01-10')
+    with pytest.raises(sut.TrainingCalendarError) as exc_info:
+        list(sut.stream_calendar_plan(fake.build_service(), 'Template', '2022-10-15', cache=cache))
+    assert exc_info.value.message.startswith("template calendar 'Template' has a race day on 2020-01-21 but it was expected on 2020-01-10")
+
+@pytest.mark.parametrize('inputs,expected', [
+    ({}, True),
+    ({ 'sync': True }, False),
+    ({ 'compress': True }, False),
+    ({ 'force': True }, False),
+    ({ 'ends_on_race_day': True }, False),
+    ({ 'output_ics': 'plan.ics' }, True),
+])
+def test_can_stream_template(inputs, expected):
+    assert sut.can_stream_template(dict(inputs, template_calendar_name='Template')) == expected
+
+def test_cached_template_is_not_streamed(fake, tmp_path):
+    template_id = add_template(fake)
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'))
+    inputs = { 'template_calendar_name': 'Template' }
+    assert sut.can_stream_template(inputs, cache, { 'Template': template_id })
+    cache.get_events(fake.build_service(), template_id)
+    assert not sut.can_stream_template(inputs, cache, { 'Template': template_id })
+
+def test_streaming_fills_cache(fake, tmp_path):
+    template_id = add_template(fake)
+    service = fake.build_service()
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'), max_age=0)
+    assert len(list(sut.stream_calendar_plan(service, 'Template', '2022-10-15', page_size=10, cache=cache))) == 30
+    list_calls = fake.method_counts['events.list']
+    # Only the changes since the streamed listing are asked for
+    cache = sut.CalendarCache(str(tmp_path / 'cache.json'), max_age=0)
+    assert len(cache.get_events(service, template_id, page_size=10)) == 30
+    assert fake.method_counts['events.list'] == list_calls + 1
@@ -0,0 +1,65 @@
+from training_calendar import training_calendar as sut
+from datetime import datetime, timedelta
+import pytest
+
+@pytest.fixture
+def calendar_id(fake):
+    return fake.add_calendar('Marathon')
+
+def make_plan(summaries, race_day='2022-10-15'):
+    start = datetime.strptime(race_day, '%Y-%m-%d') - timedelta(days=len(summaries)-1)
+    return [
+        sut.Event(start=start + timedelta(days=i), end=start + timedelta(days=i+1), properties={'summary': s, 'description': 'Desc'})
+        for (i,s) in enumerate(summaries)]
+
+def summaries_by_date(fake, calendar_id):
+    return [(e['start']['date'], e['summary']) for e in fake.get_events(calendar_id)]
+
+def test_first_sync_inserts_everything(fake, calendar_id):
+    service = fake.build_service()
+    sut.sync_events(service, make_plan(['A', 'B', 'RACE DAY']), calendar_id, 'plan', '2022-10-15')
+    assert fake.method_counts == {'events.list': 1, 'events.insert': 3}
+    assert summaries_by_date(fake, calendar_id) == [('2022-10-13', 'A'), ('2022-10-14', 'B'), ('2022-10-15', 'RACE DAY')]
+
+def test_resync_of_same_plan_makes_no_changes(fake, calendar_id):
+    service = fake.build_service()
+    sut.sync_events(service, make_plan(['A', 'B', 'RACE DAY']), calendar_id, 'plan', '2022-10-15')
+    fake.method_counts.clear()
+    sut.sync_events(service, make_plan(['A', 'B', 'RACE DAY']), calendar_id, 'plan', '2022-10-15')
+    assert fake.method_counts == {'events.list': 1}
+
+def test_changed_event_is_patched(fake, calendar_id):
+    service = fake.build_service()
+    sut.sync_events(service, make_plan(['A', 'B', 'RACE DAY']), calendar_id, 'plan', '2022-10-15')
+    fake.method_counts.clear()
+    sut.sync_events(service, make_plan(['A', 'Fixed', 'RACE DAY']), calendar_id, 'plan', '2022-10-15')
+    assert fake.method_counts == {'events.list': 1, 'events.patch': 1}
+    assert summaries_by_date(fake, calendar_id) == [('2022-10-13', 'A'), ('2022-10-14', 'Fixed'), ('2022-10-15', 'RACE DAY')]
+
+def test_removed_and_emptied_events_are_deleted(fake, calendar_id):
+    service = fake.build_service()
+    sut.sync_events(service, make_plan(['A', 'B', 'C', 'RACE DAY']), calendar_id, 'plan', '2022-10-15')
+    fake.method_counts.clear()
+    sut.sync_events(service, make_plan(['', 'C', 'RACE DAY']), calendar_id, 'plan', '2022-10-15')
+    assert fake.method_counts == {'events.list': 1, 'events.delete': 2}
+    assert summaries_by_date(fake, calendar_id) == [('2022-10-14', 'C'), ('2022-10-15', 'RACE DAY')]
+
+def test_moving_race_day_patches_dates(fake, calendar_id):
+    service = fake.build_service()
+    sut.sync_events(service, make_plan(['A', 'RACE DAY']), calendar_id, 'plan', '2022-10-15')
+    fake.method_counts.clear()
+    sut.sync_events(service, make_plan(['A', 'RACE DAY'], race_day='2022-10-22'), calendar_id, 'plan', '2022-10-22')
+    assert fake.method_counts == {'events.list': 1, 'events.patch': 2}
+    assert summaries_by_date(fake, calendar_id) == [('2022-10-21', 'A'), ('2022-10-22', 'RACE DAY')]
+
+def test_other_plans_are_left_alone(fake, calendar_id):
+    service = fake.build_service()
+    sut.sync_events(service, make_plan(['A', 'RACE DAY']), calendar_id, 'plan1', '2022-10-15')
+    sut.sync_events(service, make_plan(['B']), calendar_id, 'plan2', '2022-10-15')
+    assert len(fake.get_events(calendar_id)) == 3
+
+def test_what_if_makes_no_changes(fake, calendar_id, capsys):
+    service = fake.build_service()
+    sut.sync_events(service, make_plan(['A', 'RACE DAY']), calendar_id, 'plan', '2022-10-15', what_if=True)
+    assert fake.method_counts == {'events.list': 1}
+    assert '2 to create' in capsys.readouterr().out
@@ -8,48 +8,81 @@ import os
 import datetime
 import pickle
 import os.path
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 
 import datetime
 import itertools
 import sys
+import array
 import csv
+import hashlib
+import io
 import time
+import threading
+import collections
+import concurrent.futures
+import contextlib
+import bisect
+import email.utils
+import json
+import mmap
+import random
+import socket
+import urllib.parse
 
 SCRIPT_NAME = "create_training_calendar.py"
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 CLIENT_SECRET_FILE = 'credentials.json'
+DEFAULT_TOKEN_FILE = 'token.json'
+DEFAULT_TOKEN_REFRESH_MARGIN = 300
+TOKEN_REFRESH_RETRY_SECONDS = 30
+LOCK_RETRY_SECONDS = 0.1
 APPLICATION_NAME = 'Google Calendar API Python Quickstart'
 
 EVENT_PROPERTIES_TO_RETAIN = ['summary','description','notes']
 RACE_DAY_SUMMARY = 'RACE DAY'
 TRAINING_CALENDAR_EVENT_DATE_FORMAT = '%Y-%m-%d'
 TEMPLATE_CALENDAR_NAME = 'Iron Man 70.3 Training Template'
+CALENDAR_API_MAX_BATCH_SIZE = 50
+DEFAULT_QUERIES_PER_SECOND = 10
+DEFAULT_HTTP_TIMEOUT = 60
+DEFAULT_HTTP_POOL_SIZE = 16
+CALENDAR_API_MAX_PAGE_SIZE = 2500
+DEFAULT_PAGE_SIZE = 250
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'training_calendar')
+DEFAULT_CACHE_MAX_AGE = 60
+DEFAULT_JOURNAL_FSYNC_EVERY = 50
+PLAN_FORMAT_VERSION = 1
+RECURRENCE_INTERVALS = (7, 1)
+RECURRENCE_MAX_SKIPPED = 1
+ICS_MAX_LINE_OCTETS = 75
+ICS_PRODUCT_ID = '-//training_calendar//create_training_calendar.py//EN'
+DEFAULT_API_LATENCY = 0.25
+CALENDAR_LIST_PAGE_SIZE = 100
+DEFAULT_SOURCE_FORMAT = 'csv'
+MMAP_MIN_BYTES = 1 << 20
+METRICS_PREFIX = 'training_calendar_'
+# The parts of each API method's response that are actually read, requested with `fields=` so
+# that the API leaves out the rest (see with_response_fields). Methods not listed here get
+# the full response.
+API_RESPONSE_FIELDS = {
+    'calendar.calendarList.list': 'nextPageToken,nextSyncToken,items(id,summary,deleted)',
+    'calendar.calendars.insert': 'id,summary',
+    'calendar.events.list': 'nextPageToken,nextSyncToken,items(id,etag,status,summary,description,start,end,extendedProperties)',
+    'calendar.events.insert': 'id',
+    'calendar.events.patch': 'id',
+}
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
-def get_calendar_service():
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CLIENT_SECRET_FILE, SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    service = build('calendar', 'v3', credentials=creds)
+# The Google client libraries take a good part of a second to import, so they're only
+# imported once a run actually needs the API (not for --help, bad arguments or an offline
+# --what-if).
+def get_calendar_service(timeout=DEFAULT_HTTP_TIMEOUT, credentials=None):
+    with METRICS.phase('auth'):
+        creds = (credentials or CredentialManager()).start()
+    with METRICS.phase('discovery'):
+        from googleapiclient.discovery import build
+        # Use the discovery document bundled with the client library instead of fetching it
+        service = build('calendar', 'v3', http=HttpPool(creds, timeout), static_discovery=True, cache_discovery=False)
     return service
 
 ####################################
@@ -63,11 +96,238 @@ class TrainingCalendarError(Exception):
 class EventLoadError(TrainingCalendarError):
     pass
 
-class Event:
-    def __init__(self, start, end, properties):
-        self.start = start
-        self.end = end
-        self.properties = { k: v for (k,v) in properties.items() if k in EVENT_PROPERTIES_TO_RETAIN }
+# Locks `path` (created if need be) against other processes for the duration of the block.
+@contextlib.contextmanager
+def lock_file(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a+') as f:
+        if os.name == 'nt':
+            import msvcrt
+            # LK_LOCK gives up after 10 tries, a second apart, but the lock may be held for as
+            # long as it takes the user to sign in
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(LOCK_RETRY_SECONDS)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+# Stands in for the service's credentials: signs in with the saved token & keeps it fresh for
+# the rest of the run. Tokens are refreshed `refresh_margin` seconds before they expire, by a
+# background thread, so that long runs don't hit a 401 part way through. Threads, & processes
+# sharing the token file, take turns through a lock; whoever goes second picks up the token
+# the first one saved instead of refreshing (or asking the user to sign in) again.
+class CredentialManager:
+    def __init__(self, token_path=DEFAULT_TOKEN_FILE, client_secret_path=CLIENT_SECRET_FILE,
+                 refresh_margin=DEFAULT_TOKEN_REFRESH_MARGIN):
+        self.token_path = token_path
+        self.client_secret_path = client_secret_path
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self.credentials = None
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # Identifies the account (see get_account_key)
+    @property
+    def client_id(self):
+        return getattr(self.credentials, 'client_id', None)
+
+    @property
+    def refresh_token(self):
+        return getattr(self.credentials, 'refresh_token', None)
+
+    def start(self):
+        self.update(None)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.keep_fresh, name='token-refresh', daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self):
+        self.stopped.set()
+
+    # Called by AuthorizedHttp before each request
+    def before_request(self, request, method, url, headers):
+        self.apply(headers)
+
+    # Called by AuthorizedHttp when a request was refused with the current token, & by batch
+    # requests when the token isn't valid
+    def refresh(self, request):
+        self.update(self.get_token(), force=True)
+
+    # Batch requests check & apply the credentials themselves, through googleapiclient._auth.
+    # That only takes google-auth's interface from its own Credentials class (which isn't
+    # imported until sign-in), & oauth2client's interface (below) from anything else.
+    @property
+    def access_token(self):
+        return self.get_token()
+
+    @property
+    def access_token_expired(self):
+        return not self.valid
+
+    @property
+    def token(self):
+        return self.get_token()
+
+    @property
+    def valid(self):
+        return not self.is_expiring(self.credentials)
+
+    def apply(self, headers, token=None):
+        stale_token = self.get_token()
+        if self.is_expiring(self.credentials):
+            self.update(stale_token)
+        self.credentials.apply(headers, token)
+
+    def get_token(self):
+        return getattr(self.credentials, 'token', None)
+
+    def is_expiring(self, credentials):
+        if credentials is None or not credentials.token:
+            return True
+        if credentials.expiry is None:
+            return False
+        return credentials.expiry - get_utc_now() < self.refresh_margin
+
+    # Replaces the credentials holding `stale_token` (None if there aren't any yet) with fresh
+    # ones, unless another thread or process got there first.
+    def update(self, stale_token, force=False):
+        with self.lock:
+            if self.get_token() != stale_token:
+                return
+            if not force and not self.is_expiring(self.credentials):
+                return
+            with lock_file(self.token_path + '.lock'):
+                saved = self.read_token()
+                if saved is not None and saved.token != stale_token and not self.is_expiring(saved):
+                    self.credentials = saved
+                    return
+                credentials = self.credentials or saved
+                if credentials is not None and credentials.refresh_token:
+                    from google.auth.transport.requests import Request
+                    credentials.refresh(Request())
+                    METRICS.inc('token_refreshes_total')
+                else:
+                    credentials = self.sign_in()
+                self.credentials = credentials
+                self.save_token()
+
+    def keep_fresh(self):
+        while not self.stopped.wait(self.get_seconds_until_refresh()):
+            try:
+                self.update(self.get_token())
+            except Exception as e:
+                # The next request will try again (& report the error if it still fails)
+                print('warning: failed to refresh the access token ahead of time: {}'.format(e), file=sys.stderr)
+                self.stopped.wait(TOKEN_REFRESH_RETRY_SECONDS)
+
+    def get_seconds_until_refresh(self):
+        expiry = getattr(self.credentials, 'expiry', None)
+        if expiry is None:
+            return None
+        return max(0, (expiry - self.refresh_margin - get_utc_now()).total_seconds())
+
+    def read_token(self):
+        if not os.path.exists(self.token_path):
+            return None
+        from google.oauth2.credentials import Credentials
+        return Credentials.from_authorized_user_file(self.token_path, SCOPES)
+
+    def sign_in(self):
+        if not os.path.exists(self.client_secret_path):
+            exit_with_error('no saved token in {} & no OAuth client file {} to sign in with (see --credentials)'.format(
+                self.token_path, self.client_secret_path))
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        flow = InstalledAppFlow.from_client_secrets_file(self.client_secret_path, SCOPES)
+        return flow.run_local_server(port=0)
+
+    def save_token(self):
+        directory = os.path.dirname(self.token_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.token_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.credentials.to_json())
+        os.replace(tmp_path, self.token_path)
+
+# google-auth keeps expiry times as naive UTC datetimes
+def get_utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+# Stands in for the service's httplib2.Http, so that the service can be used from many
+# threads at once. httplib2 connections aren't thread-safe, so each request checks out a
+# connection for its sole use & returns it afterwards. Idle connections (& their keep-alive
+# sockets) are kept for the next request, so connection setup & TLS handshakes are paid
+# once per connection rather than once per call.
+class HttpPool:
+    def __init__(self, credentials, timeout=None, max_idle=DEFAULT_HTTP_POOL_SIZE):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self.lock:
+            http = self.idle.pop() if self.idle else None
+        if http is None:
+            http = new_authorized_http(self.credentials, self.timeout)
+            METRICS.inc('http_connections_opened_total')
+        try:
+            yield http
+        finally:
+            with self.lock:
+                if len(self.idle) < self.max_idle:
+                    self.idle.append(http)
+                    http = None
+            if http is not None:
+                http.close()
+
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        # The API only compresses responses for clients that say they can take gzip in the
+        # user agent as well; requests built by googleapiclient do, batch requests don't.
+        headers = dict(headers or {})
+        headers.setdefault('accept-encoding', 'gzip, deflate')
+        if '(gzip)' not in headers.get('user-agent', ''):
+            headers['user-agent'] = (headers.get('user-agent', '') + ' (gzip)').strip()
+        with self.connection() as http:
+            return http.request(uri, method, body, headers, *args, **kwargs)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for http in idle:
+            http.close()
+
+def new_authorized_http(credentials, timeout=None):
+    import httplib2
+    http = httplib2.Http(timeout=timeout)
+    if credentials is None:
+        return http
+    from google_auth_httplib2 import AuthorizedHttp
+    return AuthorizedHttp(credentials, http=http)
+
+# Shared behaviour for anything that looks like an event: needs start, end & properties.
+class EventBase:
+    __slots__ = ()
 
     def build(self):
         event = dict(self.properties)
@@ -84,30 +344,430 @@ class Event:
                 datetime.datetime.strftime(self.end, TRAINING_CALENDAR_EVENT_DATE_FORMAT),
                 ', '.join(["{}:'{}'".format(k, v) for (k,v) in self.properties.items()]))
 
+class Event(EventBase):
+    def __init__(self, start, end, properties):
+        self.start = start
+        self.end = end
+        self.properties = { k: v for (k,v) in properties.items() if k in EVENT_PROPERTIES_TO_RETAIN }
+
+# Columnar store for a whole plan's events. Start & end dates are kept as day ordinals in
+# typed arrays, & each property column stores codes into a list of its distinct values,
+# since the same few descriptions ("REST", ...) make up most of a plan. Iterating or
+# indexing the table gives EventRow views, which can be used anywhere an Event can.
+class EventTable:
+    MISSING = -1
+
+    def __init__(self, properties=EVENT_PROPERTIES_TO_RETAIN):
+        self.starts = array.array('i')
+        self.ends = array.array('i')
+        self.columns = { p: array.array('i') for p in properties }
+        self.values = { p: [] for p in properties }
+        self.value_codes = { p: {} for p in properties }
+
+    @classmethod
+    def from_events(cls, events, properties=EVENT_PROPERTIES_TO_RETAIN):
+        table = cls(properties)
+        table.extend(events)
+        return table
+
+    def append(self, start, end, properties):
+        self.append_days(start.toordinal(), end.toordinal(), properties)
+
+    # Like append, but with the start & end given as day numbers (ordinals, or offsets).
+    def append_days(self, start, end, properties):
+        self.starts.append(start)
+        self.ends.append(end)
+        for p,column in self.columns.items():
+            column.append(self.intern(p, properties[p]) if p in properties else self.MISSING)
+
+    def extend(self, events):
+        for event in events:
+            self.append(event.start, event.end, event.properties)
+
+    def intern(self, prop, value):
+        codes = self.value_codes[prop]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[prop])
+            self.values[prop].append(value)
+        return code
+
+    def get_properties(self, index):
+        properties = {}
+        for p,column in self.columns.items():
+            code = column[index]
+            if code != self.MISSING:
+                properties[p] = self.values[p][code]
+        return properties
+
+    # Returns a table of the same events moved by the given number of days. The property
+    # columns are shared with this table, so it should not be appended to.
+    def shifted(self, days):
+        table = EventTable(())
+        table.starts = array.array('i', (o + days for o in self.starts))
+        table.ends = array.array('i', (o + days for o in self.ends))
+        table.columns, table.values, table.value_codes = self.columns, self.values, self.value_codes
+        return table
+
+    def to_dict(self):
+        return {
+            'starts': self.starts.tolist(),
+            'ends': self.ends.tolist(),
+            'columns': { p: column.tolist() for (p,column) in self.columns.items() },
+            'values': self.values,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        table = cls(list(data['columns']))
+        table.starts = array.array('i', data['starts'])
+        table.ends = array.array('i', data['ends'])
+        table.columns = { p: array.array('i', column) for (p,column) in data['columns'].items() }
+        table.values = data['values']
+        table.value_codes = { p: { v: i for (i,v) in enumerate(values) } for (p,values) in table.values.items() }
+        return table
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('event index out of range')
+        return EventRow(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield EventRow(self, i)
+
+class EventRow(EventBase):
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def start(self):
+        return datetime.datetime.fromordinal(self.table.starts[self.index])
+
+    @property
+    def end(self):
+        return datetime.datetime.fromordinal(self.table.ends[self.index])
+
+    @property
+    def properties(self):
+        return self.table.get_properties(self.index)
+
+    def build(self):
+        event = self.properties
+        event['start'] = { 'date': datetime.date.fromordinal(self.table.starts[self.index]).isoformat() }
+        event['end'] = { 'date': datetime.date.fromordinal(self.table.ends[self.index]).isoformat() }
+        return event
+
+    def is_empty(self):
+        code = self.table.columns['summary'][self.index]
+        return code == EventTable.MISSING or not self.table.values['summary'][code]
+
+
+# An event repeated every `interval` days, `count` times (counting the occurrences on the
+# `excluded` dates, which are skipped). Built with RRULE/EXDATE recurrence rules, so the
+# whole series is created by a single insert.
+class RecurringEvent(EventBase):
+    def __init__(self, start, end, properties, interval, count, excluded=()):
+        self.start = start
+        self.end = end
+        self.properties = properties
+        self.interval = interval
+        self.count = count
+        self.excluded = list(excluded)
+
+    def __len__(self):
+        return self.count - len(self.excluded)
+
+    def get_recurrence(self):
+        if self.interval % 7 == 0:
+            rule = 'RRULE:FREQ=WEEKLY;COUNT={}'.format(self.count)
+            interval = self.interval // 7
+        else:
+            rule = 'RRULE:FREQ=DAILY;COUNT={}'.format(self.count)
+            interval = self.interval
+        if interval > 1:
+            rule += ';INTERVAL={}'.format(interval)
+        recurrence = [rule]
+        if self.excluded:
+            recurrence.append('EXDATE;VALUE=DATE:' + ','.join(d.strftime('%Y%m%d') for d in self.excluded))
+        return recurrence
+
+    def build(self):
+        event = EventBase.build(self)
+        event['recurrence'] = self.get_recurrence()
+        return event
+
+    def __str__(self):
+        return "RecurringEvent(start:{}, every {} days x{}{}, {})".format(
+                datetime.datetime.strftime(self.start, TRAINING_CALENDAR_EVENT_DATE_FORMAT),
+                self.interval, len(self),
+                ''.join(', except:{}'.format(datetime.datetime.strftime(d, TRAINING_CALENDAR_EVENT_DATE_FORMAT)) for d in self.excluded),
+                ', '.join(["{}:'{}'".format(k, v) for (k,v) in self.properties.items()]))
+
+# Replaces runs of identical events (same properties & length) that recur at a regular
+# interval with a RecurringEvent per run. The run covering the most occurrences, at any of
+# the RECURRENCE_INTERVALS (the first one on a tie), is taken first, then the longest among
+# what's left, & so on; a run may skip up to RECURRENCE_MAX_SKIPPED occurrences in a row,
+# which become EXDATEs. Events that aren't part of a run are kept as they are. Needs the
+# whole plan, so the events are read into memory; the result is ordered by start date.
+def compress_recurring_events(events, file=None):
+    groups = collections.OrderedDict()
+    for event in events:
+        if event.is_empty():
+            print('Skipping empty event: {}'.format(event), file=file)
+            continue
+        event = Event(event.start, event.end, event.properties)
+        key = (tuple(sorted(event.properties.items())), (event.end - event.start).days)
+        events_by_day = groups.setdefault(key, collections.OrderedDict())
+        events_by_day.setdefault(event.start.toordinal(), []).append(event)
+
+    compressed = []
+    for events_by_day in groups.values():
+        # Events repeated on the same day can't be part of the same series, so only the first
+        # one on each day is considered for a run
+        remaining = set(events_by_day)
+        while True:
+            runs = [(run, interval) for interval in RECURRENCE_INTERVALS for run in find_recurring_runs(sorted(remaining), interval)]
+            if not runs:
+                break
+            run, interval = max(runs, key=lambda r: len(r[0]))
+            first = events_by_day[run[0]][0]
+            count = (run[-1] - run[0]) // interval + 1
+            run_days = set(run)
+            excluded = [datetime.datetime.fromordinal(d) for d in range(run[0], run[-1], interval) if d not in run_days]
+            compressed.append(RecurringEvent(first.start, first.end, first.properties, interval, count, excluded))
+            remaining.difference_update(run)
+            for day in run:
+                events_by_day[day] = events_by_day[day][1:]
+        for day_events in events_by_day.values():
+            compressed.extend(day_events)
+    compressed.sort(key=lambda e: e.start)
+    return compressed
+
+# Splits the (sorted) day ordinals into runs of at least 2 days, `interval` days apart, with
+# at most RECURRENCE_MAX_SKIPPED occurrences missing in a row.
+def find_recurring_runs(days, interval):
+    runs = []
+    by_phase = collections.OrderedDict()
+    for day in days:
+        by_phase.setdefault(day % interval, []).append(day)
+    for phase_days in by_phase.values():
+        run = [phase_days[0]]
+        for day in phase_days[1:]:
+            if day - run[-1] <= interval * (RECURRENCE_MAX_SKIPPED + 1):
+                run.append(day)
+            else:
+                if len(run) > 1:
+                    runs.append(run)
+                run = [day]
+        if len(run) > 1:
+            runs.append(run)
+    return runs
 
 # Debugging utility
-def print_table(dicts, keys=[]):
+def print_table(dicts, keys=[], file=None):
     if not keys:
         keys = sorted(set(itertools.chain(*[d.keys() for d in dicts])))
     column_lens = { k: (max(len(k), *[len(str(d.get(k, ''))) for d in dicts]) + 1) for k in keys }
     format_str = ' '.join(["{{:<{}}}"] * len(keys)).format(*[column_lens[k] for k in keys])
-    print(format_str.format(*keys))
-    print(format_str.format(*['-'*column_lens[k] for k in keys]))
+    print(format_str.format(*keys), file=file)
+    print(format_str.format(*['-'*column_lens[k] for k in keys]), file=file)
     for d in dicts:
-        print(format_str.format(*[d.get(k,'') for k in keys]))
+        print(format_str.format(*[str(d.get(k,'')) for k in keys]), file=file)
+
+# Lazily yields the calendar's events in start order, fetching a page of `page_size` events
+# at a time. Stops after `num_events` events if given.
+def get_events_for_calendar(service, calendar_id='primary', num_events=None, from_time=(datetime.datetime.min.isoformat() + 'Z'), page_size=DEFAULT_PAGE_SIZE, retry_policy=None, private_properties=None, query=None):
+    if page_size < 1 or page_size > CALENDAR_API_MAX_PAGE_SIZE:
+        exit_with_error('page size must be between 1 and {} (got {})'.format(CALENDAR_API_MAX_PAGE_SIZE, page_size))
+
+    filters = {}
+    if query:
+        filters['q'] = query
+    if private_properties:
+        filters['privateExtendedProperty'] = ['{}={}'.format(k, v) for (k,v) in private_properties.items()]
 
-def get_events_for_calendar(service, calendar_id='primary', num_events=10, from_time=(datetime.datetime.min.isoformat() + 'Z')):
-    eventsResult = service.events().list(
-        calendarId=calendar_id, timeMin=from_time, maxResults=num_events, singleEvents=True,
-        orderBy='startTime').execute()
-    events = eventsResult.get('items', [])
-    return events
+    num_yielded = 0
+    page_token = None
+    while num_events is None or num_yielded < num_events:
+        max_results = page_size if num_events is None else min(page_size, num_events - num_yielded)
+        eventsResult = execute_request(service.events().list(
+            calendarId=calendar_id, timeMin=from_time, maxResults=max_results, singleEvents=True,
+            orderBy='startTime', pageToken=page_token, **filters), retry_policy)
+        for event in eventsResult.get('items', [])[:max_results]:
+            yield event
+            num_yielded += 1
+        page_token = eventsResult.get('nextPageToken')
+        if not page_token:
+            break
 
-def get_calendar_name_id_map(service):
-    calendars = service.calendarList().list().execute().get('items', [])
+def get_calendar_name_id_map(service, retry_policy=None, cache=None):
+    if cache:
+        calendars = cache.get_calendars(service, retry_policy)
+    else:
+        calendars = fetch_changes(service.calendarList().list, {}, None, retry_policy)[0].values()
     return {c['summary']: c['id'] for c in calendars}
 
-def create_events(service, events, to_calendar_id, tag=None):
+# Pages through a list method, applying the listed items to `items` (a dict of id -> item)
+# & returning it along with the token for fetching later changes. Given a sync token, only
+# the changes since that token was issued are fetched.
+def fetch_changes(list_method, items, sync_token=None, retry_policy=None, **params):
+    result = {}
+    for result in list_pages(list_method, sync_token, retry_policy, **params):
+        apply_changes(items, result)
+    return items, result.get('nextSyncToken')
+
+def list_pages(list_method, sync_token=None, retry_policy=None, **params):
+    page_token = None
+    while True:
+        kwargs = dict(params, pageToken=page_token)
+        if sync_token:
+            kwargs['syncToken'] = sync_token
+        result = execute_request(list_method(**kwargs), retry_policy)
+        yield result
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return
+
+# Applies a page of listed items to `items`, returning the ones added or changed.
+def apply_changes(items, result):
+    changed = []
+    for item in result.get('items', []):
+        if item.get('deleted') or item.get('status') == 'cancelled':
+            items.pop(item['id'], None)
+        else:
+            items[item['id']] = item
+            changed.append(item)
+    return changed
+
+def get_service_credentials(service):
+    return getattr(getattr(service, '_http', None), 'credentials', None)
+
+def get_account_key(service):
+    credentials = get_service_credentials(service)
+    identity = [getattr(credentials, 'client_id', None), getattr(credentials, 'refresh_token', None)]
+    if not any(identity):
+        return 'default'
+    return hashlib.sha256(json.dumps(identity).encode('utf-8')).hexdigest()[:16]
+
+# On-disk cache of an account's calendar list & template calendar events. Entries are
+# brought up to date with the API's sync tokens, so a refresh only fetches what changed;
+# entries refreshed in the last `max_age` seconds are used without asking the API at all.
+class CalendarCache:
+    def __init__(self, path, max_age=DEFAULT_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)['entries']
+            except (ValueError, KeyError, TypeError):
+                print('warning: ignoring unreadable cache file {}'.format(path), file=sys.stderr)
+
+    @classmethod
+    def for_account(cls, cache_dir, service, max_age=DEFAULT_CACHE_MAX_AGE):
+        return cls(os.path.join(cache_dir, '{}.json'.format(get_account_key(service))), max_age)
+
+    def get_calendars(self, service, retry_policy=None):
+        return list(self.refresh('calendarList', service.calendarList().list, retry_policy).values())
+
+    def put_calendar(self, calendar):
+        with self.lock:
+            entry = self.entries.get('calendarList')
+            if entry:
+                entry['items'][calendar['id']] = calendar
+                self.save()
+
+    def remove_calendar(self, calendar_id):
+        with self.lock:
+            entry = self.entries.get('calendarList')
+            if entry and entry['items'].pop(calendar_id, None) is not None:
+                self.save()
+
+    # Returns the calendar's events ordered by start date.
+    def get_events(self, service, calendar_id, page_size=DEFAULT_PAGE_SIZE, retry_policy=None):
+        items = self.refresh('events:{}'.format(calendar_id), service.events().list, retry_policy,
+            calendarId=calendar_id, singleEvents=True, maxResults=page_size)
+        return sorted(items.values(), key=lambda e: e['start'].get('date') or e['start'].get('dateTime'))
+
+    # Yields the events of a calendar that isn't cached yet as their pages arrive (in the
+    # API's order, not by date), & caches them, as get_events would have, once the last
+    # page has been read.
+    def stream_events(self, service, calendar_id, page_size=DEFAULT_PAGE_SIZE, retry_policy=None):
+        items = {}
+        result = {}
+        for result in list_pages(service.events().list, None, retry_policy,
+                calendarId=calendar_id, singleEvents=True, maxResults=page_size):
+            for item in apply_changes(items, result):
+                yield item
+        with self.lock:
+            self.entries['events:{}'.format(calendar_id)] = {
+                'items': items, 'syncToken': result.get('nextSyncToken'), 'fetched_at': time.time() }
+            self.save()
+
+    # Whether the calendar's events are cached at all; stale ones are brought up to date
+    # with a sync token, which is much cheaper than listing them again.
+    def has_events(self, calendar_id):
+        with self.lock:
+            return 'events:{}'.format(calendar_id) in self.entries
+
+    # The date of a template calendar's race day (see find_template_race_day)
+    def get_race_day(self, calendar_id):
+        with self.lock:
+            key = 'race_day:{}'.format(calendar_id)
+            return self.entries[key]['date'] if self.is_fresh(key) else None
+
+    def put_race_day(self, calendar_id, date):
+        with self.lock:
+            self.entries['race_day:{}'.format(calendar_id)] = { 'date': date, 'fetched_at': time.time() }
+            self.save()
+
+    def is_fresh(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and time.time() - entry['fetched_at'] < self.max_age
+
+    def refresh(self, key, list_method, retry_policy=None, **params):
+        with self.lock:
+            entry = self.entries.get(key)
+            if self.is_fresh(key):
+                return entry['items']
+            try:
+                if entry and entry.get('syncToken'):
+                    items, sync_token = fetch_changes(list_method, entry['items'], entry['syncToken'], retry_policy, **params)
+                else:
+                    items, sync_token = fetch_changes(list_method, {}, None, retry_policy, **params)
+            except Exception as e:
+                if not is_http_error(e) or e.resp.status != 410:
+                    raise
+                # 410 Gone: the sync token has expired, so everything has to be fetched again
+                print('warning: cached {} is out of date; fetching it again'.format(key), file=sys.stderr)
+                items, sync_token = fetch_changes(list_method, {}, None, retry_policy, **params)
+            self.entries[key] = { 'items': items, 'syncToken': sync_token, 'fetched_at': time.time() }
+            self.save()
+            return items
+
+    def save(self):
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({ 'entries': self.entries }, f)
+            os.replace(tmp_path, self.path)
+
+def get_event_bodies(events, tag=None):
     for event in events:
         if event.is_empty():
             print('Skipping empty event: {}'.format(event))
@@ -116,118 +776,1126 @@ def create_events(service, events, to_calendar_id, tag=None):
         new_event_body = event.build()
         if tag:
             new_event_body['etag'] = tag
+        yield event, new_event_body
+
+# Counters & latency histograms describing a run, each keyed by name & label values. They
+# are updated from worker threads, so every update takes the lock. Written out at exit for
+# --profile & --metrics-file.
+class Metrics:
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = collections.OrderedDict()
+            self.histograms = collections.OrderedDict()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = { 'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'max': 0.0 }
+            histogram['counts'][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+
+    # Adds the time spent in the block to phase_seconds_total for the given phase.
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.inc('phase_seconds_total', time.monotonic() - start, phase=name)
+
+    def get(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    # Mean of a histogram's observations across all its label values (None if there are none).
+    def mean(self, name):
+        with self.lock:
+            histograms = [h for ((n, _), h) in self.histograms.items() if n == name]
+            count = sum(sum(h['counts']) for h in histograms)
+            return sum(h['sum'] for h in histograms) / count if count else None
+
+    # Estimates the q'th quantile (0-1) of a histogram as the upper bound of the bucket it
+    # falls in (or the largest observation, for the last bucket).
+    def quantile(self, histogram, q):
+        count = sum(histogram['counts'])
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, histogram['counts']):
+            seen += bucket_count
+            if seen >= rank and seen > 0:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def to_json(self):
+        counters = collections.OrderedDict()
+        for (name, labels), value in self.counters.items():
+            counters.setdefault(name, []).append({ 'labels': dict(labels), 'value': value })
+        histograms = collections.OrderedDict()
+        for (name, labels), histogram in self.histograms.items():
+            histograms.setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': sum(histogram['counts']),
+                'sum': histogram['sum'],
+                'p50': self.quantile(histogram, 0.5),
+                'p99': self.quantile(histogram, 0.99),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], itertools.accumulate(histogram['counts']))),
+            })
+        return { 'counters': counters, 'histograms': histograms }
+
+    def to_prometheus(self):
+        lines = []
+        def format_labels(labels):
+            if not labels:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for (k,v) in labels) + '}'
+        typed = set()
+        for (name, labels), value in self.counters.items():
+            if name not in typed:
+                lines.append('# TYPE {}{} counter'.format(METRICS_PREFIX, name))
+                typed.add(name)
+            lines.append('{}{}{} {}'.format(METRICS_PREFIX, name, format_labels(labels), value))
+        for (name, labels), histogram in self.histograms.items():
+            if name not in typed:
+                lines.append('# TYPE {}{} histogram'.format(METRICS_PREFIX, name))
+                typed.add(name)
+            for bound, cumulative in zip([str(b) for b in self.buckets] + ['+Inf'], itertools.accumulate(histogram['counts'])):
+                lines.append('{}{}_bucket{} {}'.format(METRICS_PREFIX, name, format_labels(labels + (('le', bound),)), cumulative))
+            lines.append('{}{}_sum{} {}'.format(METRICS_PREFIX, name, format_labels(labels), histogram['sum']))
+            lines.append('{}{}_count{} {}'.format(METRICS_PREFIX, name, format_labels(labels), sum(histogram['counts'])))
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+
+# Wraps an httplib2.Http-like object to record the latency, status & size of every HTTP
+# request sent through it (each retry included) against the given API method.
+class MeteredHttp:
+    def __init__(self, http, method, metrics=METRICS):
+        self.http = http
+        self.method = method
+        self.metrics = metrics
+
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        start = time.monotonic()
+        status = 'error'
+        try:
+            resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+            status = str(resp.status)
+        finally:
+            self.metrics.observe('api_request_seconds', time.monotonic() - start, method=self.method)
+            self.metrics.inc('api_requests_total', method=self.method, status=status)
+        self.metrics.inc('api_sent_bytes_total', len(uri) + (len(body) if body else 0), method=self.method)
+        self.metrics.inc('api_received_bytes_total', len(content) if content else 0, method=self.method)
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+def get_metered_http(http, method):
+    return MeteredHttp(http, method) if http is not None else None
 
-        retries = 0
-        max_retries = 3
-        success = False
-        while not success and retries <= max_retries:
-            print('Creating event: {}'.format(new_event_body))
+RETRYABLE_HTTP_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_ERROR_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+RATE_LIMIT_ERROR_MESSAGES = ('Rate Limit Exceeded', 'User Rate Limit Exceeded')
+
+def get_error_reasons(e):
+    try:
+        error = json.loads(e.content.decode('utf-8'))['error']
+        return [d.get('reason') for d in error.get('errors', [])]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return []
+
+# googleapiclient is only imported once the API is needed (see get_calendar_service), & no
+# HttpError can have been raised before then, so there's no need to import it to check.
+def is_http_error(e):
+    errors = sys.modules.get('googleapiclient.errors')
+    return errors is not None and isinstance(e, errors.HttpError)
+
+def is_retryable_error(e):
+    if is_http_error(e):
+        if e.resp.status in RETRYABLE_HTTP_STATUSES:
+            return True
+        if e.resp.status == 403:
+            return e.reason in RATE_LIMIT_ERROR_MESSAGES or \
+                any(r in RATE_LIMIT_ERROR_REASONS for r in get_error_reasons(e))
+        return False
+    return isinstance(e, (socket.timeout, TimeoutError, ConnectionError))
+
+# Number of seconds the server asked us to wait before retrying, if it said.
+def get_retry_after(e):
+    resp = getattr(e, 'resp', None)
+    value = resp.get('retry-after') if resp is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def describe_error(e):
+    if is_http_error(e):
+        return 'HTTP {} ({})'.format(e.resp.status, e.reason)
+    return '{}: {}'.format(type(e).__name__, e)
+
+def get_error_kind(e):
+    return str(e.resp.status) if is_http_error(e) else type(e).__name__
+
+# Retries calls that fail with a retryable error (as decided by is_retryable) using
+# exponential backoff with full jitter, waiting at least as long as any Retry-After
+# header on the response.
+class RetryPolicy:
+    def __init__(self, max_retries=5, base_delay=1.0, max_delay=64.0, is_retryable=is_retryable_error):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.is_retryable = is_retryable
+
+    def get_delay(self, attempt, error=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        retry_after = get_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    # Sleeps before the given retry, or raises once max_retries have been used up.
+    def wait(self, attempt, error):
+        if attempt > self.max_retries:
+            exit_with_error('retry limit exceeded ({} retries); last error: {}'.format(self.max_retries, describe_error(error)))
+        delay = self.get_delay(attempt, error)
+        print('warning: {}, waiting {:.1f} seconds before retry ({}/{})'.format(
+            describe_error(error), delay, attempt, self.max_retries), file=sys.stderr)
+        METRICS.inc('retries_total', error=get_error_kind(error))
+        METRICS.inc('backoff_seconds_total', delay)
+        time.sleep(delay)
+
+    def call(self, func):
+        attempt = 0
+        while True:
             try:
-                new_event_result = service.events().insert(calendarId=to_calendar_id, body=new_event_body).execute()
-                success = True
-            except HttpError as e:
-                if e.reason == 'Rate Limit Exceeded':
-                    retries += 1
-                    wait_s = 5 * retries
-                    print('warning: rate limit exceeded, waiting {} seconds before retry ({}/{})'.format(wait_s, retries, max_retries), file=sys.stderr)
-                    time.sleep(wait_s)
-                else:
+                return func()
+            except Exception as e:
+                if not self.is_retryable(e):
                     raise
-        if retries > max_retries:
-            exit_with_error('error: retry limit exceeded ({})'.format(max_retries))
+                attempt += 1
+                self.wait(attempt, e)
 
-def load_events_from_calendar(service, calendar_name, race_day, ends_on_race_day):
-    cal_id_map = get_calendar_name_id_map(service)
-    if calendar_name not in cal_id_map:
-        raise ValueError("Provided template calendar '{}' does not exist.".format(template_calendar_name))
+DEFAULT_RETRY_POLICY = RetryPolicy()
 
-    calendar_id = cal_id_map[template_calendar_name]
-    cal_events = get_events_for_calendar(service, calendar_id=template_calendar_id, num_events=500)
+# Asks for a partial response with just the fields in API_RESPONSE_FIELDS, unless the
+# request already names its fields.
+def with_response_fields(request):
+    fields = API_RESPONSE_FIELDS.get(getattr(request, 'methodId', None))
+    uri = getattr(request, 'uri', None)
+    if fields and uri and 'fields' not in urllib.parse.parse_qs(urllib.parse.urlsplit(uri).query):
+        request.uri = uri + ('&' if '?' in uri else '?') + urllib.parse.urlencode({ 'fields': fields })
+    return request
 
-    if ends_on_race_day:
-        race_day_index = len(cal_events)-1
+def execute_request(request, retry_policy=None, limiter=None, http=None):
+    request = with_response_fields(request)
+    http = get_metered_http(http or getattr(request, 'http', None), getattr(request, 'methodId', 'unknown'))
+    def attempt():
+        if limiter:
+            limiter.acquire()
+        return request.execute(http=http)
+    return (retry_policy or DEFAULT_RETRY_POLICY).call(attempt)
+
+# Shared queries-per-second budget for API calls. Callers reserve tokens up front &
+# sleep off any debt, so concurrent callers are admitted in the order they asked and a
+# request for more tokens than the bucket holds (e.g. a whole batch) still goes through.
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= tokens
+            wait_s = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait_s > 0:
+            METRICS.inc('throttle_waits_total')
+            METRICS.inc('throttled_seconds_total', wait_s)
+            time.sleep(wait_s)
+        return wait_s
+
+# Calls func on each item using up to `concurrency` worker threads & yields the results in
+# the order of the items. The first error (in item order) is raised & no further items run.
+def run_in_order(func, items, concurrency=1):
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = collections.deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= concurrency * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+# One API request to be run by execute_calls. `key` identifies what the request is for &
+# is handed back with its response; `description` is logged when the request is sent.
+ApiCall = collections.namedtuple('ApiCall', ['key', 'description', 'request'])
+
+# Each insert is keyed by its date & its position among the events on that date, which
+# identifies it across runs of the same plan (see EventJournal).
+def get_insert_calls(service, events, to_calendar_id, tag=None, journal=None):
+    # Building a resource regenerates all of its methods, so do it once rather than per event
+    events_resource = service.events()
+    events_per_day = collections.Counter()
+    for event, new_event_body in get_event_bodies(events, tag):
+        day = new_event_body['start']['date']
+        key = '{}:{}'.format(day, events_per_day[day])
+        events_per_day[day] += 1
+        if journal is not None and key in journal:
+            print('Skipping event already created by an earlier run: {}'.format(event))
+            continue
+        yield ApiCall(key, 'Creating event: {}'.format(new_event_body),
+            events_resource.insert(calendarId=to_calendar_id, body=new_event_body))
+
+def create_events(service, events, to_calendar_id, tag=None, batch_size=None, concurrency=1, limiter=None, retry_policy=None, journal=None):
+    calls = get_insert_calls(service, events, to_calendar_id, tag, journal)
+    on_result = (lambda key, response: journal.record(key, response.get('id'))) if journal is not None else None
+    num_created = 0
+    for _ in execute_calls(service, calls, batch_size, concurrency, limiter, retry_policy, on_result):
+        num_created += 1
+    return num_created
+
+def check_batch_size(batch_size):
+    if batch_size < 1 or batch_size > CALENDAR_API_MAX_BATCH_SIZE:
+        exit_with_error('batch size must be between 1 and {} (got {})'.format(CALENDAR_API_MAX_BATCH_SIZE, batch_size))
+
+# Runs the given ApiCalls, singly or `batch_size` at a time through the batch endpoint, on
+# up to `concurrency` workers, which share the service's connections (see HttpPool).
+# Yields (key, response) pairs in the order of the calls; on_result(key, response), if
+# given, is called from the worker as soon as a call succeeds (for a batched call, even if
+# others in its batch then fail).
+def execute_calls(service, calls, batch_size=None, concurrency=1, limiter=None, retry_policy=None, on_result=None):
+    if batch_size is not None:
+        check_batch_size(batch_size)
+        def execute(batch):
+            return execute_call_batch(service, batch, limiter, retry_policy=retry_policy, on_result=on_result)
+        for results in run_in_order(execute, chunked(calls, batch_size), concurrency):
+            for result in results:
+                yield result
+    else:
+        def execute(call):
+            print(call.description)
+            response = execute_request(call.request, retry_policy, limiter)
+            if on_result:
+                on_result(call.key, response)
+            return call.key, response
+        for result in run_in_order(execute, calls, concurrency):
+            yield result
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Sends the calls as batch requests until every one has succeeded, resending only the
+# sub-requests that failed with a retryable error. Returns the (key, response) pairs in
+# the order of the calls. on_result(key, response), if given, is called for each call as
+# soon as it succeeds, so calls that succeeded are accounted for even if the batch goes on
+# to fail.
+def execute_call_batch(service, calls, limiter=None, http=None, retry_policy=None, on_result=None):
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    responses = {}
+    pending = list(range(len(calls)))
+    attempt = 0
+    while pending:
+        def send():
+            if limiter:
+                # Each sub-request counts against the quota on its own
+                limiter.acquire(len(pending))
+            return send_batch(service, [calls[i] for i in pending], http)
+        results = retry_policy.call(send)
+        failed = []
+        errors = []
+        for i,(response, e) in zip(pending, results):
+            if e is None:
+                responses[i] = response
+                if on_result:
+                    on_result(calls[i].key, response)
+            elif retry_policy.is_retryable(e):
+                failed.append((i, e))
+            else:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        if not failed:
+            break
+        attempt += 1
+        print('warning: {} of {} batched requests failed'.format(len(failed), len(pending)), file=sys.stderr)
+        retry_policy.wait(attempt, max(failed, key=lambda f: get_retry_after(f[1]) or 0)[1])
+        pending = [i for (i, e) in failed]
+    return [(call.key, responses[i]) for (i, call) in enumerate(calls)]
+
+# Sends one batch request containing the given calls & returns a (response, error) pair
+# for each, in the order they were given.
+def send_batch(service, calls, http=None):
+    results = {}
+    def on_response(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=on_response)
+    for i,call in enumerate(calls):
+        print(call.description)
+        batch.add(with_response_fields(call.request), request_id=str(i))
+        METRICS.inc('api_batched_calls_total', method=getattr(call.request, 'methodId', 'unknown'))
+    batch.execute(http=get_metered_http(http or getattr(service, '_http', None), 'batch'))
+    return [results[i] for i in range(len(calls))]
+
+# Append-only record of the events a run has created, so that a run that dies partway
+# through can be resumed without creating those events again. Each line holds the key
+# of a created event (see get_insert_calls) & the id the API gave it. Lines are flushed
+# as they're written & fsynced every `fsync_every` events.
+class EventJournal:
+    def __init__(self, path, resume=False, fsync_every=DEFAULT_JOURNAL_FSYNC_EVERY):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.created = {}
+        self.unsynced = 0
+        self.lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by the crash; the event it was for will be created again
+                        continue
+                    self.created[entry['key']] = entry['id']
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a' if resume else 'w')
+
+    @classmethod
+    def for_calendar(cls, journal_dir, calendar_id, resume=False):
+        name = hashlib.sha256(calendar_id.encode('utf-8')).hexdigest()[:16]
+        return cls(os.path.join(journal_dir, '{}.jsonl'.format(name)), resume)
+
+    def __contains__(self, key):
+        return key in self.created
+
+    def __len__(self):
+        return len(self.created)
+
+    def record(self, key, event_id):
+        with self.lock:
+            self.created[key] = event_id
+            self.file.write(json.dumps({ 'key': key, 'id': event_id }) + '\n')
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every:
+                self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.sync()
+                self.file.close()
+
+# Where a run's events end up. write() takes the events as a stream & returns the number
+# written; close() is called once the run is done with the writer, even if it failed.
+class EventWriter:
+    def write(self, events):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+# Inserts the events into a Google calendar through the API (see create_events).
+class ApiEventWriter(EventWriter):
+    def __init__(self, service, calendar_id, tag=None, batch_size=None, concurrency=1, limiter=None, retry_policy=None, journal=None):
+        self.service = service
+        self.calendar_id = calendar_id
+        self.tag = tag
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.retry_policy = retry_policy
+        self.journal = journal
+
+    def write(self, events):
+        return create_events(self.service, events, self.calendar_id, self.tag, self.batch_size,
+            self.concurrency, self.limiter, self.retry_policy, self.journal)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+# Writes the events as all-day events to an RFC 5545 (iCalendar) file, which Google Calendar
+# & most other calendar apps can import in one go. Events are written as they arrive, so
+# memory use doesn't grow with the plan. Use '--' as the path to write to stdout.
+class IcsEventWriter(EventWriter):
+    def __init__(self, path, calendar_name, tag=None):
+        self.path = path
+        self.calendar_name = calendar_name
+        self.tag = tag
+        self.file = sys.stdout if path == '--' else open(path, 'w', encoding='utf-8', newline='')
+        self.timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        # UIDs stay the same across exports of the same plan, so importing it again updates
+        # the events instead of duplicating them.
+        self.uid_prefix = hashlib.sha256(calendar_name.encode('utf-8')).hexdigest()[:16]
+
+    def write(self, events):
+        self.write_lines([
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:' + ICS_PRODUCT_ID,
+            'CALSCALE:GREGORIAN',
+            'X-WR-CALNAME:' + escape_ics_text(self.calendar_name),
+        ])
+        num_written = 0
+        events_per_day = collections.Counter()
+        for event in events:
+            # Logged to stderr, since the file itself may be going to stdout
+            if event.is_empty():
+                print('Skipping empty event: {}'.format(event), file=sys.stderr)
+                continue
+            body = event.build()
+            day = body['start']['date']
+            lines = [
+                'BEGIN:VEVENT',
+                'UID:{}-{}-{}@training-calendar'.format(self.uid_prefix, day, events_per_day[day]),
+                'DTSTAMP:' + self.timestamp,
+                'DTSTART;VALUE=DATE:' + day.replace('-', ''),
+                'DTEND;VALUE=DATE:' + body['end']['date'].replace('-', ''),
+            ]
+            events_per_day[day] += 1
+            if body.get('summary'):
+                lines.append('SUMMARY:' + escape_ics_text(body['summary']))
+            if body.get('description'):
+                lines.append('DESCRIPTION:' + escape_ics_text(body['description']))
+            if body.get('notes'):
+                lines.append('COMMENT:' + escape_ics_text(body['notes']))
+            lines.extend(body.get('recurrence', []))
+            if self.tag:
+                lines.append('CATEGORIES:' + escape_ics_text(self.tag))
+            lines.append('END:VEVENT')
+            self.write_lines(lines)
+            num_written += 1
+        self.write_lines(['END:VCALENDAR'])
+        return num_written
+
+    def write_lines(self, lines):
+        self.file.write(''.join(fold_ics_line(line) for line in lines))
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+        else:
+            self.file.flush()
+
+def escape_ics_text(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n')
+
+# Folds a content line so that no line is longer than 75 octets (not counting the CRLF),
+# continuing it on lines that start with a space, without splitting any UTF-8 character.
+def fold_ics_line(line):
+    encoded = line.encode('utf-8')
+    if len(encoded) <= ICS_MAX_LINE_OCTETS:
+        return line + '\r\n'
+    parts = []
+    start = 0
+    limit = ICS_MAX_LINE_OCTETS
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        start = end
+        # The leading space of a continuation line counts towards its length
+        limit = ICS_MAX_LINE_OCTETS - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+# Private extended properties that identify the events a sync created, so that later syncs
+# of the same plan can find them again.
+SYNC_PLAN_PROPERTY = 'trainingCalendarPlan'
+SYNC_KEY_PROPERTY = 'trainingCalendarKey'
+SYNCED_EVENT_FIELDS = ['summary','description','start','end']
+
+# Gives each event a key that stays the same across runs of the same plan: its day
+# relative to the race day, plus its position among the events on that day.
+def get_event_sync_keys(events, race_day):
+    race_day_ordinal = datetime.datetime.strptime(race_day, TRAINING_CALENDAR_EVENT_DATE_FORMAT).toordinal()
+    events_per_day = collections.Counter()
+    for event in events:
+        offset = event.start.toordinal() - race_day_ordinal
+        yield '{}:{}'.format(offset, events_per_day[offset]), event
+        events_per_day[offset] += 1
+
+def get_synced_events(service, calendar_id, plan_id, page_size=DEFAULT_PAGE_SIZE, retry_policy=None):
+    return get_events_for_calendar(
+        service, calendar_id=calendar_id, page_size=page_size, retry_policy=retry_policy,
+        private_properties={ SYNC_PLAN_PROPERTY: plan_id })
+
+def get_sync_key(cal_event):
+    return cal_event.get('extendedProperties', {}).get('private', {}).get(SYNC_KEY_PROPERTY)
+
+# Compares the wanted event bodies (by sync key) against the events already in the calendar.
+# Returns the bodies to insert, the (event id, changed fields) to patch & the event ids to delete.
+def plan_sync(desired, existing):
+    inserts = []
+    patches = []
+    deletes = []
+    existing_by_key = {}
+    for cal_event in existing:
+        key = get_sync_key(cal_event)
+        if key in existing_by_key or key not in desired:
+            deletes.append(cal_event['id'])
+        else:
+            existing_by_key[key] = cal_event
+
+    for key, body in desired.items():
+        cal_event = existing_by_key.get(key)
+        if cal_event is None:
+            inserts.append(body)
+            continue
+        changes = {}
+        for field in SYNCED_EVENT_FIELDS:
+            # The API leaves empty fields out of the events it returns
+            if (body.get(field) or None) != (cal_event.get(field) or None):
+                changes[field] = body.get(field)
+        if changes:
+            patches.append((cal_event['id'], changes))
+    return inserts, patches, deletes
+
+# Brings the calendar in line with the events, touching only the events that differ from
+# what an earlier sync of the same plan left there. Only the fields the API returns (&
+# so can be compared on the next sync) are sent; the plan id stands in for the tag.
+def sync_events(service, events, to_calendar_id, plan_id, race_day, batch_size=None, concurrency=1, limiter=None, retry_policy=None, page_size=DEFAULT_PAGE_SIZE, what_if=False, estimate=None):
+    desired = collections.OrderedDict()
+    for key, event in get_event_sync_keys(events, race_day):
+        if event.is_empty():
+            continue
+        body = { k: v for (k,v) in event.build().items() if k in SYNCED_EVENT_FIELDS }
+        body['extendedProperties'] = { 'private': { SYNC_PLAN_PROPERTY: plan_id, SYNC_KEY_PROPERTY: key } }
+        desired[key] = body
+
+    existing = get_synced_events(service, to_calendar_id, plan_id, page_size, retry_policy) if to_calendar_id else []
+    inserts, patches, deletes = plan_sync(desired, existing)
+    print('{}Syncing plan \'{}\': {} to create, {} to update, {} to delete, {} unchanged'.format(
+        'WHAT-IF: ' if what_if else '', plan_id, len(inserts), len(patches), len(deletes),
+        len(desired) - len(inserts) - len(patches)))
+    if estimate is not None:
+        if to_calendar_id:
+            estimate.add('sync', get_page_count(len(existing), page_size))
+        estimate.add_calls('sync', len(inserts) + len(patches) + len(deletes), batch_size)
+
+    if what_if:
+        for body in inserts:
+            print('WHAT-IF: Creating event: {}'.format(body))
+        for event_id, changes in patches:
+            print('WHAT-IF: Updating event {}: {}'.format(event_id, changes))
+        for event_id in deletes:
+            print('WHAT-IF: Deleting event {}'.format(event_id))
+        return 0
+
+    events_resource = service.events()
+    calls = itertools.chain(
+        (ApiCall(body, 'Creating event: {}'.format(body),
+            events_resource.insert(calendarId=to_calendar_id, body=body)) for body in inserts),
+        (ApiCall(event_id, 'Updating event {}: {}'.format(event_id, changes),
+            events_resource.patch(calendarId=to_calendar_id, eventId=event_id, body=changes)) for (event_id, changes) in patches),
+        (ApiCall(event_id, 'Deleting event {}'.format(event_id),
+            events_resource.delete(calendarId=to_calendar_id, eventId=event_id)) for event_id in deletes))
+    num_changed = 0
+    for _ in execute_calls(service, calls, batch_size, concurrency, limiter, retry_policy):
+        num_changed += 1
+    return num_changed
+
+# Plan for clearing the way for a plan's events in an existing calendar (--force): either
+# delete the calendar's events that fall on the plan's dates, in batches, or delete the whole
+# calendar & create it again. Recreating takes 2 calls however many events there are, but
+# changes the calendar's id & would take any events outside the plan's dates with it.
+OverwritePlan = collections.namedtuple('OverwritePlan',
+    ['strategy', 'event_ids', 'num_kept', 'list_calls', 'delete_calls', 'recreate_calls', 'batch_size'])
+OVERWRITE_DELETE = 'delete'
+OVERWRITE_RECREATE = 'recreate'
+OVERWRITE_RECREATE_CALLS = 2
+
+def plan_overwrite(service, calendar_id, events, batch_size=None, page_size=DEFAULT_PAGE_SIZE, retry_policy=None):
+    batch_size = batch_size or CALENDAR_API_MAX_BATCH_SIZE
+    first_day = min(e.start.toordinal() for e in events) if len(events) else 0
+    last_day = max(e.end.toordinal() for e in events) if len(events) else 0
+    event_ids = []
+    num_kept = 0
+    list_calls = 0
+    events_resource = service.events()
+    page_token = None
+    while True:
+        # Recurring events are listed (& deleted) as a whole, by their first occurrence
+        result = execute_request(events_resource.list(
+            calendarId=calendar_id, maxResults=page_size, pageToken=page_token), retry_policy)
+        list_calls += 1
+        for cal_event in result.get('items', []):
+            start = cal_event['start'].get('date') or cal_event['start'].get('dateTime')[:10]
+            day = datetime.datetime.strptime(start, TRAINING_CALENDAR_EVENT_DATE_FORMAT).toordinal()
+            if first_day <= day < last_day:
+                event_ids.append(cal_event['id'])
+            else:
+                num_kept += 1
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            break
+    delete_calls = -(-len(event_ids) // batch_size)
+    # On a tie keep the calendar, & its id
+    recreate = num_kept == 0 and OVERWRITE_RECREATE_CALLS < delete_calls
+    return OverwritePlan(OVERWRITE_RECREATE if recreate else OVERWRITE_DELETE, event_ids, num_kept,
+        list_calls, delete_calls, OVERWRITE_RECREATE_CALLS, batch_size)
+
+def print_overwrite_plan(calendar_name, overwrite, what_if=False):
+    prefix = 'WHAT-IF: ' if what_if else ''
+    print("{}Overwriting calendar '{}': {} of its events fall on the plan's dates, {} don't".format(
+        prefix, calendar_name, len(overwrite.event_ids), overwrite.num_kept))
+    deleting = 'deleting the events ({} calls in batches of {})'.format(overwrite.delete_calls, overwrite.batch_size)
+    recreating = 'recreating the calendar ({} calls; its id changes)'.format(overwrite.recreate_calls)
+    if overwrite.strategy == OVERWRITE_RECREATE:
+        choice = '{} rather than {}'.format(recreating, deleting)
+        num_calls = overwrite.recreate_calls
+    elif overwrite.num_kept:
+        choice = '{}; {} would remove the events outside the plan\'s dates too'.format(deleting, recreating)
+        num_calls = overwrite.delete_calls
     else:
-        race_day_index = find_race_day(cal_events)
-    race_date = datetime.datetime.strptime(race_day, TRAINING_CALENDAR_EVENT_DATE_FORMAT)
-    template_race_date = datetime.datetime.strptime(cal_events[race_day_index]['start']['date'], TRAINING_CALENDAR_EVENT_DATE_FORMAT)
-    shift_dates_by = race_date - template_race_date
+        choice = '{} rather than {}'.format(deleting, recreating)
+        num_calls = overwrite.delete_calls
+    print('{}Strategy: {}; estimated {} calls, including {} to list the events'.format(
+        prefix, choice[0].upper() + choice[1:], overwrite.list_calls + num_calls, overwrite.list_calls))
+
+def delete_events(service, event_ids, calendar_id, batch_size=None, concurrency=1, limiter=None, retry_policy=None):
+    events_resource = service.events()
+    calls = (ApiCall(event_id, 'Deleting event {}'.format(event_id),
+        events_resource.delete(calendarId=calendar_id, eventId=event_id)) for event_id in event_ids)
+    num_deleted = 0
+    for _ in execute_calls(service, calls, batch_size, concurrency, limiter, retry_policy):
+        num_deleted += 1
+    return num_deleted
+
+def delete_calendar(service, calendar_id, cache=None, retry_policy=None):
+    execute_request(service.calendars().delete(calendarId=calendar_id), retry_policy)
+    print("Calendar deleted: {}".format(calendar_id))
+    if cache:
+        cache.remove_calendar(calendar_id)
+
+# The events of a template calendar for the given race day (see load_calendar_plan).
+def load_events_from_calendar(service, calendar_name, race_day, ends_on_race_day, page_size=DEFAULT_PAGE_SIZE, retry_policy=None, cache=None):
+    plan = load_calendar_plan(service, calendar_name, ends_on_race_day, page_size, retry_policy, cache)
+    return plan.shifted(datetime.datetime.strptime(race_day, TRAINING_CALENDAR_EVENT_DATE_FORMAT).toordinal())
 
-    events = [
-        Event(
+# Finds the date of a template calendar's race day with a search for its summary, so that
+# the template's events can be shifted as they're read rather than once all of them have
+# been. The search also matches events that merely mention the race day, so the results are
+# checked for the exact summary. The date is cached alongside the calendar list.
+def find_template_race_day(service, calendar_id, calendar_name, retry_policy=None, cache=None):
+    date = cache.get_race_day(calendar_id) if cache else None
+    if date is not None:
+        return date
+    matches = [e for e in get_events_for_calendar(service, calendar_id, retry_policy=retry_policy, query=RACE_DAY_SUMMARY)
+        if e.get('summary') == RACE_DAY_SUMMARY]
+    if not matches:
+        exit_with_no_race_day('calendar: {}'.format(calendar_name))
+    if len(matches) > 1:
+        exit_with_error("multiple events with summary 'RACE DAY' found; expected at most 1 (calendar: {}; on {})".format(
+            calendar_name, ', '.join(e['start']['date'] for e in matches)))
+    date = matches[0]['start']['date']
+    if cache:
+        cache.put_race_day(calendar_id, date)
+    return date
+
+# Like load_calendar_plan, but returns the events for the given race day as they're read
+# from the template, page by page, once its race day has been found. The template's events
+# are cached (see CalendarCache.stream_events) once they've all been read, but the plan
+# isn't compiled, so this suits runs that go through the events once.
+def stream_calendar_plan(service, calendar_name, race_day, page_size=DEFAULT_PAGE_SIZE, retry_policy=None, cache=None, cal_id_map=None):
+    calendar_id = get_template_calendar_id(service, calendar_name, retry_policy, cache, cal_id_map)
+    template_race_day = find_template_race_day(service, calendar_id, calendar_name, retry_policy, cache)
+    shift_dates_by = datetime.datetime.strptime(race_day, TRAINING_CALENDAR_EVENT_DATE_FORMAT) - \
+        datetime.datetime.strptime(template_race_day, TRAINING_CALENDAR_EVENT_DATE_FORMAT)
+    if cache:
+        cal_events = cache.stream_events(service, calendar_id, page_size, retry_policy)
+    else:
+        cal_events = get_events_for_calendar(service, calendar_id=calendar_id, page_size=page_size, retry_policy=retry_policy)
+    return shift_calendar_events(check_template_race_day(cal_events, template_race_day, calendar_name), shift_dates_by)
+
+# Passes the events through, failing if the race day isn't where it was found to be (say,
+# because the template changed since).
+def check_template_race_day(cal_events, race_day, calendar_name):
+    for e in cal_events:
+        if e.get('summary') == RACE_DAY_SUMMARY and e['start']['date'] != race_day:
+            exit_with_error("template calendar '{}' has a race day on {} but it was expected on {}; run again".format(
+                calendar_name, e['start']['date'], race_day))
+        yield e
+
+def shift_calendar_events(cal_events, shift_dates_by):
+    for e in cal_events:
+        yield Event(
             start=datetime.datetime.strptime(e['start']['date'], TRAINING_CALENDAR_EVENT_DATE_FORMAT) + shift_dates_by,
             end=datetime.datetime.strptime(e['end']['date'], TRAINING_CALENDAR_EVENT_DATE_FORMAT) + shift_dates_by,
             properties={ k: v for (k,v) in e.items() if k not in ('start','end') })
-        for e in cal_events]
-    return events
 
 def get_input_handle(path):
     if path == '--':
         return sys.stdin
-    return open(path, 'r')
+    return open(path, 'r', encoding='utf-8', newline='')
 
-def load_events_from_file(path, column_map, race_day, ends_on_race_day):
-    events_raw = []
-    race_day_index = -1
+# Returns a function that opens a fresh handle on the input each time it's called, so that
+# the input can be read more than once. stdin can only be read once, so it's kept in memory.
+# Large files are memory-mapped.
+def get_input_opener(path):
+    if path == '--':
+        data = sys.stdin.read()
+        return lambda: io.StringIO(data)
+    if os.path.isfile(path) and os.path.getsize(path) >= MMAP_MIN_BYTES:
+        return lambda: MappedFile(path)
+    return lambda: get_input_handle(path)
+
+# A (UTF-8) file read through a memory map. Iterating it slices the lines out of the map &
+# decodes them one at a time, so the file is never copied into Python strings as a whole or
+# in blocks, & its bytes can be hashed straight from the map.
+class MappedFile:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __iter__(self):
+        self.map.seek(0)
+        for line in iter(self.map.readline, b''):
+            yield line.decode('utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.map.close()
+
+# Reads the events of a plan source in one format. read() takes a handle on the source (an
+# iterable of its lines) & returns its header (the column names) & an iterable of its rows
+# (lists of cells in the header's order), so that every format shares the column map &
+# race day handling.
+class SourceReader:
+    extensions = ()
+
+    def read(self, f, source):
+        raise NotImplementedError()
+
+class CsvSourceReader(SourceReader):
+    extensions = ('.csv',)
+
+    def read(self, f, source):
+        return read_csv_rows(f)
+
+# One JSON object per line. The first object's fields are the columns; later objects may
+# leave fields out (like short CSV rows), but can't add any. Values that aren't strings are
+# kept as JSON text.
+class JsonLinesSourceReader(SourceReader):
+    extensions = ('.jsonl', '.ndjson')
+
+    def read(self, f, source):
+        records = (parse_json_line(line, number, source) for (number, line) in enumerate(f, 1) if line.strip())
+        first = next(records, None)
+        if first is None:
+            return [], iter(())
+        header = list(first[1])
+        return header, self.get_rows(itertools.chain([first], records), header, source)
+
+    @staticmethod
+    def get_rows(records, header, source):
+        for number, record in records:
+            row = [get_json_cell(record.pop(k, None)) for k in header]
+            if record:
+                exit_with_error("unexpected field '{}' on line {}; lines can only have the first line's fields ({})".format(
+                    next(iter(record)), number, source))
+            yield row
+
+def parse_json_line(line, number, source):
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        exit_with_error('invalid JSON on line {}: {} ({})'.format(number, e, source))
+    if not isinstance(record, dict):
+        exit_with_error('expected a JSON object on line {} ({})'.format(number, source))
+    return number, record
+
+def get_json_cell(value):
+    return value if value is None or isinstance(value, str) else json.dumps(value)
+
+SOURCE_READERS = {
+    'csv': CsvSourceReader(),
+    'jsonl': JsonLinesSourceReader(),
+}
+
+# The format is taken from the file's extension unless it's given; stdin & unknown
+# extensions are read as CSV.
+def get_source_format(path, source_format=None):
+    if source_format is not None:
+        return parse_source_format(source_format)
+    extension = os.path.splitext(path)[1].lower()
+    for name, reader in SOURCE_READERS.items():
+        if extension in reader.extensions:
+            return name
+    return DEFAULT_SOURCE_FORMAT
+
+def parse_source_format(value):
+    if value not in SOURCE_READERS:
+        exit_with_error('--format must be one of {} (got {})'.format(', '.join(SOURCE_READERS), value))
+    return value
+
+# Works out, from the CSV header alone, which column each event property is read from.
+# Returns a dict of lower-cased property name -> column index.
+def compile_column_map(header, column_map, path):
     column_map_lower = { k.lower(): v.lower() for (k,v) in column_map.items() }
-    # TODO: Close file ASAP after opening
-    with get_input_handle(path) as f:
-        reader = csv.DictReader(f)
-        for i,row in enumerate(reader):
-            # TODO: Do this all at once, not per record.
-            from_lower = { k.lower(): v for (k,v) in row.items() }
-            to_lower = {}
-            for from_c,to_c in column_map_lower.items():
-                if to_c in to_lower:
-                    exit_with_error(\
-                        "cannot map column '{0}' to '{1}' because '{1}' is already mapped (file: {2})".format(\
-                        from_c, to_c, path))
-                elif from_c in from_lower and to_c in from_lower and to_c not in column_map_lower:
-                    exit_with_error(\
-                        "cannot map column '{0}' to '{1}' because '{1}' already exists and is not remapped (file: {2})".format(\
-                        from_c, to_c, path))
-                elif from_c in from_lower:
-                    to_lower[to_c] = from_lower[from_c]
-            for k in from_lower:
-                if k not in column_map_lower:
-                    to_lower[k] = from_lower[k]
-            if 'summary' not in to_lower:
-                exit_with_error("expected column 'summary', but none found (file: {})".format(path))
-            events_raw.append(to_lower)
+    from_lower = { c.lower(): i for (i,c) in enumerate(header) }
+    to_lower = {}
+    for from_c,to_c in column_map_lower.items():
+        if to_c in to_lower:
+            exit_with_error(\
+                "cannot map column '{0}' to '{1}' because '{1}' is already mapped (file: {2})".format(\
+                from_c, to_c, path))
+        elif from_c in from_lower and to_c in from_lower and to_c not in column_map_lower:
+            exit_with_error(\
+                "cannot map column '{0}' to '{1}' because '{1}' already exists and is not remapped (file: {2})".format(\
+                from_c, to_c, path))
+        elif from_c in from_lower:
+            to_lower[to_c] = from_lower[from_c]
+    for k in from_lower:
+        if k not in column_map_lower:
+            to_lower[k] = from_lower[k]
+    if 'summary' not in to_lower:
+        exit_with_error("expected column 'summary', but none found (file: {})".format(path))
+    return to_lower
+
+def read_csv_rows(f):
+    reader = csv.reader(f)
+    header = next(reader, [])
+    # Skip blank lines, as csv.DictReader does
+    return header, (row for row in reader if row)
+
+# The events of a plan file for the given race day (see load_file_plan).
+def load_events_from_file(path, column_map, race_day, ends_on_race_day, source_format=None):
+    plan = load_file_plan(path, column_map, ends_on_race_day, source_format=source_format)
+    return plan.shifted(datetime.datetime.strptime(race_day, TRAINING_CALENDAR_EVENT_DATE_FORMAT).toordinal())
+
+# Like load_events_from_file, but the events are streamed from the file rather than compiled
+# into a plan, so memory use doesn't grow with the file. The rows are counted (& the race day
+# found) in a first pass; the column map & race day are checked eagerly, so errors in the
+# input are raised from here.
+def stream_events_from_file(path, column_map, race_day, ends_on_race_day, source_format=None):
+    reader = SOURCE_READERS[get_source_format(path, source_format)]
+    open_input = get_input_opener(path)
+    with open_input() as f:
+        header, rows = reader.read(f, 'file: {}'.format(path))
+        compiled_map = compile_column_map(header, column_map, path)
+        summary_index = compiled_map['summary']
+        num_rows, race_day_index = find_race_day_index(
+            None if ends_on_race_day else get_column(row, summary_index) for row in rows)
 
     if ends_on_race_day:
-        race_day_index = len(events_raw)-1
-    else:
-        race_day_index = find_race_day(events_raw)
+        race_day_index = num_rows-1
 
     if race_day_index < 0:
-        exit_with_error(
-            "no race day detected; ensure that there is a single event with the summary 'RACE DAY'" +
-            " or pass the --ends-on-race-day switch to this script (file: {})".format(path))
+        exit_with_no_race_day('file: {}'.format(path))
 
-    events = []
+    projection = [(k, i) for (k,i) in compiled_map.items() if k in EVENT_PROPERTIES_TO_RETAIN]
     race_day_dt = datetime.datetime.strptime(race_day, TRAINING_CALENDAR_EVENT_DATE_FORMAT)
+    first_dt = race_day_dt - datetime.timedelta(days=race_day_index)
+    return stream_events_from_rows(open_input, reader, projection, first_dt, path)
+
+def stream_events_from_rows(open_input, reader, projection, first_dt, path):
     one_day = datetime.timedelta(days=1)
-    for i,e in enumerate(events_raw):
-        days = race_day_index - i
-        this_dt = race_day_dt - datetime.timedelta(days=days)
-        event = Event(start=this_dt, end=this_dt+one_day, properties=e)
-        events.append(event)
-    return events
+    this_dt = first_dt
+    with open_input() as f:
+        header, rows = reader.read(f, 'file: {}'.format(path))
+        for row in rows:
+            next_dt = this_dt + one_day
+            yield Event(start=this_dt, end=next_dt, properties={ k: get_column(row, i) for (k,i) in projection })
+            this_dt = next_dt
+
+def get_column(row, index):
+    # Short rows are padded with None, as csv.DictReader does
+    return row[index] if index < len(row) else None
 
 def find_race_day(events):
+    return find_race_day_index(e.get('summary') for e in events)[1]
+
+# Returns the number of summaries & the index of the one for the race day (-1 if none).
+def find_race_day_index(summaries):
+    num_summaries = 0
     race_day_index = -1
-    for i,e in enumerate(events):
-        if e['summary'] == 'RACE DAY':
+    for i,summary in enumerate(summaries):
+        num_summaries += 1
+        if summary == RACE_DAY_SUMMARY:
             if race_day_index >= 0:
                 exit_with_error(\
-                    "multiple events_raw with summary 'RACE DAY' found; expected at most 1 " +
+                    "multiple events with summary 'RACE DAY' found; expected at most 1 " +
                     "(second found in entry {})".format(i+1))
             race_day_index = i
-    return race_day_index
+    return num_summaries, race_day_index
+
+# A compiled plan is an EventTable of a source's events with every day given as an offset
+# from the source's race day, checked & parsed once. The events for a given race day are
+# then just plan.shifted(race day ordinal), with no re-parsing.
+def compile_plan(entries, ends_on_race_day, source):
+    table = EventTable()
+    def summaries():
+        for start, end, properties in entries:
+            table.append_days(start, end, properties)
+            yield None if ends_on_race_day else properties.get('summary')
+    num_events, race_day_index = find_race_day_index(summaries())
+
+    if ends_on_race_day:
+        race_day_index = num_events-1
+    if race_day_index < 0:
+        exit_with_no_race_day(source)
+    return table.shifted(-table.starts[race_day_index])
+
+def compile_file_plan(open_input, reader, column_map, ends_on_race_day, path):
+    with open_input() as f:
+        header, rows = reader.read(f, 'file: {}'.format(path))
+        compiled_map = compile_column_map(header, column_map, path)
+        projection = [(k, i) for (k,i) in compiled_map.items() if k in EVENT_PROPERTIES_TO_RETAIN]
+        entries = ((i, i+1, { k: get_column(row, c) for (k,c) in projection }) for (i,row) in enumerate(rows))
+        return compile_plan(entries, ends_on_race_day, 'file: {}'.format(path))
+
+def compile_calendar_plan(cal_events, ends_on_race_day, calendar_name):
+    def get_day(date):
+        return datetime.datetime.strptime(date, TRAINING_CALENDAR_EVENT_DATE_FORMAT).toordinal()
+    entries = (
+        (get_day(e['start']['date']), get_day(e['end']['date']),
+            { k: v for (k,v) in e.items() if k in EVENT_PROPERTIES_TO_RETAIN })
+        for e in cal_events)
+    return compile_plan(entries, ends_on_race_day, 'calendar: {}'.format(calendar_name))
+
+# Compiled plans, keyed by a hash of everything they were compiled from, kept in memory
+# (so manifest jobs sharing a source compile it once) & on disk under `directory` if given.
+class PlanCache:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.plans = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(*parts):
+        digest = hashlib.sha256(json.dumps([PLAN_FORMAT_VERSION] + list(parts[:-1]), sort_keys=True).encode('utf-8'))
+        digest.update(parts[-1])
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, '{}.json'.format(key))
+
+    # Returns the plan for the key, calling compile() to make it if it isn't cached.
+    def get(self, key, compile):
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is None and self.directory and os.path.exists(self.get_path(key)):
+                try:
+                    with open(self.get_path(key), 'r') as f:
+                        plan = EventTable.from_dict(json.load(f))
+                except (ValueError, KeyError, TypeError):
+                    print('warning: ignoring unreadable compiled plan {}'.format(self.get_path(key)), file=sys.stderr)
+            if plan is None:
+                plan = compile()
+                if self.directory:
+                    self.save(key, plan)
+            self.plans[key] = plan
+            return plan
+
+    def save(self, key, plan):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.get_path(key) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(plan.to_dict(), f)
+        os.replace(tmp_path, self.get_path(key))
+
+def hash_input(open_input):
+    digest = hashlib.sha256()
+    with open_input() as f:
+        if isinstance(f, MappedFile):
+            digest.update(f.map)
+        else:
+            for chunk in iter(lambda: f.read(1 << 16), ''):
+                digest.update(chunk.encode('utf-8'))
+    return digest.digest()
+
+def load_file_plan(path, column_map, ends_on_race_day, plan_cache=None, source_format=None):
+    source_format = get_source_format(path, source_format)
+    open_input = get_input_opener(path)
+    compile = lambda: compile_file_plan(open_input, SOURCE_READERS[source_format], column_map, ends_on_race_day, path)
+    if plan_cache is None:
+        return compile()
+    key = PlanCache.get_key('file', source_format, sorted(column_map.items()), ends_on_race_day, hash_input(open_input))
+    return plan_cache.get(key, compile)
+
+# Template plans are cached by the template's calendar id & the ids & etags of its events
+# (an event's etag changes whenever it does), which is much cheaper to work out than the
+# plan itself. Events without an etag make the plan uncacheable.
+def load_calendar_plan(service, calendar_name, ends_on_race_day, page_size=DEFAULT_PAGE_SIZE, retry_policy=None, cache=None, plan_cache=None, cal_id_map=None):
+    calendar_id = get_template_calendar_id(service, calendar_name, retry_policy, cache, cal_id_map)
+    if cache:
+        cal_events = cache.get_events(service, calendar_id, page_size, retry_policy)
+    else:
+        cal_events = list(get_events_for_calendar(service, calendar_id=calendar_id, page_size=page_size, retry_policy=retry_policy))
+    compile = lambda: compile_calendar_plan(cal_events, ends_on_race_day, calendar_name)
+    versions = [(e.get('id'), e.get('etag')) for e in cal_events]
+    if plan_cache is None or not all(etag for (_, etag) in versions):
+        return compile()
+    key = PlanCache.get_key('calendar', calendar_id, ends_on_race_day, json.dumps(versions).encode('utf-8'))
+    return plan_cache.get(key, compile)
+
+def get_template_calendar_id(service, calendar_name, retry_policy=None, cache=None, cal_id_map=None):
+    if cal_id_map is None:
+        cal_id_map = get_calendar_name_id_map(service, retry_policy, cache)
+    if calendar_name not in cal_id_map:
+        exit_with_error("template calendar '{}' does not exist".format(calendar_name))
+    return cal_id_map[calendar_name]
 
 def exit_with_error(msg):
     raise TrainingCalendarError(msg)
 
+def exit_with_no_race_day(source):
+    exit_with_error(
+        "no race day detected; ensure that there is a single event with the summary 'RACE DAY'" +
+        " or pass the --ends-on-race-day switch to this script ({})".format(source))
+
 def help_and_exit():
     helpstr = """{script_upper}
     Create a training calendar in Google Calendars using a standard template or a
@@ -235,11 +1903,15 @@ def help_and_exit():
 
 USAGE:
     $ python {script} [-n] <new-calendar-name> [-r] <race-day> [options]
+    $ python {script} --manifest <path> [options]
 
     -n,--name <name>                    Display name for the calendar to be created.
     -r,--race-day <date>                Date that the given race will take place. Format: '{fmt}'
-    -f,--file <path>                    CSV file from which events should be copied. Use '--' to
-                                          read the events from stdin.
+    -f,--file <path>                    CSV or JSON Lines file from which events should be copied.
+                                          Use '--' to read the events from stdin.
+    --format <format>                   Format of the --file: one of {formats}. Default: taken
+                                          from the file's extension (.jsonl & .ndjson are JSON
+                                          Lines), otherwise {default_format}.
     -c,--template-calendar <name>       Name of template calendar from which events should
                                           be copied.
     -t,--tag <name>                     Name of the tag with which each event in the calendar
@@ -250,8 +1922,79 @@ USAGE:
     --ends-on-race-day                  Indicates that the last event in the CSV file should be
                                           used as the race day. A warning will be written if this
                                           is used with -c, but it otherwise does nothing.
+    -b,--batch-size <n>                 Insert events through the Calendar batch endpoint, <n> events
+                                          per batch request (at most {max_batch}). Failed events in a
+                                          batch are retried on their own.
+    -j,--concurrency <n>                Insert events using <n> parallel workers. Unless --qps is
+                                          given, the workers share a budget of {qps} queries/second.
+    --qps <rate>                        Maximum number of API queries per second to issue while
+                                          inserting events.
+    --max-retries <n>                   Number of times to retry an API call that failed with a
+                                          transient error (rate limit, 5xx, timeout). Default: {retries}
+    --timeout <seconds>                 Seconds to wait for the API to respond to a request before
+                                          giving up on it (it's retried like other transient
+                                          errors). Default: {timeout}
+    --page-size <n>                     Number of template calendar events to fetch per request
+                                          (at most {max_page}). Default: {page}
+    --sync                              Only create, update or delete the events that differ from
+                                          what an earlier --sync of the same plan left in the
+                                          calendar, instead of copying every event again. Events are
+                                          matched by plan (the tag if given, otherwise the calendar
+                                          name) & their day relative to the race day.
+    --cache-dir <path>                  Directory in which calendar lists, template calendar events
+                                          & compiled plans are cached between runs. Default: {cache_dir}
+    --no-cache                          Always fetch calendar lists & template events from the API,
+                                          & compile the plan from its source again. Nothing is written
+                                          to the cache directory, including the default journal.
+    --token <path>                      File in which the Google sign-in (access & refresh tokens) is
+                                          saved between runs. Runs sharing the file take turns to
+                                          refresh it, so only one of them asks you to sign in.
+                                          Default: {token}
+    --credentials <path>                OAuth client file downloaded from the Google API console,
+                                          used to sign in when there's no saved token. Default: {credentials}
+    --journal <path>                    File in which to record the events created in the calendar.
+                                          Default: a file per calendar under <cache-dir>/journals,
+                                          or none with --no-cache
+    --resume                            Skip the events that the journal says an earlier, interrupted
+                                          run already created in the calendar.
+    --manifest <path>                   Create a calendar for each job in a CSV or JSON manifest
+                                          instead (see MANIFEST FILE FORMAT).
+    --jobs <n>                          Number of manifest jobs to run at once. Default: 1
+    --report <path>                     File to which a JSON report of each manifest job's outcome
+                                          is written.
+    --compress                          Create one recurring event for each run of identical events
+                                          repeated every week (or every day), instead of an event
+                                          per occurrence; at most {max_skipped} occurrence in a row may be
+                                          missing from a run. Prints the compression ratio (also
+                                          with --what-if).
+    --output-ics <path>                 Write the events to an iCalendar (.ics) file instead of
+                                          creating a calendar through the API. The file can be
+                                          imported into Google Calendar (or most other calendar
+                                          apps) in one go; with --file no Google sign-in is needed.
+                                          The tag, if given, is written as each event's category.
+                                          Use '--' to write to stdout.
+    --force                             If the calendar already exists, remove its events that fall on
+                                          the plan's dates before copying the plan's events, instead
+                                          of adding them alongside. When nothing else is in the
+                                          calendar & it's cheaper, the whole calendar is deleted &
+                                          created again (giving it a new id). The chosen way & its
+                                          estimated number of API calls are printed (also with
+                                          --what-if).
     --what-if                           Indicates that no calendars should be created or events
                                           copied, but the potential actions taken should be logged.
+                                          With --file (& without --sync) this runs offline, without
+                                          signing in to Google. Ends with an estimate of the API
+                                          requests, quota units & time the run would take, per
+                                          phase, given --batch-size, --concurrency & --qps (&
+                                          the latency of the requests the what-if made, if any).
+    --estimate-file <path>              File to which the --what-if estimate is written as JSON (with
+                                          --manifest, each job's & their total).
+    --profile                           Print where the run's time went when it finishes: time per
+                                          phase, API requests & latencies per method, retries &
+                                          time spent throttled.
+    --metrics-file <path>               File to which the run's metrics are written when it finishes,
+                                          in Prometheus text format if <path> ends in .prom or .txt,
+                                          or as JSON otherwise.
     -h,--help,-?                        Show this message & exit.
 
 DESCRIPTION:
@@ -275,6 +2018,17 @@ CSV FILE FORMAT:
   - If a race day is not detected via the 'RACE DAY' summary & the --ends-on-race-day flag is
     not provided, an error will be thrown.
 
+MANIFEST FILE FORMAT:
+  - A CSV file with a header row, or a JSON file holding a list of objects, with one job per
+    row/object. Each job has the fields 'name', 'race_day' & one of 'file' or
+    'template_calendar_name' (or 'template'), plus optionally 'format', 'tag', 'column_map',
+    'output_ics', 'batch_size', 'concurrency', 'page_size' & the flags 'ends_on_race_day',
+    'sync', 'force', 'compress' & 'what_if' (true/false, yes/no or 1/0). Other fields are
+    an error.
+  - Fields left out of a job are taken from the command line, so e.g. a template calendar
+    given with -c is used by every job that doesn't name its own source.
+  - Relative file paths are relative to the manifest's directory.
+
 EXAMPLES:
   - Create a new calendar called 'Iron Dragon 2019' for a race day on June 15, 2019:
 
@@ -306,7 +2060,29 @@ EXAMPLES:
       $ head -n -3 fun_run.csv | python {script} \\
               -n 'Fun Run - August 2023' -r 2023-08-12
 
-""".format(script_upper=SCRIPT_NAME.upper(), script=SCRIPT_NAME, fmt=TRAINING_CALENDAR_EVENT_DATE_FORMAT)
+  - Write the events from 'marathon_training.csv' to 'marathon.ics' for importing into
+    a calendar by hand, without signing in to Google:
+
+      $ python {script} \\
+              -n 'Baltimore Marathon 2022' -r 2022-10-15 -f marathon_training.csv \\
+              --output-ics marathon.ics
+
+  - Create a calendar for each athlete listed in 'athletes.csv' from the same template,
+    4 calendars at a time:
+
+      $ cat athletes.csv
+      name,race_day
+      Alex - Iron Dragon 2019,2019-06-15
+      Sam - Iron Dragon 2019,2019-06-15
+      $ python {script} --manifest athletes.csv \\
+              -c 'Iron Man 70.3 Training Template' --jobs 4 --report results.json
+
+""".format(script_upper=SCRIPT_NAME.upper(), script=SCRIPT_NAME, fmt=TRAINING_CALENDAR_EVENT_DATE_FORMAT,
+        max_batch=CALENDAR_API_MAX_BATCH_SIZE, qps=DEFAULT_QUERIES_PER_SECOND,
+        retries=DEFAULT_RETRY_POLICY.max_retries, max_page=CALENDAR_API_MAX_PAGE_SIZE, page=DEFAULT_PAGE_SIZE,
+        cache_dir=DEFAULT_CACHE_DIR, max_skipped=RECURRENCE_MAX_SKIPPED, timeout=DEFAULT_HTTP_TIMEOUT,
+        token=DEFAULT_TOKEN_FILE, credentials=CLIENT_SECRET_FILE, formats=', '.join(SOURCE_READERS),
+        default_format=DEFAULT_SOURCE_FORMAT)
 
     print(helpstr, file=sys.stderr)
     sys.exit(0)
@@ -338,18 +2114,87 @@ def parse_arguments(args):
                 exit_with_error('exactly one of --file or --template-calendar-name required (got both)')
             inputs['template_calendar_name'] = args[i+1]
             i += 2
+        elif arg == '--format':
+            inputs['format'] = parse_source_format(args[i+1])
+            i += 2
         elif arg in ('-t','--tag'):
             inputs['tag'] = args[i+1]
             i += 2
         elif arg in ('-m','--column-map'):
             inputs['column_map'] = args[i+1]
             i += 2
+        elif arg in ('-b','--batch-size'):
+            inputs['batch_size'] = parse_positive_int('--batch-size', args[i+1])
+            i += 2
+        elif arg in ('-j','--concurrency'):
+            inputs['concurrency'] = parse_positive_int('--concurrency', args[i+1])
+            i += 2
+        elif arg == '--qps':
+            inputs['qps'] = parse_positive_float('--qps', args[i+1])
+            i += 2
+        elif arg == '--max-retries':
+            inputs['max_retries'] = parse_positive_int('--max-retries', args[i+1], allow_zero=True)
+            i += 2
+        elif arg == '--timeout':
+            inputs['timeout'] = parse_positive_float('--timeout', args[i+1])
+            i += 2
+        elif arg == '--page-size':
+            inputs['page_size'] = parse_positive_int('--page-size', args[i+1])
+            i += 2
         elif arg == '--ends-on-race-day':
             inputs['ends_on_race_day'] = True
             i += 1
+        elif arg == '--sync':
+            inputs['sync'] = True
+            i += 1
+        elif arg == '--no-cache':
+            inputs['no_cache'] = True
+            i += 1
+        elif arg == '--cache-dir':
+            inputs['cache_dir'] = args[i+1]
+            i += 2
+        elif arg == '--token':
+            inputs['token'] = args[i+1]
+            i += 2
+        elif arg == '--credentials':
+            inputs['credentials'] = args[i+1]
+            i += 2
+        elif arg == '--resume':
+            inputs['resume'] = True
+            i += 1
+        elif arg == '--journal':
+            inputs['journal'] = args[i+1]
+            i += 2
+        elif arg == '--manifest':
+            inputs['manifest'] = args[i+1]
+            i += 2
+        elif arg == '--jobs':
+            inputs['jobs'] = parse_positive_int('--jobs', args[i+1])
+            i += 2
+        elif arg == '--report':
+            inputs['report'] = args[i+1]
+            i += 2
         elif arg == '--what-if':
             inputs['what_if'] = True
             i += 1
+        elif arg == '--compress':
+            inputs['compress'] = True
+            i += 1
+        elif arg == '--estimate-file':
+            inputs['estimate_file'] = args[i+1]
+            i += 2
+        elif arg == '--force':
+            inputs['force'] = True
+            i += 1
+        elif arg == '--output-ics':
+            inputs['output_ics'] = args[i+1]
+            i += 2
+        elif arg == '--profile':
+            inputs['profile'] = True
+            i += 1
+        elif arg == '--metrics-file':
+            inputs['metrics_file'] = args[i+1]
+            i += 2
         elif arg in ('-h','--help','help','?','-?'):
             help_and_exit()
         else:
@@ -362,6 +2207,11 @@ def parse_arguments(args):
                 inputs['name'] = arg
             i += 1
 
+    check_inputs(inputs)
+
+    if 'manifest' in inputs:
+        return inputs
+
     no_required_arg_fmt = 'missing required argument: {}'
     if 'name' not in inputs:
         msg = no_required_arg_fmt.format('--name')
@@ -374,52 +2224,541 @@ def parse_arguments(args):
 
     return inputs
 
+# Checks the options that can't be combined, for the command line & for each manifest job
+# (whose errors are prefixed with the job's entry).
+def check_inputs(inputs, prefix=''):
+    if inputs.get('compress', False) and inputs.get('sync', False):
+        exit_with_error(prefix + '--compress can\'t be used with --sync')
+    if 'estimate_file' in inputs and not inputs.get('what_if', False):
+        exit_with_error(prefix + '--estimate-file requires --what-if')
+    if inputs.get('force', False) and inputs.get('sync', False):
+        exit_with_error(prefix + '--force can\'t be used with --sync')
+    if inputs.get('force', False) and inputs.get('resume', False):
+        exit_with_error(prefix + '--force can\'t be used with --resume')
+    if inputs.get('force', False) and 'output_ics' in inputs:
+        exit_with_error(prefix + '--force can\'t be used with --output-ics')
+    if inputs.get('resume', False) and inputs.get('no_cache', False) and 'journal' not in inputs:
+        exit_with_error(prefix + '--resume requires --journal when used with --no-cache')
+    if 'output_ics' in inputs and inputs.get('sync', False):
+        exit_with_error(prefix + '--output-ics can\'t be used with --sync')
+    if 'output_ics' in inputs and 'manifest' in inputs:
+        exit_with_error(prefix + '--output-ics can\'t be used with --manifest; give each job its own output_ics instead')
+
+def parse_positive_int(name, value, allow_zero=False):
+    try:
+        parsed = int(value)
+    except ValueError:
+        parsed = -1
+    if parsed < (0 if allow_zero else 1):
+        exit_with_error('{} must be a {} integer (got {})'.format(name, 'non-negative' if allow_zero else 'positive', value))
+    return parsed
+
+def parse_positive_float(name, value):
+    try:
+        parsed = float(value)
+    except ValueError:
+        parsed = 0
+    if not parsed > 0:
+        exit_with_error('{} must be a positive number (got {})'.format(name, value))
+    return parsed
+
 # TODO: Test me
 def parse_column_map(column_map):
     pairs = column_map.split(',')
     mapped = [tuple(p.split(':')) for p in pairs]
     return dict(mapped)
 
+def get_limiter(inputs):
+    parallel = inputs.get('concurrency', 1) > 1 or inputs.get('jobs', 1) > 1
+    qps = inputs.get('qps', DEFAULT_QUERIES_PER_SECOND if parallel else None)
+    return TokenBucket(qps) if qps else None
+
 def main(args):
     inputs = parse_arguments(args)
 
+    METRICS.reset()
+    try:
+        with METRICS.phase('total'):
+            retry_policy = RetryPolicy(max_retries=inputs['max_retries']) if 'max_retries' in inputs else DEFAULT_RETRY_POLICY
+            limiter = get_limiter(inputs)
+            plan_cache = PlanCache(None if inputs.get('no_cache', False) else \
+                os.path.join(inputs.get('cache_dir', DEFAULT_CACHE_DIR), 'plans'))
+
+            # Signing in & building the service happen in the background, so that reading
+            # the plan doesn't have to wait for them (see run_job)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                if is_offline(inputs):
+                    service = cache = None
+                else:
+                    credentials = CredentialManager(inputs.get('token', DEFAULT_TOKEN_FILE), inputs.get('credentials', CLIENT_SECRET_FILE))
+                    service = executor.submit(get_calendar_service, inputs.get('timeout', DEFAULT_HTTP_TIMEOUT), credentials)
+                    cache = None if inputs.get('no_cache', False) else executor.submit(
+                        lambda: CalendarCache.for_account(inputs.get('cache_dir', DEFAULT_CACHE_DIR), service.result()))
+
+                if 'manifest' in inputs:
+                    run_manifest(resolve(service), inputs, resolve(cache), limiter, retry_policy, plan_cache)
+                else:
+                    result = run_job(service, inputs, cache, limiter, retry_policy, plan_cache)
+                    if 'estimate' in result and 'estimate_file' in inputs:
+                        write_cost_estimate(result['estimate'], inputs['estimate_file'])
+    finally:
+        # Phases that ran side by side add up to more than the total; the difference is
+        # latency that was hidden by running them in parallel
+        phase_seconds = sum(value for ((name, labels), value) in METRICS.counters.items()
+            if name == 'phase_seconds_total' and labels != (('phase', 'total'),))
+        METRICS.inc('hidden_latency_seconds_total', max(0, phase_seconds - METRICS.get('phase_seconds_total', phase='total')))
+        if inputs.get('profile', False):
+            print_metrics_report(METRICS, get_report_file(inputs))
+        if 'metrics_file' in inputs:
+            write_metrics(METRICS, inputs['metrics_file'])
+
+# Returns the value, or its result if it's a Future (main connects to the API in the
+# background, so run_job may be handed the service & cache before they're ready).
+def resolve(value):
+    return value.result() if isinstance(value, concurrent.futures.Future) else value
+
+def lookup_calendars(service, cache=None, retry_policy=None):
+    service, cache = resolve(service), resolve(cache)
+    with METRICS.phase('calendar_lookup'):
+        return get_calendar_name_id_map(service, retry_policy, cache)
+
+def create_calendar(service, name, cache=None, retry_policy=None):
+    new_calendar_data = { 'summary': name, 'timeZone': 'America/Chicago', 'accessRole': 'owner' }
+    with METRICS.phase('calendar_create'):
+        new_calendar_result = execute_request(service.calendars().insert(body=new_calendar_data), retry_policy)
+    print("New calendar created: {}".format(new_calendar_result))
+    if cache:
+        cache.put_calendar(new_calendar_result)
+    return new_calendar_result['id']
+
+# A template's events can be copied as they're read (see stream_calendar_plan), so that the
+# first ones are created while the rest are still being read, unless the run needs all of
+# them up front (to compare, compress or clear the way for them), the race day is found by
+# position (--ends-on-race-day), or the template is in the cache already (even if stale: it
+# can be brought up to date incrementally & its compiled plan reused).
+def can_stream_template(inputs, cache=None, cal_id_map=None):
+    if any(inputs.get(k, False) for k in ('sync', 'compress', 'force', 'ends_on_race_day')):
+        return False
+    calendar_id = (cal_id_map or {}).get(inputs['template_calendar_name'])
+    return not (cache and calendar_id and cache.has_events(calendar_id))
+
+# A --what-if of copying a CSV file's events, or writing them to an ICS file, doesn't need
+# anything from the API (unless --force has to look at what's in the calendar), so it's run
+# without authenticating (or importing the Google client libraries).
+def is_offline(inputs):
+    return (inputs.get('what_if', False) or 'output_ics' in inputs) and 'file' in inputs and \
+        not inputs.get('sync', False) and not inputs.get('force', False) and 'manifest' not in inputs
+
+# Writes the metrics in Prometheus text format if the path ends in .prom or .txt, or as
+# JSON otherwise.
+def write_metrics(metrics, path):
+    with open(path, 'w') as f:
+        if os.path.splitext(path)[1].lower() in ('.prom', '.txt'):
+            f.write(metrics.to_prometheus())
+        else:
+            json.dump(metrics.to_json(), f, indent=2)
+
+def print_metrics_report(metrics, file=None):
+    report = metrics.to_json()
+    def counter(name):
+        return { tuple(sorted(c['labels'].items())): c['value'] for c in report['counters'].get(name, []) }
+
+    print('\nPhases (seconds):', file=file)
+    print_table([{ 'phase': dict(labels)['phase'], 'seconds': '{:.3f}'.format(value) }
+        for (labels, value) in counter('phase_seconds_total').items()], ['phase', 'seconds'], file=file)
+
+    requests = collections.Counter()
+    errors = collections.Counter()
+    for labels, value in counter('api_requests_total').items():
+        labels = dict(labels)
+        requests[labels['method']] += value
+        if not labels['status'].startswith('2'):
+            errors[labels['method']] += value
+    sent = { dict(labels)['method']: value for (labels, value) in counter('api_sent_bytes_total').items() }
+    received = { dict(labels)['method']: value for (labels, value) in counter('api_received_bytes_total').items() }
+    rows = []
+    for histogram in report['histograms'].get('api_request_seconds', []):
+        method = histogram['labels']['method']
+        rows.append({
+            'method': method, 'requests': requests[method], 'errors': errors[method],
+            'p50_ms': '{:.1f}'.format(histogram['p50'] * 1000), 'p99_ms': '{:.1f}'.format(histogram['p99'] * 1000),
+            'total_s': '{:.3f}'.format(histogram['sum']), 'sent_bytes': sent.get(method, 0), 'received_bytes': received.get(method, 0) })
+    if rows:
+        print('\nAPI requests:', file=file)
+        print_table(rows, ['method', 'requests', 'errors', 'p50_ms', 'p99_ms', 'total_s', 'sent_bytes', 'received_bytes'], file=file)
+
+    print('\nRetries: {} ({:.1f} seconds backing off)'.format(
+        sum(counter('retries_total').values()), metrics.get('backoff_seconds_total')), file=file)
+    print('Throttled: {} times ({:.1f} seconds)'.format(
+        metrics.get('throttle_waits_total'), metrics.get('throttled_seconds_total')), file=file)
+    print('Hidden by running phases in parallel: {:.3f} seconds'.format(metrics.get('hidden_latency_seconds_total')), file=file)
+
+# What a --what-if run would cost for real, phase by phase: the API requests made, the quota
+# units used (every call in a batch request counts on its own) & the time taken. Requests are
+# assumed to take `latency` seconds each (measured from the what-if's own requests where it
+# made any), `concurrency` at a time where the run issues them in parallel, & no faster than
+# `qps` quota units a second where the run limits its rate.
+class CostEstimate:
+    def __init__(self, concurrency=1, qps=None):
+        self.concurrency = concurrency
+        self.qps = qps
+        self.phases = collections.OrderedDict()
+
+    # Requests the run makes one after another, outside the rate limit (lookups, reads ...).
+    def add(self, phase, requests):
+        self.add_to_phase(phase, requests, requests, 0)
+
+    # Calls the run makes through execute_calls: batched if `batch_size` is given, spread
+    # over the workers & rate limited.
+    def add_calls(self, phase, num_calls, batch_size=None):
+        requests = get_page_count(num_calls, batch_size) if batch_size else num_calls
+        self.add_to_phase(phase, 0, num_calls, requests)
+
+    def add_to_phase(self, phase, serial_requests, quota_units, parallel_requests):
+        totals = self.phases.setdefault(phase, { 'serial': 0, 'parallel': 0, 'quota_units': 0 })
+        totals['serial'] += serial_requests
+        totals['parallel'] += parallel_requests
+        totals['quota_units'] += quota_units
+
+    def to_dict(self, latency=None):
+        measured = latency is not None
+        latency = latency if measured else DEFAULT_API_LATENCY
+        phases = []
+        for phase, totals in self.phases.items():
+            seconds = totals['parallel'] * latency / self.concurrency
+            if self.qps and totals['parallel']:
+                seconds = max(seconds, (totals['quota_units'] - totals['serial']) / self.qps)
+            phases.append({ 'phase': phase, 'requests': totals['serial'] + totals['parallel'],
+                'quota_units': totals['quota_units'], 'seconds': round(totals['serial'] * latency + seconds, 3) })
+        return {
+            'phases': phases,
+            'requests': sum(p['requests'] for p in phases),
+            'quota_units': sum(p['quota_units'] for p in phases),
+            'seconds': round(sum(p['seconds'] for p in phases), 3),
+            'latency_seconds': round(latency, 4),
+            'latency_source': 'measured' if measured else 'default',
+            'concurrency': self.concurrency,
+            'qps': self.qps,
+        }
+
+def get_page_count(num_items, page_size):
+    return max(1, -(-num_items // page_size))
+
+def print_cost_estimate(estimate):
+    print('WHAT-IF: Estimated cost:')
+    print_table([dict(p, seconds='{:.2f}'.format(p['seconds'])) for p in estimate['phases']] +
+        [{ 'phase': 'total', 'requests': estimate['requests'], 'quota_units': estimate['quota_units'],
+            'seconds': '{:.2f}'.format(estimate['seconds']) }],
+        ['phase', 'requests', 'quota_units', 'seconds'])
+    print('(assuming {:.0f} ms per request ({}), {} at a time{})'.format(
+        estimate['latency_seconds'] * 1000, estimate['latency_source'], estimate['concurrency'],
+        ', at most {:g} queries per second'.format(estimate['qps']) if estimate['qps'] else ''))
+
+# Adds up the estimates of several runs (e.g. a manifest's jobs, which run side by side, so
+# the time is only an upper bound).
+def add_cost_estimates(estimates):
+    total = { 'requests': 0, 'quota_units': 0, 'seconds': 0.0 }
+    for estimate in estimates:
+        for key in total:
+            total[key] += estimate[key]
+    total['seconds'] = round(total['seconds'], 3)
+    return total
+
+def write_cost_estimate(estimate, path):
+    with open(path, 'w') as f:
+        json.dump(estimate, f, indent=2)
+
+# Creates (or syncs) the calendar described by `inputs` & returns a summary of what was done.
+def run_job(service, inputs, cache=None, limiter=None, retry_policy=None, plan_cache=None, stream_template=True):
     new_calendar_name = inputs['name']
     race_day = inputs['race_day']
     if 'tag' in inputs:
         tag = inputs['tag']
     else:
         tag = None
+    what_if = inputs.get('what_if', False)
+    # A --what-if run adds up what each step would cost for real as it goes
+    estimate = CostEstimate(inputs.get('concurrency', 1), limiter.rate if limiter else None) if what_if else None
+
+    # The steps of a run form a small dependency graph: the calendar lookup (which needs the
+    # API) runs alongside loading the plan (which, from a file, doesn't), & a new calendar is
+    # created while the events are being prepared. It's only created once the plan has
+    # loaded, so that a bad plan doesn't leave an empty calendar behind.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        lookup = None
+        if service is not None and 'output_ics' not in inputs:
+            lookup = executor.submit(lookup_calendars, service, cache, retry_policy)
 
-    service = get_calendar_service()
-    if 'file' in inputs:
-        column_map = parse_column_map(inputs['column_map']) if 'column_map' in inputs else {}
-        events = load_events_from_file(inputs['file'], column_map, race_day, inputs.get('ends_on_race_day', False))
-        shift_dates_by = datetime.timedelta(days=0)
-    elif 'template_calendar_name' in inputs:
-        events = load_events_from_calendar(service, inputs['template_calendar_name'])
-        if inputs['ends_on_race_day']:
-            race_day_index = len(events)-1
-        else:
-            race_day_index = find_race_day(events)
         race_date = datetime.datetime.strptime(race_day, TRAINING_CALENDAR_EVENT_DATE_FORMAT)
-        shift_dates_by = race_date - events[race_day_index].date 
-    else:
-        exit_with_error('exactly one of --file or --template-calendar-name required (got neither)')
+        if 'file' in inputs:
+            column_map = parse_column_map(inputs['column_map']) if 'column_map' in inputs else {}
+            with METRICS.phase('load'):
+                if 'output_ics' in inputs and not inputs.get('compress', False):
+                    # Written out as they're read, so memory use doesn't grow with the plan
+                    events = stream_events_from_file(inputs['file'], column_map, race_day,
+                        inputs.get('ends_on_race_day', False), inputs.get('format'))
+                else:
+                    plan = load_file_plan(inputs['file'], column_map, inputs.get('ends_on_race_day', False), plan_cache, inputs.get('format'))
+                    events = plan.shifted(race_date.toordinal())
+        elif 'template_calendar_name' in inputs:
+            # A template can only be read once signed in, so there's nothing to overlap here
+            cal_id_map = lookup.result() if lookup is not None else None
+            with METRICS.phase('load'):
+                page_size = inputs.get('page_size', DEFAULT_PAGE_SIZE)
+                if stream_template and can_stream_template(inputs, resolve(cache), cal_id_map):
+                    events = stream_calendar_plan(
+                        resolve(service), inputs['template_calendar_name'], race_day,
+                        page_size, retry_policy, resolve(cache), cal_id_map)
+                    if estimate is not None:
+                        events = list(events)
+                        # The race day search, then the template's pages
+                        estimate.add('load', 1 + get_page_count(len(events), page_size))
+                else:
+                    plan = load_calendar_plan(
+                        resolve(service), inputs['template_calendar_name'], inputs.get('ends_on_race_day', False),
+                        page_size, retry_policy, resolve(cache), plan_cache, cal_id_map)
+                    events = plan.shifted(race_date.toordinal())
+                    if estimate is not None:
+                        estimate.add('load', get_page_count(len(events), page_size))
+        else:
+            exit_with_error('exactly one of --file or --template-calendar-name required (got neither)')
 
-    cal_id_map = get_calendar_name_id_map(service)
-    if new_calendar_name not in cal_id_map:
-        print("{}Creating new calendar".format('WHAT-IF: ' if inputs.get('what_if', False) else ''))
-        if not inputs.get('what_if', False):
-            new_calendar_data = { 'summary': new_calendar_name, 'timeZone': 'America/Chicago', 'accessRole': 'owner' }
-            new_calendar_result = service.calendars().insert(body=new_calendar_data).execute()
-            print("New calendar created: {}".format(new_calendar_result))
-            new_calendar_id = new_calendar_result['id']
-    else:
-        new_calendar_id = cal_id_map[new_calendar_name]
-        print("Calendar '{}' (id='{}') already exists".format(new_calendar_name, new_calendar_id))
+        new_calendar_id = None
+        create = None
+        if 'output_ics' not in inputs:
+            # Without a lookup the run is offline (see is_offline), so there's no way to tell
+            # whether the calendar exists yet
+            cal_id_map = lookup.result() if lookup is not None else {}
+            if estimate is not None:
+                estimate.add('calendar_lookup', get_page_count(len(cal_id_map), CALENDAR_LIST_PAGE_SIZE))
+            if new_calendar_name not in cal_id_map:
+                print("{}Creating new calendar".format('WHAT-IF: ' if what_if else ''))
+                if estimate is not None:
+                    estimate.add('calendar_create', 1)
+                if not what_if:
+                    create = executor.submit(create_calendar, resolve(service), new_calendar_name, resolve(cache), retry_policy)
+            else:
+                new_calendar_id = cal_id_map[new_calendar_name]
+                print("Calendar '{}' (id='{}') already exists".format(new_calendar_name, new_calendar_id))
+                if inputs.get('force', False):
+                    new_calendar_id, create = overwrite_calendar(
+                        executor, resolve(service), new_calendar_name, new_calendar_id, events, inputs,
+                        resolve(cache), limiter, retry_policy, estimate)
 
-    if inputs.get('what_if', False):
+        if inputs.get('compress', False):
+            events = compress_recurring_events(events, get_report_file(inputs))
+            print_compression_report(events, what_if, get_report_file(inputs))
+
+        if 'output_ics' in inputs:
+            return write_ics(inputs, events, tag)
+        if create is not None:
+            new_calendar_id = create.result()
+
+    service = resolve(service)
+    cache = resolve(cache)
+    concurrency = inputs.get('concurrency', 1)
+    result = { 'calendar_id': new_calendar_id, 'events': 0 }
+    if inputs.get('sync', False):
+        with METRICS.phase('sync'):
+            result['events'] = sync_events(
+                service, events, new_calendar_id, tag if tag else new_calendar_name, race_day,
+                inputs.get('batch_size'), concurrency, limiter, retry_policy,
+                inputs.get('page_size', DEFAULT_PAGE_SIZE), inputs.get('what_if', False), estimate)
+    elif inputs.get('what_if', False):
+        num_events = 0
         for e in events:
             print("WHAT-IF: Copying event: {} (tag: {})".format(str(e), tag if tag else '<NONE>'))
+            if not e.is_empty():
+                num_events += 1
+        estimate.add_calls('insert', num_events, inputs.get('batch_size'))
     else:
-        create_events(service, events, new_calendar_id, tag)
+        # The default journal lives in the cache directory, which --no-cache leaves alone
+        journal = None
+        if 'journal' in inputs:
+            journal = EventJournal(inputs['journal'], inputs.get('resume', False))
+        elif not inputs.get('no_cache', False):
+            journal_dir = os.path.join(inputs.get('cache_dir', DEFAULT_CACHE_DIR), 'journals')
+            journal = EventJournal.for_calendar(journal_dir, new_calendar_id, inputs.get('resume', False))
+        if journal is not None and len(journal):
+            print("Resuming: {} events were already created (journal: {})".format(len(journal), journal.path))
+        writer = ApiEventWriter(service, new_calendar_id, tag, inputs.get('batch_size'), concurrency, limiter, retry_policy, journal)
+        try:
+            with METRICS.phase('insert'):
+                result['events'] = writer.write(events)
+        finally:
+            writer.close()
+    if estimate is not None:
+        result['estimate'] = estimate.to_dict(METRICS.mean('api_request_seconds'))
+        print_cost_estimate(result['estimate'])
+    return result
+
+# Clears the plan's dates in the existing calendar (see plan_overwrite). Returns the
+# calendar's id, or None & the future of the calendar that replaces it.
+def overwrite_calendar(executor, service, calendar_name, calendar_id, events, inputs, cache=None, limiter=None, retry_policy=None, estimate=None):
+    what_if = inputs.get('what_if', False)
+    with METRICS.phase('overwrite'):
+        overwrite = plan_overwrite(service, calendar_id, events, inputs.get('batch_size'),
+            inputs.get('page_size', DEFAULT_PAGE_SIZE), retry_policy)
+        print_overwrite_plan(calendar_name, overwrite, what_if)
+        if estimate is not None:
+            estimate.add('overwrite', overwrite.list_calls)
+            if overwrite.strategy == OVERWRITE_RECREATE:
+                estimate.add('overwrite', 1)
+                estimate.add('calendar_create', 1)
+            else:
+                estimate.add_calls('overwrite', len(overwrite.event_ids), overwrite.batch_size)
+        if what_if:
+            return calendar_id, None
+        if overwrite.strategy == OVERWRITE_RECREATE:
+            delete_calendar(service, calendar_id, cache, retry_policy)
+            return None, executor.submit(create_calendar, service, calendar_name, cache, retry_policy)
+        delete_events(service, overwrite.event_ids, calendar_id, overwrite.batch_size,
+            inputs.get('concurrency', 1), limiter, retry_policy)
+        return calendar_id, None
+
+def print_compression_report(events, what_if=False, file=None):
+    num_occurrences = sum(len(e) if isinstance(e, RecurringEvent) else 1 for e in events)
+    num_recurring = sum(1 for e in events if isinstance(e, RecurringEvent))
+    print("{}Compressed {} events into {} ({} recurring); compression ratio {:.1f}x".format(
+        'WHAT-IF: ' if what_if else '', num_occurrences, len(events), num_recurring,
+        num_occurrences / float(len(events)) if events else 1.0), file=file)
+
+# Where a run's reports are printed: stderr when the ICS file is written to stdout, so they
+# don't end up in it
+def get_report_file(inputs):
+    return sys.stderr if inputs.get('output_ics') == '--' else sys.stdout
+
+def write_ics(inputs, events, tag=None):
+    result = { 'calendar_id': None, 'events': 0 }
+    if inputs.get('what_if', False):
+        for e in events:
+            print("WHAT-IF: Writing event to {}: {} (tag: {})".format(inputs['output_ics'], str(e), tag if tag else '<NONE>'),
+                file=get_report_file(inputs))
+        return result
+    writer = IcsEventWriter(inputs['output_ics'], inputs['name'], tag)
+    try:
+        with METRICS.phase('write'):
+            result['events'] = writer.write(events)
+    finally:
+        writer.close()
+    if inputs['output_ics'] != '--':
+        print("Wrote {} events to {}".format(result['events'], inputs['output_ics']))
+    return result
+
+MANIFEST_COLUMN_ALIASES = {
+    'template': 'template_calendar_name',
+    'template_calendar': 'template_calendar_name',
+}
+# The fields a manifest job may set: the flags are given as true/false (or yes/no, 1/0) &
+# the counts as positive integers
+MANIFEST_FLAG_FIELDS = ['ends_on_race_day', 'sync', 'force', 'compress', 'what_if']
+MANIFEST_COUNT_FIELDS = ['batch_size', 'concurrency', 'page_size']
+MANIFEST_FIELDS = ['name', 'race_day', 'file', 'template_calendar_name', 'format', 'tag', 'column_map', 'output_ics'] + \
+    MANIFEST_FLAG_FIELDS + MANIFEST_COUNT_FIELDS
+MANIFEST_REPORT_KEYS = ['name', 'race_day', 'status', 'calendar_id', 'events', 'seconds', 'error']
+
+# Reads the jobs from a CSV or JSON (a list of objects) manifest. Each job has the same keys
+# as the inputs returned by parse_arguments; relative file paths are taken relative to the
+# manifest.
+def load_manifest(path):
+    with get_input_handle(path) as f:
+        if path.lower().endswith('.json'):
+            rows = json.load(f)
+            if not isinstance(rows, list):
+                exit_with_error('expected a list of jobs in manifest (file: {})'.format(path))
+        else:
+            rows = list(csv.DictReader(f))
+
+    base_dir = os.path.dirname(os.path.abspath(path)) if path != '--' else os.getcwd()
+    jobs = []
+    for i,row in enumerate(rows):
+        job = {}
+        for k,v in row.items():
+            if k is None or v is None or v == '':
+                continue
+            key = k.strip().lower().replace('-', '_').replace(' ', '_')
+            key = MANIFEST_COLUMN_ALIASES.get(key, key)
+            field = 'manifest entry {}: {}'.format(i+1, key)
+            if key not in MANIFEST_FIELDS:
+                exit_with_error('manifest entry {}: unknown field: {} (file: {})'.format(i+1, k, path))
+            elif key in MANIFEST_FLAG_FIELDS:
+                v = parse_manifest_flag(field, v)
+            elif key in MANIFEST_COUNT_FIELDS:
+                v = parse_positive_int(field, v)
+            elif key == 'format':
+                v = parse_source_format(v)
+            elif key == 'file' and v != '--':
+                v = os.path.join(base_dir, v)
+            job[key] = v
+        jobs.append(job)
+    return jobs
+
+def parse_manifest_flag(name, value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in ('1', 'true', 'yes', 'y'):
+        return True
+    if value in ('0', 'false', 'no', 'n'):
+        return False
+    exit_with_error('{} must be true or false (got {})'.format(name, value))
+
+# The inputs for a manifest job: its own fields over the command line's, checked as
+# parse_arguments checks the command line's.
+def get_job_inputs(inputs, job, index):
+    job_inputs = { k: v for (k,v) in inputs.items() if k not in ('manifest', 'journal', 'report') }
+    if 'file' in job or 'template_calendar_name' in job:
+        job_inputs.pop('file', None)
+        job_inputs.pop('template_calendar_name', None)
+    job_inputs.update(job)
+    for key in ('name', 'race_day'):
+        if key not in job_inputs:
+            exit_with_error('manifest entry {}: missing required field: {}'.format(index+1, key))
+    if 'file' in job_inputs and 'template_calendar_name' in job_inputs:
+        exit_with_error('manifest entry {}: exactly one of file or template_calendar_name required (got both)'.format(index+1))
+    if 'file' not in job_inputs and 'template_calendar_name' not in job_inputs:
+        exit_with_error('manifest entry {}: exactly one of file or template_calendar_name required (got neither)'.format(index+1))
+    check_inputs(job_inputs, 'manifest entry {}: '.format(index+1))
+    return job_inputs
+
+# Runs every job in the manifest, up to --jobs of them at once, sharing the service, cache
+# & rate limit between them. A failed job doesn't stop the others; a report of every
+# job's outcome is printed (& written to --report) at the end.
+def run_manifest(service, inputs, cache=None, limiter=None, retry_policy=None, plan_cache=None):
+    jobs = [get_job_inputs(inputs, job, i) for (i,job) in enumerate(load_manifest(inputs['manifest']))]
+    # Jobs run one at a time share a template through the cache the first one fills as it
+    # streams the template; jobs run at once would each stream it before that.
+    stream_template = inputs.get('jobs', 1) == 1
+
+    def run(job_inputs):
+        report = { 'name': job_inputs['name'], 'race_day': job_inputs['race_day'] }
+        start = time.monotonic()
+        try:
+            report.update(run_job(service, job_inputs, cache, limiter, retry_policy, plan_cache, stream_template))
+            report['status'] = 'ok'
+        except Exception as e:
+            report['status'] = 'failed'
+            report['error'] = e.message if isinstance(e, TrainingCalendarError) else describe_error(e)
+            print("error: job '{}' failed: {}".format(job_inputs['name'], report['error']), file=sys.stderr)
+        report['seconds'] = round(time.monotonic() - start, 2)
+        return report
+
+    reports = list(run_in_order(run, jobs, inputs.get('jobs', 1)))
+    print_table(reports, MANIFEST_REPORT_KEYS)
+    if 'report' in inputs:
+        with open(inputs['report'], 'w') as f:
+            json.dump(reports, f, indent=2)
+
+    estimated = [r for r in reports if 'estimate' in r]
+    if estimated:
+        total = add_cost_estimates(r['estimate'] for r in estimated)
+        print('WHAT-IF: Estimated cost of {} jobs: {} requests, {} quota units, {:.1f} seconds if run one after another'.format(
+            len(estimated), total['requests'], total['quota_units'], total['seconds']))
+        if 'estimate_file' in inputs:
+            write_cost_estimate({ 'jobs': [{ 'name': r['name'], 'race_day': r['race_day'], 'estimate': r['estimate'] }
+                for r in estimated], 'total': total }, inputs['estimate_file'])
+
+    failed = [r for r in reports if r['status'] != 'ok']
+    if failed:
+        exit_with_error('{} of {} jobs failed'.format(len(failed), len(reports)))
+    return reports